@@ -17,6 +17,8 @@ Notes
 """
 
 import sys
+import threading
+from contextlib import asynccontextmanager
 from datetime import datetime
 from pathlib import Path
 
@@ -27,7 +29,13 @@ from sqlmodel import select
 from database import get_session, init_db
 from models import Image, Tag
 from routes import (
+    api_analytics_histogram,
+    api_analytics_images,
+    api_analytics_summary,
     api_get_tags,
+    api_thumb_stats,
+    api_warmup_restart,
+    api_warmup_status,
     assign_tag,
     bulk_add_tag,
     bulk_delete_images,
@@ -35,6 +43,8 @@ from routes import (
     bulk_remove_tag,
     create_tag,
     dashboard,
+    deep_zoom_descriptor,
+    deep_zoom_tile,
     delete_image,
     delete_tag,
     export_execute,
@@ -45,26 +55,53 @@ from routes import (
     list_images,
     media,
     open_folder,
+    preview,
     remove_tag,
     scan_route,
     settings,
+    thumb_atlas,
+    thumb_atlas_json,
     thumbnail,
     update_tag,
 )
+from snapshot import SNAPSHOT_ENABLED, catalog_snapshot
+from tagindex import TAG_INDEX_ENABLED, run_log_pruner, tag_index
 from templates_static import ensure_assets
+from thumbpool import thumb_pool
+from warmup import WARMUP_ENABLED, warmup_job
 
 # Configuration
 APP_DIR = Path(__file__).resolve().parent
 STATIC_DIR = APP_DIR / "static"
 
-# Create FastAPI app
-app = FastAPI(title="Image Vault")
 
-# Ensure templates and static files exist
-ensure_assets()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start and stop background machinery with the server."""
+    # Here rather than at import: thumbnail pool workers re-import this module
+    ensure_assets()
+    init_db()
+    seed_default_tags()
+    if TAG_INDEX_ENABLED:
+        threading.Thread(target=tag_index.warm, name="tag-index", daemon=True).start()
+    if SNAPSHOT_ENABLED:
+        threading.Thread(target=catalog_snapshot.get, name="snapshot", daemon=True).start()
+    readers = {"tag-index": tag_index, "snapshot": catalog_snapshot}
+    threading.Thread(target=run_log_pruner, args=(readers,), name="log-pruner", daemon=True).start()
+    if WARMUP_ENABLED:
+        warmup_job.start()
+    yield
+    await warmup_job.stop()
+    thumb_pool.shutdown()
+    if SNAPSHOT_ENABLED:
+        catalog_snapshot.save()
+
 
-# Mount static files
-app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
+# Create FastAPI app
+app = FastAPI(title="Image Vault", lifespan=lifespan)
+
+# Mount static files (written by ensure_assets on startup)
+app.mount("/static", StaticFiles(directory=str(STATIC_DIR), check_dir=False), name="static")
 
 
 def seed_default_tags() -> None:
@@ -129,10 +166,6 @@ def seed_default_tags() -> None:
         s.commit()
 
 
-# Initialize database and seed tags
-init_db()
-seed_default_tags()
-
 # Routes
 app.get("/", response_class="HTMLResponse")(index)
 app.get("/dashboard", response_class="HTMLResponse")(dashboard)
@@ -158,6 +191,11 @@ app.post("/images/{image_id}/tags/remove")(remove_tag)
 app.post("/images/{image_id}/delete")(delete_image)
 app.post("/images/{image_id}/open_folder")(open_folder)
 app.get("/media/{image_id}")(media)
+app.get("/preview/{image_id}")(preview)
+app.get("/dzi/{image_id}.dzi")(deep_zoom_descriptor)
+app.get("/dzi/{image_id}_files/{level}/{tile}")(deep_zoom_tile)
+app.get("/thumb/atlas")(thumb_atlas)  # before /thumb/{image_id}
+app.get("/thumb/atlas.json")(thumb_atlas_json)
 app.get("/thumb/{image_id}")(thumbnail)
 
 # Export functionality
@@ -166,6 +204,12 @@ app.post("/export/execute")(export_execute)
 
 # API endpoints
 app.get("/api/tags")(api_get_tags)
+app.get("/api/analytics/summary")(api_analytics_summary)
+app.get("/api/analytics/histogram")(api_analytics_histogram)
+app.get("/api/analytics/images")(api_analytics_images)
+app.get("/api/thumbs/stats")(api_thumb_stats)
+app.get("/api/thumbs/warmup")(api_warmup_status)
+app.post("/api/thumbs/warmup")(api_warmup_restart)
 
 
 if __name__ == "__main__":
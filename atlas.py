@@ -0,0 +1,125 @@
+"""Per-page thumbnail atlases (CSS sprites), enabled with ``VAULT_GRID_ATLAS=1``.
+
+A listing page asks for one atlas image holding a square, center-cropped cell
+for every image on the page, instead of one ``/thumb`` request per card. The
+layout is a deterministic grid derived from the id order alone, so templates
+can compute sprite offsets without waiting for the atlas to be built.
+
+Cells are cut from the page's ordinary cached thumbnails: missing ones are
+generated in parallel on the thumbnail pool (sharing jobs with ``/thumb``),
+and composing the sheet then only decodes those small files.
+"""
+import hashlib
+import io
+import math
+import os
+from pathlib import Path
+from typing import Optional
+
+from PIL import Image as PILImage, ImageOps
+
+from thumbnails import GRID_THUMB_WIDTH, THUMB_FORMATS, THUMB_QUALITY, ensure_cached, source_hash
+from thumbstore import ThumbCache, get_thumb_store
+
+# Configuration
+ATLAS_ENABLED = os.environ.get("VAULT_GRID_ATLAS", "0") != "0"
+ATLAS_CELL = int(os.environ.get("VAULT_ATLAS_CELL", "256"))  # px, square cells
+ATLAS_MAX_IDS = 500
+# AVIF encoding of a multi-megapixel sprite is too slow to do on demand
+ATLAS_FORMATS = ("webp", "jpeg")
+ATLAS_BACKGROUND = (9, 10, 13)
+
+
+def atlas_item(image_id: int, file_hash: Optional[str], mtime: float, path: str) -> str:
+    """Signature item of one cell: the content hash, else id and disk mtime.
+
+    Like single thumbnails, the hash only counts while the file on disk is
+    the one that was hashed (see ``source_hash``).
+    """
+    try:
+        disk_mtime = os.stat(path).st_mtime
+    except OSError:
+        return f"{image_id}:-"
+    return source_hash(file_hash, mtime, disk_mtime) or f"{image_id}:{disk_mtime!r}"
+
+
+def atlas_signature(items: list[str]) -> str:
+    """Cache signature of an atlas from its ordered ``atlas_item`` values."""
+    h = hashlib.sha1(str(ATLAS_CELL).encode("ascii"))
+    for item in items:
+        h.update(f"{item};".encode("ascii"))
+    return h.hexdigest()[:20]
+
+
+def atlas_key(signature: str, fmt: str) -> str:
+    """Thumbnail-cache key of an atlas."""
+    return f"atlas_{signature}{THUMB_FORMATS[fmt][2]}"
+
+
+def atlas_cell_width(width: Optional[int], height: Optional[int]) -> int:
+    """Width of the thumbnail a cell is cut from.
+
+    The grid thumbnail, unless the image is so wide that its height would
+    fall short of a cell; then one just wide enough, so cells never upscale.
+    """
+    if not (width and height):
+        return GRID_THUMB_WIDTH
+    return max(GRID_THUMB_WIDTH, math.ceil(ATLAS_CELL * width / height))
+
+
+def atlas_layout(ids: list[int]) -> dict:
+    """Grid layout for ``ids`` in order: columns, rows and per-id cell position.
+
+    ``css`` holds ready-to-use ``background-size``/``background-position``
+    values that map one cell onto a square box of any size.
+    """
+    count = max(len(ids), 1)
+    columns = math.ceil(math.sqrt(count))
+    rows = math.ceil(count / columns)
+    cells = {}
+    for index, image_id in enumerate(ids):
+        col, row = index % columns, index // columns
+        x = col / (columns - 1) * 100 if columns > 1 else 0
+        y = row / (rows - 1) * 100 if rows > 1 else 0
+        cells[image_id] = {
+            "x": col * ATLAS_CELL,
+            "y": row * ATLAS_CELL,
+            "position": f"{x:.4f}% {y:.4f}%",
+        }
+    return {
+        "cell": ATLAS_CELL,
+        "columns": columns,
+        "rows": rows,
+        "size": f"{columns * 100}% {rows * 100}%",
+        "cells": cells,
+    }
+
+
+def render_atlas(store: ThumbCache, cell_keys: list[Optional[str]], fmt: str) -> bytes:
+    """Compose the atlas from cached cell thumbnails; ``None`` cells stay blank.
+
+    Raises ``FileNotFoundError`` if a cell thumbnail was evicted meanwhile.
+    """
+    count = max(len(cell_keys), 1)
+    columns = math.ceil(math.sqrt(count))
+    rows = math.ceil(count / columns)
+    sheet = PILImage.new("RGB", (columns * ATLAS_CELL, rows * ATLAS_CELL), ATLAS_BACKGROUND)
+    for index, key in enumerate(cell_keys):
+        if key is None:
+            continue
+        hit = store.get(key)
+        if hit is None:
+            raise FileNotFoundError(f"Cell thumbnail {key} is gone")
+        im = PILImage.open(hit if isinstance(hit, Path) else io.BytesIO(hit))
+        cell = ImageOps.fit(im.convert("RGB"), (ATLAS_CELL, ATLAS_CELL))
+        sheet.paste(cell, ((index % columns) * ATLAS_CELL, (index // columns) * ATLAS_CELL))
+    buf = io.BytesIO()
+    sheet.save(buf, format=THUMB_FORMATS[fmt][0], quality=THUMB_QUALITY[fmt])
+    return buf.getvalue()
+
+
+def generate_atlas(root: Path, key: str, cell_keys: list[Optional[str]], fmt: str) -> str:
+    """Process-pool entry point: cache the atlas under ``key``."""
+    store = get_thumb_store(root)
+    ensure_cached(store, key, 0.0, lambda: render_atlas(store, cell_keys, fmt))
+    return key
@@ -0,0 +1,56 @@
+"""Result counts for filtered image listings.
+
+Counts run as ``SELECT count(*)`` over an id-only copy of the listing query,
+stop at ``COUNT_LIMIT`` rows ("at least N" beyond that) and are cached per
+filter signature. Cache entries are tied to the catalog version, the last
+row of the change log that triggers append to on every image, link and tag
+change (see migrations), so any such change invalidates them; an age limit
+covers what the log does not record, such as tag renames seen by search.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable
+
+from sqlalchemy import func, select, text
+
+from models import Image
+
+# Configuration
+# Counting stops here and the listing shows "at least N" (0 = always exact)
+COUNT_LIMIT = int(os.environ.get("VAULT_COUNT_LIMIT", "10000"))
+COUNT_CACHE_SIZE = 256
+COUNT_CACHE_SECONDS = 300
+
+# (signature, catalog version) -> (count, exact, time), most recently used last
+_cache: "OrderedDict[tuple, tuple[int, bool, float]]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def catalog_version(session) -> int:
+    """Changes whenever an image, a tag link or a tag is added or removed."""
+    return session.execute(text("SELECT coalesce(max(seq), 0) FROM tagindex_log")).scalar()
+
+
+def count_images(session, stmt, signature: Hashable) -> tuple[int, bool]:
+    """(count, exact) for an ``Image`` query; ``signature`` identifies its filters."""
+    key = (signature, catalog_version(session))
+    now = time.monotonic()
+    with _cache_lock:
+        hit = _cache.get(key)
+        if hit and now - hit[2] < COUNT_CACHE_SECONDS:
+            _cache.move_to_end(key)
+            return hit[0], hit[1]
+    ids = stmt.with_only_columns(Image.id).order_by(None)
+    if COUNT_LIMIT:
+        ids = ids.limit(COUNT_LIMIT + 1)
+    count = session.execute(select(func.count()).select_from(ids.subquery())).scalar_one()
+    exact = not COUNT_LIMIT or count <= COUNT_LIMIT
+    count = count if exact else COUNT_LIMIT
+    with _cache_lock:
+        _cache[key] = (count, exact, now)
+        _cache.move_to_end(key)
+        while len(_cache) > COUNT_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return count, exact
@@ -1,39 +1,176 @@
 """Database configuration and utilities."""
+import os
+import threading
+import time
 from contextlib import contextmanager
 from pathlib import Path
 from typing import Optional
 
+from sqlalchemy import event, text
 from sqlmodel import Session, create_engine, select
 
+from migrations import UNSTAMPED_SETTINGS, migrate, reset_version
 from models import Setting, SQLModel
 
 # Configuration
 APP_DIR = Path(__file__).resolve().parent
-DB_PATH = APP_DIR / "image_vault.db"
+DB_PATH = Path(os.environ.get("VAULT_DB") or APP_DIR / "image_vault.db")
+# Applied to every connection
+SQLITE_PRAGMAS = {
+    "busy_timeout": 5000,  # ms to wait for a lock instead of failing at once
+    "synchronous": "NORMAL",  # durable with WAL; fsync only at checkpoints
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64 * 1024,  # negative = KiB, i.e. a 64 MB page cache
+    "temp_store": "MEMORY",
+}
+# Long-running writers (the scanner) commit at least this often
+WRITE_SLICE_SECONDS = 0.05
+# Longest a background writer defers to interactive sessions between slices
+WRITE_YIELD_SECONDS = 2.0
+# Cached settings check the version stamp for changes made by other
+# processes at most this often; changes made here are seen at once
+SETTINGS_CHECK_SECONDS = 1.0
 
-# Database engine
+
+def _apply_pragmas(dbapi_connection, read_only: bool) -> None:
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    if read_only:
+        cursor.execute("PRAGMA query_only=ON")
+    cursor.close()
+
+
+# Database engines: ``engine`` for anything that writes, ``read_engine`` for
+# pages and APIs that only read. With WAL, readers never wait for a writer.
 engine = create_engine(
     f"sqlite:///{DB_PATH}", connect_args={"check_same_thread": False}
 )
+read_engine = create_engine(
+    f"sqlite:///{DB_PATH}", connect_args={"check_same_thread": False}
+)
+
+
+@event.listens_for(engine, "connect")
+def _on_write_connect(dbapi_connection, _record):
+    # Persistent in the file; a no-op once the database is in WAL mode
+    dbapi_connection.execute("PRAGMA journal_mode=WAL")
+    _apply_pragmas(dbapi_connection, read_only=False)
+    # Let SQLAlchemy issue BEGIN itself (see _on_write_begin)
+    dbapi_connection.isolation_level = None
+
+
+@event.listens_for(engine, "begin")
+def _on_write_begin(conn):
+    # Take the write lock up front: a deferred transaction that reads first and
+    # then writes fails with SQLITE_BUSY under WAL instead of waiting
+    conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+@event.listens_for(read_engine, "connect")
+def _on_read_connect(dbapi_connection, _record):
+    _apply_pragmas(dbapi_connection, read_only=True)
+
+
+# Open interactive write sessions; background writers let them go first
+_interactive = 0
+_interactive_changed = threading.Condition()
 
 
 @contextmanager
 def get_session():
     """Get a database session context manager."""
+    global _interactive
+    with _interactive_changed:
+        _interactive += 1
+    try:
+        with Session(engine) as session:
+            yield session
+    finally:
+        with _interactive_changed:
+            _interactive -= 1
+            _interactive_changed.notify_all()
+
+
+@contextmanager
+def get_batch_session():
+    """Write session for long-running background jobs.
+
+    Such jobs commit every ``WRITE_SLICE_SECONDS`` and call
+    ``yield_to_interactive`` after each commit. SQLite's busy handler polls
+    with growing sleeps, so without that a waiting request would rarely win
+    the lock in the gap between two slices.
+    """
     with Session(engine) as session:
         yield session
 
 
+def yield_to_interactive() -> None:
+    """Wait (briefly) until no interactive write session is open."""
+    with _interactive_changed:
+        _interactive_changed.wait_for(lambda: _interactive == 0, WRITE_YIELD_SECONDS)
+
+
+@contextmanager
+def get_read_session():
+    """Get a read-only session; it never blocks or waits for writers."""
+    with Session(read_engine) as session:
+        yield session
+
+
 def init_db() -> None:
-    """Initialize database tables."""
+    """Create missing tables and apply pending schema migrations."""
     SQLModel.metadata.create_all(engine)
+    migrate(engine)
+
+
+def reset_db() -> None:
+    """Drop every table and recreate the schema from scratch."""
+    SQLModel.metadata.drop_all(engine)
+    # Triggers went with the tables; migrations must run again
+    reset_version(engine)
+    init_db()
+    _forget_settings()
+
+
+# (settings version stamp, all settings); replaced whole, never mutated
+_settings: Optional[tuple[int, dict[str, str]]] = None
+_settings_checked = 0.0
+_settings_lock = threading.Lock()
+
+
+def _forget_settings() -> None:
+    global _settings
+    # Under the lock, so a load racing with a write cannot keep its old values
+    with _settings_lock:
+        _settings = None
+
+
+def _cached_settings() -> dict[str, str]:
+    global _settings, _settings_checked
+    now = time.monotonic()
+    cached = _settings
+    if cached is not None and now - _settings_checked < SETTINGS_CHECK_SECONDS:
+        return cached[1]
+    with _settings_lock:
+        with get_read_session() as s:
+            version = s.execute(
+                text("SELECT version FROM version_stamp WHERE name = 'settings'")
+            ).scalar()
+            if _settings is None or _settings[0] != version:
+                rows = s.exec(select(Setting).where(Setting.key.not_in(UNSTAMPED_SETTINGS)))
+                _settings = (version, {row.key: row.value for row in rows})
+        _settings_checked = now
+        return _settings[1]
 
 
 def get_setting(key: str) -> Optional[str]:
-    """Get a setting value by key."""
-    with get_session() as s:
-        row = s.get(Setting, key)
-        return row.value if row else None
+    """Get a setting value by key (cached, see ``SETTINGS_CHECK_SECONDS``)."""
+    if key in UNSTAMPED_SETTINGS:
+        with get_read_session() as s:
+            row = s.get(Setting, key)
+            return row.value if row else None
+    return _cached_settings().get(key)
 
 
 def set_setting(key: str, value: str) -> None:
@@ -44,4 +181,6 @@ def set_setting(key: str, value: str) -> None:
             row.value = value
         else:
             s.add(Setting(key=key, value=value))
-        s.commit()
\ No newline at end of file
+        s.commit()
+    if key not in UNSTAMPED_SETTINGS:
+        _forget_settings()
@@ -0,0 +1,109 @@
+"""Database maintenance commands.
+
+Usage::
+
+    python maintenance.py check-counts      # report tags whose usage_count drifted
+    python maintenance.py rebuild-counts    # recompute every usage_count
+    python maintenance.py check-stats       # report dashboard statistics that drifted
+    python maintenance.py rebuild-stats     # recompute the dashboard statistics
+"""
+import argparse
+import sys
+
+from sqlalchemy import text
+
+from database import engine, init_db
+from migrations import STAT_KEYS, rebuild_stats
+
+_ACTUAL_COUNTS = """
+    SELECT tag.id, tag.name, tag.usage_count,
+           (SELECT count(*) FROM imagetaglink WHERE imagetaglink.tag_id = tag.id) AS actual
+    FROM tag
+"""
+
+
+def check_tag_counts() -> list[tuple[int, str, int, int]]:
+    """Tags whose stored usage_count differs from their links: (id, name, stored, actual)."""
+    with engine.begin() as conn:
+        return [
+            tuple(row) for row in conn.execute(text(_ACTUAL_COUNTS)) if row.usage_count != row.actual
+        ]
+
+
+def rebuild_tag_counts() -> int:
+    """Recompute every tag's usage_count from the link table; returns tags fixed."""
+    with engine.begin() as conn:
+        return conn.execute(
+            text(
+                "UPDATE tag SET usage_count = "
+                "(SELECT count(*) FROM imagetaglink WHERE imagetaglink.tag_id = tag.id) "
+                "WHERE usage_count IS NOT "
+                "(SELECT count(*) FROM imagetaglink WHERE imagetaglink.tag_id = tag.id)"
+            )
+        ).rowcount
+
+
+def check_catalog_stats() -> list[tuple[str, str, tuple[int, int], tuple[int, int]]]:
+    """Dashboard buckets whose stored (count, size) is off: (kind, key, stored, actual)."""
+    with engine.begin() as conn:
+        stored = {
+            (kind, key): (count, size)
+            for kind, key, count, size in conn.execute(
+                text("SELECT kind, key, count, size FROM catalog_stats WHERE count != 0 OR size != 0")
+            )
+        }
+        actual = {}
+        for kind, key in STAT_KEYS.items():
+            rows = conn.execute(
+                text(
+                    f"SELECT key, count(*), total(size) FROM "
+                    f"(SELECT {key.format(row='image')} AS key, size FROM image) "
+                    "WHERE key IS NOT NULL GROUP BY key"
+                )
+            )
+            actual.update({(kind, key): (count, int(size)) for key, count, size in rows})
+    return [
+        (kind, key, stored.get((kind, key), (0, 0)), actual.get((kind, key), (0, 0)))
+        for kind, key in sorted(stored.keys() | actual.keys())
+        if stored.get((kind, key)) != actual.get((kind, key))
+    ]
+
+
+def rebuild_catalog_stats() -> None:
+    """Recompute the dashboard statistics from the image table."""
+    with engine.begin() as conn:
+        rebuild_stats(conn)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Image Vault database maintenance")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("check-counts", help="report tags whose usage_count drifted")
+    commands.add_parser("rebuild-counts", help="recompute every tag usage_count")
+    commands.add_parser("check-stats", help="report dashboard statistics that drifted")
+    commands.add_parser("rebuild-stats", help="recompute the dashboard statistics")
+    args = parser.parse_args(argv)
+
+    init_db()
+    if args.command == "check-counts":
+        drifted = check_tag_counts()
+        for tag_id, name, stored, actual in drifted:
+            print(f"{name} (id {tag_id}): stored {stored}, actual {actual}")
+        print(f"{len(drifted)} tag(s) out of sync")
+        return 1 if drifted else 0
+    if args.command == "rebuild-counts":
+        print(f"Fixed {rebuild_tag_counts()} tag(s)")
+    if args.command == "check-stats":
+        drifted = check_catalog_stats()
+        for kind, key, stored, actual in drifted:
+            print(f"{kind} {key!r}: stored {stored}, actual {actual}")
+        print(f"{len(drifted)} statistic(s) out of sync")
+        return 1 if drifted else 0
+    if args.command == "rebuild-stats":
+        rebuild_catalog_stats()
+        print("Dashboard statistics rebuilt")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,411 @@
+"""Versioned schema migrations.
+
+The schema version is kept in SQLite's ``PRAGMA user_version``. ``migrate``
+applies every migration above it in order, each in its own transaction, and
+refreshes the planner statistics afterwards. Tables freshly created from the
+models are already current, so migrations must tolerate objects that exist.
+"""
+from typing import Callable
+
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import OperationalError
+
+
+def _columns(conn: Connection, table: str) -> set[str]:
+    return {row[1] for row in conn.exec_driver_sql(f'PRAGMA table_xinfo("{table}")')}
+
+
+def _add_column(conn: Connection, table: str, column: str, ddl: str) -> None:
+    """ALTER TABLE ... ADD COLUMN unless the column is already there."""
+    if column not in _columns(conn, table):
+        conn.exec_driver_sql(f'ALTER TABLE "{table}" ADD COLUMN "{column}" {ddl}')
+
+
+def _placeholder_columns(conn: Connection) -> None:
+    _add_column(conn, "image", "placeholder", "VARCHAR")
+    _add_column(conn, "image", "dominant_color", "VARCHAR")
+
+
+def _performance_indexes(conn: Connection) -> None:
+    # Tag filters and per-tag counts look links up by tag_id; the primary
+    # key (image_id, tag_id) cannot serve them
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_imagetaglink_tag_id_image_id "
+        "ON imagetaglink (tag_id, image_id)"
+    )
+    # Sort columns of the image list and the dashboard
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_image_created_at ON image (created_at)")
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_image_updated_at ON image (updated_at)")
+
+
+def _tag_usage_counts(conn: Connection) -> None:
+    _add_column(conn, "tag", "usage_count", "INTEGER NOT NULL DEFAULT 0")
+    # Keep Tag.usage_count exact on every link change, whoever makes it
+    conn.exec_driver_sql(
+        "CREATE TRIGGER IF NOT EXISTS imagetaglink_usage_insert AFTER INSERT ON imagetaglink "
+        "BEGIN UPDATE tag SET usage_count = usage_count + 1 WHERE id = NEW.tag_id; END"
+    )
+    conn.exec_driver_sql(
+        "CREATE TRIGGER IF NOT EXISTS imagetaglink_usage_delete AFTER DELETE ON imagetaglink "
+        "BEGIN UPDATE tag SET usage_count = usage_count - 1 WHERE id = OLD.tag_id; END"
+    )
+    conn.exec_driver_sql(
+        "CREATE TRIGGER IF NOT EXISTS imagetaglink_usage_update "
+        "AFTER UPDATE OF tag_id ON imagetaglink WHEN OLD.tag_id IS NOT NEW.tag_id "
+        "BEGIN "
+        "UPDATE tag SET usage_count = usage_count - 1 WHERE id = OLD.tag_id; "
+        "UPDATE tag SET usage_count = usage_count + 1 WHERE id = NEW.tag_id; "
+        "END"
+    )
+    conn.exec_driver_sql(
+        "UPDATE tag SET usage_count = "
+        "(SELECT count(*) FROM imagetaglink WHERE imagetaglink.tag_id = tag.id)"
+    )
+
+
+def _tag_index_log(conn: Connection) -> None:
+    # Change feed for the in-memory tag index (tagindex.py). image_id and
+    # tag_id set: a link; only image_id: an image; only tag_id: a deleted
+    # tag; neither: rebuild from scratch.
+    conn.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS tagindex_log ("
+        "seq INTEGER PRIMARY KEY AUTOINCREMENT, image_id INTEGER, tag_id INTEGER, "
+        "added BOOLEAN NOT NULL)"
+    )
+    for name, event, table, values in [
+        ("link_insert", "INSERT", "imagetaglink", "NEW.image_id, NEW.tag_id, 1"),
+        ("link_delete", "DELETE", "imagetaglink", "OLD.image_id, OLD.tag_id, 0"),
+        ("image_insert", "INSERT", "image", "NEW.id, NULL, 1"),
+        ("image_delete", "DELETE", "image", "OLD.id, NULL, 0"),
+        ("tag_delete", "DELETE", "tag", "NULL, OLD.id, 0"),
+    ]:
+        conn.exec_driver_sql(
+            f"CREATE TRIGGER IF NOT EXISTS tagindex_{name} AFTER {event} ON {table} BEGIN "
+            f"INSERT INTO tagindex_log (image_id, tag_id, added) VALUES ({values}); END"
+        )
+    conn.exec_driver_sql(
+        "CREATE TRIGGER IF NOT EXISTS tagindex_link_update AFTER UPDATE ON imagetaglink BEGIN "
+        "INSERT INTO tagindex_log (image_id, tag_id, added) VALUES (OLD.image_id, OLD.tag_id, 0); "
+        "INSERT INTO tagindex_log (image_id, tag_id, added) VALUES (NEW.image_id, NEW.tag_id, 1); "
+        "END"
+    )
+    # Tables may have been dropped and recreated without any log rows
+    conn.exec_driver_sql("INSERT INTO tagindex_log (image_id, tag_id, added) VALUES (NULL, NULL, 0)")
+
+
+_FTS_TAGS = (
+    "coalesce((SELECT group_concat(tag.name, ' ') FROM imagetaglink "
+    "JOIN tag ON tag.id = imagetaglink.tag_id WHERE imagetaglink.image_id = {image}), '')"
+)
+
+
+def _search_index(conn: Connection) -> None:
+    # Search falls back to LIKE when SQLite lacks FTS5 (see search.py)
+    try:
+        conn.exec_driver_sql(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS image_fts USING fts5("
+            "filename, folders, tags, tokenize = 'unicode61 remove_diacritics 2', "
+            "prefix = '2 3')"
+        )
+    except OperationalError:
+        return
+    # Default ranking: filename hits count most, then tags, then folders
+    conn.exec_driver_sql(
+        "INSERT INTO image_fts (image_fts, rank) VALUES ('rank', 'bm25(10.0, 2.0, 5.0)')"
+    )
+    for name, event, table, body in [
+        (
+            "image_insert", "INSERT", "image",
+            "INSERT INTO image_fts (rowid, filename, folders, tags) "
+            f"VALUES (NEW.id, NEW.filename, NEW.dirpath, {_FTS_TAGS.format(image='NEW.id')});",
+        ),
+        (
+            "image_update", "UPDATE OF filename, dirpath", "image",
+            "UPDATE image_fts SET filename = NEW.filename, folders = NEW.dirpath "
+            "WHERE rowid = NEW.id;",
+        ),
+        ("image_delete", "DELETE", "image", "DELETE FROM image_fts WHERE rowid = OLD.id;"),
+        (
+            "link_insert", "INSERT", "imagetaglink",
+            f"UPDATE image_fts SET tags = {_FTS_TAGS.format(image='NEW.image_id')} WHERE rowid = NEW.image_id;",
+        ),
+        (
+            "link_delete", "DELETE", "imagetaglink",
+            f"UPDATE image_fts SET tags = {_FTS_TAGS.format(image='OLD.image_id')} WHERE rowid = OLD.image_id;",
+        ),
+        (
+            "tag_rename", "UPDATE OF name", "tag",
+            f"UPDATE image_fts SET tags = {_FTS_TAGS.format(image='image_fts.rowid')} "
+            "WHERE rowid IN (SELECT image_id FROM imagetaglink WHERE tag_id = NEW.id);",
+        ),
+        (
+            "tag_delete", "DELETE", "tag",
+            f"UPDATE image_fts SET tags = {_FTS_TAGS.format(image='image_fts.rowid')} "
+            "WHERE rowid IN (SELECT image_id FROM imagetaglink WHERE tag_id = OLD.id);",
+        ),
+    ]:
+        conn.exec_driver_sql(
+            f"CREATE TRIGGER IF NOT EXISTS image_fts_{name} AFTER {event} ON {table} "
+            f"BEGIN {body} END"
+        )
+    # The virtual table outlives a reset of the model tables
+    conn.exec_driver_sql("DELETE FROM image_fts")
+    conn.exec_driver_sql(
+        "INSERT INTO image_fts (rowid, filename, folders, tags) "
+        f"SELECT id, filename, dirpath, {_FTS_TAGS.format(image='image.id')} FROM image"
+    )
+
+
+# Folders are indexed below the vault root, so segments of the root itself
+# ("home", the user name, "Vault") do not match every image
+_FTS_ROOT = "rtrim(coalesce((SELECT value FROM setting WHERE key = 'root_dir'), ''), '/\\')"
+_FTS_FOLDERS = (
+    "CASE WHEN {dir} = {root} THEN '' "
+    "WHEN {root} <> '' "
+    "AND substr({dir}, 1, length({root}) + 1) IN ({root} || '/', {root} || '\\') "
+    "THEN substr({dir}, length({root}) + 2) ELSE {dir} END"
+)
+
+
+def _search_relative_folders(conn: Connection) -> None:
+    if not conn.exec_driver_sql("SELECT 1 FROM sqlite_master WHERE name = 'image_fts'").first():
+        return
+    new_folders = _FTS_FOLDERS.format(dir="NEW.dirpath", root=_FTS_ROOT)
+    row_folders = (
+        "(SELECT " + _FTS_FOLDERS.format(dir="dirpath", root=_FTS_ROOT)
+        + " FROM image WHERE image.id = image_fts.rowid)"
+    )
+    conn.exec_driver_sql("DROP TRIGGER IF EXISTS image_fts_image_insert")
+    conn.exec_driver_sql("DROP TRIGGER IF EXISTS image_fts_image_update")
+    conn.exec_driver_sql(
+        "CREATE TRIGGER image_fts_image_insert AFTER INSERT ON image BEGIN "
+        "INSERT INTO image_fts (rowid, filename, folders, tags) "
+        f"VALUES (NEW.id, NEW.filename, {new_folders}, {_FTS_TAGS.format(image='NEW.id')}); END"
+    )
+    conn.exec_driver_sql(
+        "CREATE TRIGGER image_fts_image_update AFTER UPDATE OF filename, dirpath ON image BEGIN "
+        f"UPDATE image_fts SET filename = NEW.filename, folders = {new_folders} "
+        "WHERE rowid = NEW.id; END"
+    )
+    # A new root changes every relative folder
+    for name in ("insert", "update"):
+        conn.exec_driver_sql(
+            f"CREATE TRIGGER IF NOT EXISTS image_fts_root_{name} AFTER {name.upper()} ON setting "
+            f"WHEN NEW.key = 'root_dir' BEGIN UPDATE image_fts SET folders = {row_folders}; END"
+        )
+    conn.exec_driver_sql(f"UPDATE image_fts SET folders = {row_folders}")
+
+
+def _sort_columns(conn: Connection) -> None:
+    # Virtual generated columns may be added to an existing table
+    _add_column(conn, "image", "pixels", "INTEGER GENERATED ALWAYS AS (width * height)")
+    _add_column(
+        conn,
+        "image",
+        "aspect",
+        "FLOAT GENERATED ALWAYS AS "
+        "(CASE WHEN height > 0 THEN CAST(width AS REAL) / height ELSE 0 END)",
+    )
+    # Every index also holds the rowid, so (key, id) keyset seeks are index-only
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_image_filename_nocase ON image (filename COLLATE NOCASE)"
+    )
+    for column in ("size", "pixels", "aspect"):
+        conn.exec_driver_sql(f"CREATE INDEX IF NOT EXISTS ix_image_{column} ON image ({column})")
+
+
+def _version_stamps(conn: Connection) -> None:
+    # Counters bumped by triggers; in-process caches compare them to know
+    # when to reload (see tagcatalog.py)
+    conn.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS version_stamp ("
+        "name VARCHAR PRIMARY KEY, version INTEGER NOT NULL DEFAULT 0)"
+    )
+    conn.exec_driver_sql("INSERT OR IGNORE INTO version_stamp (name) VALUES ('tags')")
+    # usage_count is left out: it changes with every link
+    for name, event in [
+        ("insert", "INSERT"),
+        ("update", "UPDATE OF name, color, description"),
+        ("delete", "DELETE"),
+    ]:
+        conn.exec_driver_sql(
+            f"CREATE TRIGGER IF NOT EXISTS version_stamp_tag_{name} AFTER {event} ON tag BEGIN "
+            "UPDATE version_stamp SET version = version + 1 WHERE name = 'tags'; END"
+        )
+    # Tables dropped by a reset took their rows with them without any trigger
+    conn.exec_driver_sql("UPDATE version_stamp SET version = version + 1")
+
+
+def _settings_stamp(conn: Connection) -> None:
+    # Lets every worker's settings cache notice writes made by the others
+    conn.exec_driver_sql("INSERT OR IGNORE INTO version_stamp (name) VALUES ('settings')")
+    for name in ("insert", "update", "delete"):
+        conn.exec_driver_sql(
+            f"CREATE TRIGGER IF NOT EXISTS version_stamp_setting_{name} AFTER {name.upper()} "
+            "ON setting BEGIN "
+            "UPDATE version_stamp SET version = version + 1 WHERE name = 'settings'; END"
+        )
+    conn.exec_driver_sql("UPDATE version_stamp SET version = version + 1 WHERE name = 'settings'")
+
+
+# Settings written often and read rarely (job progress). Writing them does
+# not bump the settings stamp and the settings cache leaves them out.
+# Changing this list needs a migration that recreates the triggers.
+UNSTAMPED_SETTINGS = ("warmup_cursor",)
+
+
+def _unstamped_settings(conn: Connection) -> None:
+    keys = ", ".join(f"'{key}'" for key in UNSTAMPED_SETTINGS)
+    for name, row in (("insert", "NEW"), ("update", "NEW"), ("delete", "OLD")):
+        conn.exec_driver_sql(f"DROP TRIGGER IF EXISTS version_stamp_setting_{name}")
+        conn.exec_driver_sql(
+            f"CREATE TRIGGER version_stamp_setting_{name} AFTER {name.upper()} ON setting "
+            f"WHEN {row}.key NOT IN ({keys}) BEGIN "
+            "UPDATE version_stamp SET version = version + 1 WHERE name = 'settings'; END"
+        )
+
+
+def _tagindex_readers(conn: Connection) -> None:
+    # How far each in-memory log reader got; the log is pruned below the
+    # lowest live position (see tagindex.prune_log)
+    conn.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS tagindex_reader ("
+        "name VARCHAR PRIMARY KEY, seq INTEGER NOT NULL, seen_at REAL NOT NULL)"
+    )
+
+
+def _image_log_index(conn: Connection) -> None:
+    # The newest image row (or rebuild marker) in the log, without walking
+    # past tag link rows; read by resolver.PathResolver
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_tagindex_log_images ON tagindex_log (seq) "
+        "WHERE tag_id IS NULL"
+    )
+
+
+# Dashboard breakdowns kept in catalog_stats: kind -> SQL for the bucket key
+# of an image row, referenced as {row}. A NULL key leaves the image out.
+_DIR = "replace({row}.dirpath, '\\', '/')"
+_EXT_START = "length(rtrim({row}.filename, replace({row}.filename, '.', '')))"
+STAT_KEYS = {
+    "total": "''",
+    # Last path segment, like Path(dirpath).name
+    "directory": (
+        f"coalesce(nullif(substr({_DIR}, length(rtrim({_DIR}, replace({_DIR}, '/', ''))) + 1), ''), "
+        "'Root')"
+    ),
+    "resolution": (
+        "CASE WHEN {row}.width <= 0 OR {row}.height <= 0 THEN NULL "
+        "WHEN {row}.width * {row}.height >= 3840 * 2160 THEN '4K+ (3840×2160+)' "
+        "WHEN {row}.width * {row}.height >= 2560 * 1440 THEN 'QHD (2560×1440+)' "
+        "WHEN {row}.width * {row}.height >= 1920 * 1080 THEN 'FHD (1920×1080+)' "
+        "WHEN {row}.width * {row}.height >= 1280 * 720 THEN 'HD (1280×720+)' "
+        "ELSE 'SD (<1280×720)' END"
+    ),
+    # Lower-cased suffix, like Path(filename).suffix.lower()
+    "format": (
+        f"CASE WHEN {_EXT_START} <= 1 OR {_EXT_START} = length({{row}}.filename) THEN '' "
+        f"ELSE lower(substr({{row}}.filename, {_EXT_START})) END"
+    ),
+    "size_range": (
+        "CASE WHEN {row}.size < 1048576 THEN '< 1MB' "
+        "WHEN {row}.size < 5 * 1048576 THEN '1-5MB' "
+        "WHEN {row}.size < 10 * 1048576 THEN '5-10MB' "
+        "WHEN {row}.size < 50 * 1048576 THEN '10-50MB' "
+        "ELSE '> 50MB' END"
+    ),
+}
+
+
+def _stats_add(row: str, sign: str) -> str:
+    """Statements adding (sign "+") or removing ("-") image ``row`` in every bucket."""
+    return "".join(
+        "INSERT INTO catalog_stats (kind, key, count, size) "
+        f"SELECT '{kind}', key, {sign}1, {sign}{row}.size "
+        f"FROM (SELECT {key.format(row=row)} AS key) WHERE key IS NOT NULL "
+        "ON CONFLICT (kind, key) DO UPDATE SET "
+        "count = count + excluded.count, size = size + excluded.size; "
+        for kind, key in STAT_KEYS.items()
+    )
+
+
+def rebuild_stats(conn: Connection) -> None:
+    """Recompute catalog_stats from the image table."""
+    conn.exec_driver_sql("DELETE FROM catalog_stats")
+    for kind, key in STAT_KEYS.items():
+        conn.exec_driver_sql(
+            "INSERT INTO catalog_stats (kind, key, count, size) "
+            f"SELECT '{kind}', key, count(*), total(size) FROM "
+            f"(SELECT {key.format(row='image')} AS key, size FROM image) "
+            "WHERE key IS NOT NULL GROUP BY key"
+        )
+
+
+def _catalog_stats(conn: Connection) -> None:
+    conn.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS catalog_stats ("
+        "kind VARCHAR NOT NULL, key VARCHAR NOT NULL, "
+        "count INTEGER NOT NULL DEFAULT 0, size INTEGER NOT NULL DEFAULT 0, "
+        "PRIMARY KEY (kind, key))"
+    )
+    for name, event, body in [
+        ("insert", "INSERT", _stats_add("NEW", "+")),
+        ("delete", "DELETE", _stats_add("OLD", "-")),
+        (
+            "update",
+            "UPDATE OF filename, dirpath, size, width, height",
+            _stats_add("OLD", "-") + _stats_add("NEW", "+"),
+        ),
+    ]:
+        conn.exec_driver_sql(
+            f"CREATE TRIGGER IF NOT EXISTS catalog_stats_{name} AFTER {event} ON image "
+            f"BEGIN {body}END"
+        )
+    rebuild_stats(conn)
+
+
+# (version, description, migration); append only, never renumber
+MIGRATIONS: list[tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "image placeholder and dominant color", _placeholder_columns),
+    (2, "reverse tag link index and sort-column indexes", _performance_indexes),
+    (3, "trigger-maintained tag usage counts", _tag_usage_counts),
+    (4, "change log for the in-memory tag index", _tag_index_log),
+    (5, "FTS5 search over filenames, folders and tags", _search_index),
+    (6, "generated sort columns and keyset pagination indexes", _sort_columns),
+    (7, "version stamps for in-process caches", _version_stamps),
+    (8, "trigger-maintained dashboard statistics", _catalog_stats),
+    (9, "version stamp for the settings cache", _settings_stamp),
+    (10, "reader positions for change log pruning", _tagindex_readers),
+    (11, "search folders relative to the vault root", _search_relative_folders),
+    (12, "settings stamp ignores job progress keys", _unstamped_settings),
+    (13, "change log index over image rows", _image_log_index),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn: Connection) -> int:
+    """Version recorded in the database file."""
+    return conn.exec_driver_sql("PRAGMA user_version").scalar()
+
+
+def reset_version(engine: Engine) -> None:
+    """Forget the recorded version, e.g. after dropping all tables."""
+    with engine.begin() as conn:
+        conn.exec_driver_sql("PRAGMA user_version = 0")
+
+
+def migrate(engine: Engine) -> list[int]:
+    """Bring the database up to ``SCHEMA_VERSION``; returns the versions applied."""
+    applied = []
+    for version, _, apply in MIGRATIONS:
+        with engine.begin() as conn:
+            if schema_version(conn) >= version:
+                continue
+            apply(conn)
+            conn.exec_driver_sql(f"PRAGMA user_version = {version}")
+        applied.append(version)
+    if applied:
+        with engine.begin() as conn:
+            conn.exec_driver_sql("ANALYZE")
+    return applied
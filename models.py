@@ -2,11 +2,15 @@
 from datetime import datetime
 from typing import Optional
 
+from sqlalchemy import Column, Computed, Float, Index, Integer, text
 from sqlmodel import Field, Relationship, SQLModel
 
 
 class ImageTagLink(SQLModel, table=True):
     """Link table for many-to-many relationship between images and tags."""
+    # Reverse of the primary key, for lookups by tag (see migrations.py)
+    __table_args__ = (Index("ix_imagetaglink_tag_id_image_id", "tag_id", "image_id"),)
+
     image_id: Optional[int] = Field(
         default=None, foreign_key="image.id", primary_key=True
     )
@@ -19,10 +23,25 @@ class Tag(SQLModel, table=True):
     name: str = Field(index=True, unique=True)
     color: Optional[str] = None
     description: Optional[str] = None
+    # Number of linked images, kept exact by triggers (see migrations.py)
+    usage_count: int = Field(default=0)
+
+    # Read-only: links are written through ImageTagLink
+    images: list["Image"] = Relationship(
+        back_populates="tags", link_model=ImageTagLink, sa_relationship_kwargs={"viewonly": True}
+    )
 
 
 class Image(SQLModel, table=True):
     """Image model representing files in the vault."""
+    # Sort keys of the image list; the primary key breaks ties (see pagination.py)
+    __table_args__ = (
+        Index("ix_image_filename_nocase", text("filename COLLATE NOCASE")),
+        Index("ix_image_size", "size"),
+        Index("ix_image_pixels", "pixels"),
+        Index("ix_image_aspect", "aspect"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     path: str = Field(index=True, unique=True, description="Absolute path")
     filename: str = Field(index=True)
@@ -32,8 +51,27 @@ class Image(SQLModel, table=True):
     height: int = 0
     mtime: float = 0.0
     file_hash: Optional[str] = Field(default=None, index=True)
-    created_at: datetime = Field(default_factory=datetime.utcnow)
-    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    placeholder: Optional[str] = Field(default=None, description="Tiny blurred preview as a data URI")
+    dominant_color: Optional[str] = Field(default=None, description="Hex color, e.g. #1f2a3b")
+    created_at: datetime = Field(default_factory=datetime.utcnow, index=True)
+    updated_at: datetime = Field(default_factory=datetime.utcnow, index=True)
+    # Computed by SQLite from width and height
+    pixels: Optional[int] = Field(
+        default=None, sa_column=Column(Integer, Computed("width * height"))
+    )
+    aspect: Optional[float] = Field(
+        default=None,
+        sa_column=Column(
+            Float, Computed("CASE WHEN height > 0 THEN CAST(width AS REAL) / height ELSE 0 END")
+        ),
+    )
+
+    # Read-only, like Tag.images; eager-load with selectinload(Image.tags)
+    tags: list[Tag] = Relationship(
+        back_populates="images",
+        link_model=ImageTagLink,
+        sa_relationship_kwargs={"viewonly": True, "order_by": "Tag.name"},
+    )
 
 
 class Setting(SQLModel, table=True):
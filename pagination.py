@@ -0,0 +1,131 @@
+"""Keyset (cursor) pagination for the image list.
+
+Pages are fetched with ``WHERE (key, id) < (last key, last id)`` instead of
+an OFFSET, so every page costs one index seek however deep it is. Each sort
+key has an index (see models); the id breaks ties, which keeps the order
+total and stable. Cursors are opaque URL-safe tokens holding the key and id
+of the row a page starts after (or ends before).
+
+Search results ordered by relevance page the same way on their bm25 rank;
+the rank has no index, but deep pages skip their predecessors in the sort
+instead of fetching and dropping every earlier row.
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Any, NamedTuple, Optional
+
+from sqlalchemy import DateTime, collate, literal, tuple_
+
+from models import Image
+from search import fts_rank
+
+
+class Sort(NamedTuple):
+    label: str
+    column: Any  # indexed column
+    descending: bool  # default direction
+    collation: Optional[str] = None  # of the index, if not the default
+
+    @property
+    def key(self):
+        """ORDER BY expression matching the index."""
+        return collate(self.column, self.collation) if self.collation else self.column
+
+    def bound(self, value):
+        """Cursor value to compare the column with."""
+        value = literal(value, self.column.type)
+        # An explicit collation on the right-hand side still lets SQLite seek
+        # the index; on the column it would scan it
+        return collate(value, self.collation) if self.collation else value
+
+
+SORTS = {
+    "updated": Sort("Recently updated", Image.updated_at, True),
+    "created": Sort("Recently added", Image.created_at, True),
+    "name": Sort("Name", Image.filename, False, collation="NOCASE"),
+    "size": Sort("File size", Image.size, True),
+    "pixels": Sort("Pixel count", Image.pixels, True),
+    "aspect": Sort("Aspect ratio", Image.aspect, True),
+}
+DEFAULT_SORT = "updated"
+# Search results only (the query must be a search.searches_fts one); the key
+# is the negated bm25 rank, so the most relevant come first when descending
+RELEVANCE = "relevance"
+RELEVANCE_SORT = Sort("Relevance", (-fts_rank).label("relevance"), True)
+
+
+def sort_spec(sort: str) -> Sort:
+    """The ``Sort`` of a sort name (one of ``SORTS`` or ``RELEVANCE``)."""
+    return RELEVANCE_SORT if sort == RELEVANCE else SORTS[sort]
+
+
+class Page(NamedTuple):
+    images: list[Image]
+    prev_cursor: Optional[str]  # None on the first page
+    next_cursor: Optional[str]  # None on the last page
+
+
+def encode_cursor(value: Any, image_id: int) -> str:
+    """Cursor pointing at the row with sort key ``value`` and id ``image_id``."""
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([value, image_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(sort: str, cursor: str) -> tuple[Any, int]:
+    """(key value, id) from a cursor; ValueError if it is malformed."""
+    try:
+        value, image_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if isinstance(sort_spec(sort).column.type, DateTime):
+            value = datetime.fromisoformat(value)
+        elif not isinstance(value, (str, int, float)):
+            raise ValueError(value)
+        return value, int(image_id)
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def keyset_page(
+    session,
+    stmt,
+    sort: str,
+    descending: bool,
+    limit: int,
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+) -> Page:
+    """One page of ``stmt`` with the cursors of its neighbours.
+
+    ``after`` continues past a cursor, ``before`` goes back from one; neither
+    gives the first page.
+    """
+    spec = sort_spec(sort)
+    backwards = before is not None
+    # Walking back means reading the opposite direction, then flipping the page
+    desc = descending != backwards
+    cursor = before if backwards else after
+    row = tuple_(spec.column, Image.id)
+    if cursor is not None:
+        value, image_id = decode_cursor(sort, cursor)
+        bound = tuple_(spec.bound(value), literal(image_id))
+        stmt = stmt.where(row < bound if desc else row > bound)
+    if desc:
+        stmt = stmt.order_by(spec.key.desc(), Image.id.desc())
+    else:
+        stmt = stmt.order_by(spec.key, Image.id)
+    # The key goes along with each image: relevance is not an Image column
+    rows = list(session.execute(stmt.add_columns(spec.column).limit(limit + 1)).all())
+    more = len(rows) > limit
+    del rows[limit:]
+    if backwards:
+        rows.reverse()
+        has_prev, has_next = more, True
+    else:
+        has_prev, has_next = after is not None, more
+    return Page(
+        [image for image, _ in rows],
+        encode_cursor(rows[0][1], rows[0][0].id) if rows and has_prev else None,
+        encode_cursor(rows[-1][1], rows[-1][0].id) if rows and has_next else None,
+    )
@@ -0,0 +1,124 @@
+"""Cached image id -> file lookups for the media and derivative routes.
+
+Thumbnails, previews and originals are requested by id, hundreds per page.
+Resolving one means loading the ``Image`` row and checking its path against
+the vault root; both are kept in a bounded LRU so warm requests only stat
+the file. Scans and deletes in this process clear entries directly; changes
+made by other workers show up in the image rows of the change log and the
+newest ``updated_at``, checked at most once per ``RESOLVER_CHECK_SECONDS``.
+Tag link changes do not move files, so they leave the cache alone.
+"""
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Iterable, NamedTuple, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import text
+
+from database import get_read_session
+from models import Image
+from utils import resolve_under_root
+
+# Configuration
+RESOLVER_SIZE = 8192
+RESOLVER_CHECK_SECONDS = 1.0
+
+
+class ResolvedImage(NamedTuple):
+    root: Path
+    path: Path  # real path, checked to be under root
+    file_hash: Optional[str]  # as catalogued
+    mtime: float  # catalogued mtime the hash belongs to
+
+
+class PathResolver:
+    """Bounded LRU of ``ResolvedImage`` by image id, for one vault root."""
+
+    def __init__(self, size: int = RESOLVER_SIZE):
+        self.size = size
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[int, ResolvedImage]" = OrderedDict()
+        self._root: Optional[Path] = None
+        self._version = None
+        self._checked = 0.0
+        # Bumped by every invalidation; a lookup that raced one is not cached
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _check(self, session) -> None:
+        """Drop everything if images changed elsewhere since the last check."""
+        now = time.monotonic()
+        if now - self._checked < RESOLVER_CHECK_SECONDS:
+            return
+        version = tuple(
+            session.execute(
+                text(
+                    "SELECT (SELECT coalesce(max(seq), 0) FROM tagindex_log WHERE tag_id IS NULL), "
+                    "(SELECT max(updated_at) FROM image)"
+                )
+            ).one()
+        )
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._generation += 1
+                self._version = version
+            self._checked = now
+
+    def resolve(self, root: Path, image_id: int) -> ResolvedImage:
+        """The file of an image; HTTPException 404 if it is not catalogued."""
+        with self._lock:
+            if root != self._root:
+                self._entries.clear()
+                self._generation += 1
+                self._root = root
+            fresh = time.monotonic() - self._checked < RESOLVER_CHECK_SECONDS
+            entry = self._entries.get(image_id) if fresh else None
+            if entry is not None:
+                self._entries.move_to_end(image_id)
+                self.hits += 1
+                return entry
+        with get_read_session() as s:
+            self._check(s)
+            with self._lock:
+                entry = self._entries.get(image_id)
+                if entry is not None:
+                    self._entries.move_to_end(image_id)
+                    self.hits += 1
+                    return entry
+                generation = self._generation
+            img = s.get(Image, image_id)
+            if not img:
+                raise HTTPException(404, "Not found")
+        entry = ResolvedImage(
+            root, resolve_under_root(root, Path(img.path)), img.file_hash, img.mtime
+        )
+        with self._lock:
+            self.misses += 1
+            if generation == self._generation:
+                self._entries[image_id] = entry
+                while len(self._entries) > self.size:
+                    self._entries.popitem(last=False)
+        return entry
+
+    def forget(self, image_ids: Iterable[int]) -> None:
+        """Drop the entries of deleted or rescanned images."""
+        with self._lock:
+            for image_id in image_ids:
+                self._entries.pop(image_id, None)
+            self._generation += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+
+
+path_resolver = PathResolver()
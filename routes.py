@@ -1,26 +1,85 @@
 """FastAPI routes for Image Vault."""
+import asyncio
 import shutil
-from datetime import datetime
+import time
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from typing import Optional
+from typing import Any, Callable, Optional, Union
 
 from fastapi import Form, HTTPException, Query, Request
 from typing import List as ListType
-from fastapi.responses import FileResponse, HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, Response
+from anyio import from_thread
+from fastapi.concurrency import run_in_threadpool
 from jinja2 import Environment, FileSystemLoader, select_autoescape
-from PIL import Image as PILImage, ImageOps
 from sqlmodel import select
 from sqlalchemy import text, func
+from sqlalchemy.orm import selectinload
 
-from database import get_session, get_setting, set_setting, engine
-from models import Image, ImageTagLink, Tag, SQLModel
-from scanner import scan, DEFAULT_THUMB_DIRNAME
-from utils import resolve_under_root
+from counts import count_images
+from database import get_read_session, get_session, get_setting, set_setting
+from models import Image, ImageTagLink, Tag
+from atlas import (
+    ATLAS_ENABLED,
+    ATLAS_FORMATS,
+    ATLAS_MAX_IDS,
+    atlas_cell_width,
+    atlas_item,
+    atlas_key,
+    atlas_layout,
+    atlas_signature,
+    generate_atlas,
+)
+from pagination import DEFAULT_SORT, RELEVANCE, SORTS, keyset_page, sort_spec
+from scanner import scan
+from tagcatalog import load_image_tags, tag_catalog, tag_named, tags_by_name
+from resolver import path_resolver
+from search import search, searches_fts
+from snapshot import (
+    FIELDS,
+    SNAPSHOT_ENABLED,
+    catalog_snapshot,
+    filter_mask,
+    histogram as snapshot_histogram,
+    newest_ids,
+    summary as snapshot_summary,
+)
+from tagindex import TAG_INDEX_ENABLED, restrict, tag_index
+from thumbnails import (
+    GRID_THUMB_WIDTH,
+    PREVIEW_FORMATS,
+    PREVIEW_SIZE,
+    THUMB_FORMATS,
+    generate_preview,
+    generate_thumbnail,
+    media_type_for,
+    negotiate_format,
+    preview_variant,
+    purge_thumbnails,
+    source_hash,
+    thumb_variant,
+)
+from thumbpool import THUMB_RETRY_AFTER, ClientGone, QueueFull, thumb_pool
+from thumbstore import ThumbHit, get_thumb_store
+from tiles import (
+    TILE_FORMAT,
+    deep_zoom_available,
+    dzi_descriptor,
+    generate_tile,
+    max_level,
+    tile_grid,
+    tile_variant,
+)
+from utils import proxy_sends_files, resolve_under_root, send_file
+from warmup import warmup_job
 
 # Configuration
 APP_DIR = Path(__file__).resolve().parent
 TEMPLATES_DIR = APP_DIR / "templates"
 PAGE_SIZE_DEFAULT = 100
+# One-click tag buttons on image cards and the detail page
+QUICK_TAGS = ["Needs inpainting", "Ready for i2v", "Ready for upscale"]
+VIEW_COOKIE = "vault_view"
 
 # Jinja environment
 jinja_env = Environment(
@@ -62,7 +121,7 @@ def render(name: str, **ctx) -> HTMLResponse:
     template = jinja_env.get_template(name)
 
     # helpers
-    def pager_url(page: int) -> str:
+    def pager_url(page: int, after: Optional[str] = None, before: Optional[str] = None) -> str:
         params = []
         if ctx.get("q"):
             params.append(f"q={ctx['q']}")
@@ -74,12 +133,25 @@ def render(name: str, **ctx) -> HTMLResponse:
             params.append(f"exclude_tags={ctx['exclude_tags']}")
         if ctx.get("page_size") and ctx.get("page_size") != PAGE_SIZE_DEFAULT:
             params.append(f"page_size={ctx['page_size']}")
+        default_sort = RELEVANCE if ctx.get("ranked") else DEFAULT_SORT
+        if ctx.get("sort") and ctx["sort"] != default_sort:
+            params.append(f"sort={ctx['sort']}")
+        if ctx.get("explicit_order"):
+            params.append(f"order={ctx['explicit_order']}")
+        if after:
+            params.append(f"after={after}")
+        if before:
+            params.append(f"before={before}")
         params.append(f"page={page}")
         return f"/images?{'&'.join(params)}"
 
     ctx.setdefault("title", "Image Vault")
     ctx.setdefault("pager_url", pager_url)
-    return HTMLResponse(template.render(**ctx))
+    response = HTMLResponse(template.render(**ctx))
+    # Page view id: thumbnails requested after the newest page view are
+    # generated first. A cookie keeps thumbnail URLs stable for browser caching.
+    response.set_cookie(VIEW_COOKIE, str(int(time.time() * 1000)), samesite="lax")
+    return response
 
 
 def index():
@@ -109,9 +181,8 @@ def scan_route(
     # Reset database if requested
     if reset_db:
         # Drop and recreate all tables - this is the cleanest approach
-        from database import init_db
-        SQLModel.metadata.drop_all(engine)
-        SQLModel.metadata.create_all(engine)
+        from database import reset_db
+        reset_db()
         # Reinitialize with default tags
         from app import seed_default_tags
         seed_default_tags()
@@ -120,7 +191,10 @@ def scan_route(
     set_setting("root_dir", root_dir)
     
     stats = scan(Path(root_dir), cleanup=bool(cleanup), auto_tag=bool(auto_tag))
+    path_resolver.clear()
     set_setting("last_scan", str(datetime.utcnow().timestamp()))
+    # New images sort first in the warm-up order; start it over
+    from_thread.run_sync(warmup_job.restart)
     
     auto_tag_msg = "+auto-tagged" if auto_tag else ""
     reset_msg = "+database-reset" if reset_db else ""
@@ -133,16 +207,9 @@ def scan_route(
 
 def get_tags():
     """Get all tags."""
-    with get_session() as s:
+    with get_read_session() as s:
         tags = s.exec(select(Tag).order_by(Tag.name)).all()
-        # Add image count to each tag manually
-        tag_counts = {}
-        for tag in tags:
-            count = len(s.exec(
-                select(ImageTagLink).where(ImageTagLink.tag_id == tag.id)
-            ).all())
-            tag_counts[tag.id] = count
-    return render("tags.html", title="Tags", tags=tags, tag_counts=tag_counts)
+    return render("tags.html", title="Tags", tags=tags)
 
 
 def create_tag(
@@ -211,78 +278,110 @@ def list_images(
     exclude_tags: Optional[str] = Query(None),  # Comma-separated excluded tags
     page: int = Query(1, ge=1),
     page_size: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=500),
+    sort: Optional[str] = Query(None),
+    order: Optional[str] = Query(None),
+    after: Optional[str] = Query(None),  # keyset cursors, see pagination.py
+    before: Optional[str] = Query(None),
 ):
     """List images with optional filtering."""
     tags_param = tags  # Store the query parameter to avoid variable name confusion
-    with get_session() as s:
-        stmt = select(Image).order_by(Image.updated_at.desc())
+    # Search results default to relevance order, when the search can rank them
+    ranked = bool(q) and searches_fts(q)
+    if not sort or (sort == RELEVANCE and not ranked):
+        sort = RELEVANCE if ranked else DEFAULT_SORT
+    if sort != RELEVANCE and sort not in SORTS:
+        raise HTTPException(400, f"Unknown sort: {sort}")
+    if order not in (None, "asc", "desc"):
+        raise HTTPException(400, f"Unknown order: {order}")
+    descending = order == "desc" if order else sort_spec(sort).descending
+    with get_read_session() as s:
+        stmt = select(Image)
         if q:
-            stmt = stmt.where(Image.filename.contains(q))
-        
-        # Handle single tag (for backward compatibility)
-        if tag:
-            t = s.exec(select(Tag).where(Tag.name == tag)).first()
-            if t:
-                # join via link table
-                stmt = stmt.join(ImageTagLink, Image.id == ImageTagLink.image_id).where(
-                    ImageTagLink.tag_id == t.id
-                )
+            stmt = search(stmt, q)
         
-        # Handle multiple tags
-        if tags_param:
-            tag_names = [t.strip() for t in tags_param.split(',') if t.strip()]
-            if tag_names:
-                # Get tag IDs for all selected tags
-                tag_ids = []
-                for tag_name in tag_names:
-                    t = s.exec(select(Tag).where(Tag.name == tag_name)).first()
-                    if t:
-                        tag_ids.append(t.id)
-                
-                if tag_ids:
-                    # Find images that have ALL the specified tags
-                    subquery = (
-                        select(ImageTagLink.image_id)
-                        .where(ImageTagLink.tag_id.in_(tag_ids))
-                        .group_by(ImageTagLink.image_id)
-                        .having(func.count(ImageTagLink.tag_id) == len(tag_ids))
-                    )
-                    stmt = stmt.where(Image.id.in_(subquery))
-        
-        # Handle tag exclusions
-        if exclude_tags:
-            exclude_tag_names = [t.strip() for t in exclude_tags.split(',') if t.strip()]
-            for tag_name in exclude_tag_names:
-                t = s.exec(select(Tag).where(Tag.name == tag_name)).first()
+        total = None
+        if TAG_INDEX_ENABLED and (tag or tags_param or exclude_tags):
+            # Tag filters are bitmap operations; SQL only sorts and pages the ids
+            wanted = [tag] if tag else []
+            if tags_param:
+                wanted += [t.strip() for t in tags_param.split(',') if t.strip()]
+            excluded = [t.strip() for t in (exclude_tags or "").split(',') if t.strip()]
+            tag_ids = {t.name: t.id for t in tags_by_name(s, wanted + excluded)}
+            matched, all_images = tag_index.match(
+                all_of=[tag_ids[n] for n in wanted if n in tag_ids],
+                none_of=[tag_ids[n] for n in excluded if n in tag_ids],
+            )
+            stmt = restrict(stmt, Image.id, matched, all_images)
+            if not q:
+                total = len(matched)
+        else:
+            # Handle single tag (for backward compatibility)
+            if tag:
+                t = tag_named(s, tag)
                 if t:
-                    # Use NOT EXISTS to exclude images with this tag
-                    subquery = select(ImageTagLink.image_id).where(
+                    # join via link table
+                    stmt = stmt.join(ImageTagLink, Image.id == ImageTagLink.image_id).where(
                         ImageTagLink.tag_id == t.id
                     )
-                    stmt = stmt.where(~Image.id.in_(subquery))
-        total = len(s.exec(stmt).all())
-        offset = (page - 1) * page_size
-        images = s.exec(stmt.offset(offset).limit(page_size)).all()
-        # Load tags for each image manually
-        image_tags = {}
-        for img in images:
-            tag_ids = s.exec(
-                select(ImageTagLink.tag_id).where(ImageTagLink.image_id == img.id)
-            ).all()
-            if tag_ids:
-                image_tags[img.id] = s.exec(
-                    select(Tag).where(Tag.id.in_(tag_ids))
-                ).all()
-            else:
-                image_tags[img.id] = []
-        tags = s.exec(select(Tag).order_by(Tag.name)).all()
-        quick_tags = s.exec(
-            select(Tag).where(
-                Tag.name.in_(["Needs inpainting", "Ready for i2v", "Ready for upscale"])
+        
+            # Handle multiple tags
+            if tags_param:
+                tag_names = [t.strip() for t in tags_param.split(',') if t.strip()]
+                if tag_names:
+                    # Get tag IDs for all selected tags
+                    tag_ids = []
+                    for tag_name in tag_names:
+                        t = tag_named(s, tag_name)
+                        if t:
+                            tag_ids.append(t.id)
+                
+                    if tag_ids:
+                        # Find images that have ALL the specified tags
+                        subquery = (
+                            select(ImageTagLink.image_id)
+                            .where(ImageTagLink.tag_id.in_(tag_ids))
+                            .group_by(ImageTagLink.image_id)
+                            .having(func.count(ImageTagLink.tag_id) == len(tag_ids))
+                        )
+                        stmt = stmt.where(Image.id.in_(subquery))
+        
+            # Handle tag exclusions
+            if exclude_tags:
+                exclude_tag_names = [t.strip() for t in exclude_tags.split(',') if t.strip()]
+                for tag_name in exclude_tag_names:
+                    t = tag_named(s, tag_name)
+                    if t:
+                        # Use NOT EXISTS to exclude images with this tag
+                        subquery = select(ImageTagLink.image_id).where(
+                            ImageTagLink.tag_id == t.id
+                        )
+                        stmt = stmt.where(~Image.id.in_(subquery))
+        total_exact = True
+        if total is None:
+            total, total_exact = count_images(s, stmt, (q, tag, tags_param, exclude_tags))
+        if not (after or before):
+            page = 1
+        try:
+            images, prev_cursor, next_cursor = keyset_page(
+                s, stmt, sort, descending, page_size, after=after, before=before
             )
-        ).all()
+        except ValueError:
+            raise HTTPException(400, "Invalid page cursor")
+        image_tags = load_image_tags(s, [img.id for img in images])
+        tags = list(tag_catalog(s).values())
+        quick_tags = tags_by_name(s, QUICK_TAGS)
+        atlas = None
+        if ATLAS_ENABLED and images:
+            # One sprite request paints the whole page
+            page_ids = [img.id for img in images]
+            atlas = atlas_layout(page_ids)
+            signature = atlas_signature(
+                [atlas_item(img.id, img.file_hash, img.mtime, img.path) for img in images]
+            )
+            atlas["url"] = f"/thumb/atlas?ids={','.join(map(str, page_ids))}&s={signature}"
     return render(
         "images.html",
+        atlas=atlas,
         title="Images",
         images=images,
         image_tags=image_tags,
@@ -290,9 +389,18 @@ def list_images(
         quick_tags=quick_tags,
         page=page,
         page_size=page_size,
-        has_more=(offset + len(images)) < total,
+        has_prev=prev_cursor is not None,
+        has_more=next_cursor is not None,
+        prev_cursor=prev_cursor,
+        next_cursor=next_cursor,
         total=total,
+        total_exact=total_exact,
         q=q,
+        ranked=ranked,
+        sort=sort,
+        order="desc" if descending else "asc",
+        explicit_order=order,
+        sorts=SORTS,
         active_tag=tag,
         selected_tags=tags_param,  # This is the comma-separated string from the query parameter
         exclude_tags=exclude_tags,
@@ -302,30 +410,23 @@ def list_images(
 
 def image_detail(image_id: int):
     """Show individual image details."""
-    with get_session() as s:
-        img = s.get(Image, image_id)
+    with get_read_session() as s:
+        img = s.exec(
+            select(Image).where(Image.id == image_id).options(selectinload(Image.tags))
+        ).first()
         if not img:
             raise HTTPException(404, "Not found")
-        
-        # Load tags for this image manually
-        tag_ids = s.exec(
-            select(ImageTagLink.tag_id).where(ImageTagLink.image_id == img.id)
-        ).all()
-        if tag_ids:
-            image_tags = s.exec(
-                select(Tag).where(Tag.id.in_(tag_ids))
-            ).all()
-        else:
-            image_tags = []
-            
-        tags = s.exec(select(Tag).order_by(Tag.name)).all()
-        quick_tags = s.exec(
-            select(Tag).where(
-                Tag.name.in_(["Needs inpainting", "Ready for i2v", "Ready for upscale"])
-            )
-        ).all()
+        image_tags = img.tags
+        tags = list(tag_catalog(s).values())
+        quick_tags = tags_by_name(s, QUICK_TAGS)
     return render(
-        "image.html", title=img.filename, image=img, image_tags=image_tags, tags=tags, quick_tags=quick_tags
+        "image.html",
+        title=img.filename,
+        image=img,
+        image_tags=image_tags,
+        tags=tags,
+        quick_tags=quick_tags,
+        deep_zoom=deep_zoom_available(img.width, img.height),
     )
 
 
@@ -389,6 +490,7 @@ def delete_image(image_id: int):
             actual_path = resolve_under_root(Path(root), Path(img.path))
             if actual_path.exists():
                 actual_path.unlink()
+        removed = [(image_id, img.file_hash)]
         
         # Delete image tag links first
         links = s.exec(select(ImageTagLink).where(ImageTagLink.image_id == image_id)).all()
@@ -398,53 +500,330 @@ def delete_image(image_id: int):
         # Delete the image from database
         s.delete(img)
         s.commit()
+    path_resolver.forget([image_id])
+    if root:
+        purge_thumbnails(Path(root), removed)
     
     return RedirectResponse("/images", 303)
 
 
-def media(image_id: int):
-    """Serve original media file."""
+def _image_file(image_id: int) -> tuple[Path, Path, Optional[str], float]:
+    """Look up an image: (root, validated path on disk, content hash, disk mtime).
+
+    The hash is None when the file changed on disk since it was last scanned.
+    """
     root = get_setting("root_dir")
     if not root:
         raise HTTPException(400, "Set root folder in Settings")
-    with get_session() as s:
-        img = s.get(Image, image_id)
-        if not img:
-            raise HTTPException(404, "Not found")
-    real = resolve_under_root(Path(root), Path(img.path))
-    if not real.exists():
+    found = path_resolver.resolve(Path(root), image_id)
+    try:
+        disk_mtime = found.path.stat().st_mtime
+    except FileNotFoundError:
         raise HTTPException(404, "File missing on disk")
-    return FileResponse(real)
+    return found.root, found.path, source_hash(found.file_hash, found.mtime, disk_mtime), disk_mtime
+
+
+def media(image_id: int):
+    """Serve original media file."""
+    root, real, _, _ = _image_file(image_id)
+    return send_file(real, root)
+
+
+def _view_priority(request: Request) -> float:
+    """Queue priority of a thumbnail request: the page view it belongs to."""
+    try:
+        return float(request.cookies[VIEW_COOKIE])
+    except (KeyError, ValueError):
+        return time.time() * 1000
+
+
+def _lookup_cached(root: Path, key: str, min_mtime: float = 0.0) -> Optional[ThumbHit]:
+    """Client lookup in the thumbnail cache, counted as a hit or miss.
 
+    Blocking: the first call for a vault opens (and may rebuild) its access
+    index, and every call stats the cached file or refreshes the pack index.
+    """
+    return _read_hit(get_thumb_store(root).lookup(key, min_mtime))
+
+
+def _read_generated(root: Path, key: str) -> Optional[ThumbHit]:
+    """Read back a derivative the pool just generated (blocking, not counted)."""
+    return _read_hit(get_thumb_store(root).get(key))
+
+
+def _read_hit(hit: Optional[ThumbHit]) -> Optional[Union[ThumbHit, bytes]]:
+    """Load a file hit now, so an eviction by another worker is just a miss.
+
+    The file may be unlinked any time after the lookup; once read (or handed
+    to the reverse proxy) that no longer matters. Thumbnails are small.
+    """
+    if not isinstance(hit, Path) or proxy_sends_files():
+        return hit
+    try:
+        return hit.read_bytes()
+    except FileNotFoundError:
+        return None
+
+
+async def _serve_derivative(
+    request: Request,
+    image_id: int,
+    variant: Union[int, str],
+    spec: Any,
+    fmt: str,
+    generate: Callable[..., str],
+):
+    """Serve a cached derivative of an image, generating it on a miss.
+
+    ``spec`` (a width, box size or tile address) is passed on to ``generate``.
+
+    Cache lookups run in the threadpool; misses are generated on the
+    dedicated thumbnail process pool so other routes stay responsive.
+    Derivatives for the most recent page view (``render`` stamps it in a
+    cookie) are generated first.
+    """
+    root, real, content_hash, src_mtime = await run_in_threadpool(_image_file, image_id)
+
+    key, min_mtime = thumb_variant(image_id, content_hash, src_mtime, variant, fmt)
+    hit = await run_in_threadpool(_lookup_cached, root, key, min_mtime)
+    if hit is None:
+        try:
+            fmt = await thumb_pool.run(
+                key,
+                generate, root, image_id, content_hash, real, src_mtime, spec, fmt,
+                priority=_view_priority(request),
+                is_disconnected=request.is_disconnected,
+            )
+        except QueueFull:
+            raise HTTPException(
+                503,
+                "Thumbnail queue is full",
+                headers={"Retry-After": str(THUMB_RETRY_AFTER)},
+            )
+        except ClientGone:
+            # Nobody is listening any more; nginx's "client closed request"
+            return Response(status_code=499)
+        key = thumb_variant(image_id, content_hash, src_mtime, variant, fmt)[0]
+        hit = await run_in_threadpool(_read_generated, root, key)
+        if hit is None:
+            # Evicted again before we could serve it; let the client retry
+            raise HTTPException(
+                503,
+                "Thumbnail not ready",
+                headers={"Retry-After": str(THUMB_RETRY_AFTER)},
+            )
+
+    return thumb_response(hit, media_type_for(fmt), root)
+
+
+async def thumbnail(
+    request: Request,
+    image_id: int,
+    w: int = Query(GRID_THUMB_WIDTH, ge=32, le=4096),
+):
+    """Serve a thumbnail in the best format the client accepts."""
+    fmt = negotiate_format(request.headers.get("accept"))
+    return await _serve_derivative(request, image_id, w, w, fmt, generate_thumbnail)
 
-def thumbnail(image_id: int, w: int = Query(360, ge=32, le=4096)):
-    """Generate and serve thumbnail."""
+
+async def preview(request: Request, image_id: int):
+    """Serve the screen-sized preview shown on the detail page instead of the original."""
+    fmt = negotiate_format(request.headers.get("accept"), allowed=PREVIEW_FORMATS)
+    return await _serve_derivative(
+        request, image_id, preview_variant(), PREVIEW_SIZE, fmt, generate_preview
+    )
+
+
+def _deep_zoom_image(image_id: int) -> Image:
+    """Look up an image that has a tile pyramid."""
+    with get_read_session() as s:
+        img = s.get(Image, image_id)
+    if not img or not deep_zoom_available(img.width, img.height):
+        raise HTTPException(404, "No deep zoom for this image")
+    return img
+
+
+def deep_zoom_descriptor(image_id: int):
+    """DZI descriptor of an image's tile pyramid."""
+    img = _deep_zoom_image(image_id)
+    return Response(content=dzi_descriptor(img.width, img.height), media_type="application/xml")
+
+
+async def deep_zoom_tile(request: Request, image_id: int, level: int, tile: str):
+    """One tile of the pyramid, rendered and cached on first request."""
+    img = await run_in_threadpool(_deep_zoom_image, image_id)
+    name, _, ext = tile.partition(".")
+    try:
+        col, row = (int(part) for part in name.split("_"))
+    except ValueError:
+        raise HTTPException(404, "Not found")
+    if ext != THUMB_FORMATS[TILE_FORMAT][2][1:] or not 0 <= level <= max_level(img.width, img.height):
+        raise HTTPException(404, "Not found")
+    columns, rows = tile_grid(img.width, img.height, level)
+    if not (0 <= col < columns and 0 <= row < rows):
+        raise HTTPException(404, "Not found")
+    return await _serve_derivative(
+        request, image_id, tile_variant(level, col, row), (level, col, row), TILE_FORMAT, generate_tile
+    )
+
+
+def _parse_ids(ids: str) -> list[int]:
+    """Parse a comma-separated id list for the atlas endpoints."""
+    try:
+        id_list = [int(part) for part in ids.split(",") if part.strip()]
+    except ValueError:
+        raise HTTPException(400, "ids must be comma-separated integers")
+    if not id_list or len(id_list) > ATLAS_MAX_IDS:
+        raise HTTPException(400, f"Between 1 and {ATLAS_MAX_IDS} ids required")
+    return id_list
+
+
+def _atlas_images(id_list: list[int]) -> tuple[Path, list[Optional[Image]]]:
+    """The vault root and the catalogued images of an atlas, in id order."""
     root = get_setting("root_dir")
     if not root:
         raise HTTPException(400, "Set root folder in Settings")
-    with get_session() as s:
-        img = s.get(Image, image_id)
-        if not img:
-            raise HTTPException(404, "Not found")
-    real = resolve_under_root(Path(root), Path(img.path))
-    if not real.exists():
-        raise HTTPException(404, "File missing on disk")
+    with get_read_session() as s:
+        images = {img.id: img for img in s.exec(select(Image).where(Image.id.in_(id_list))).all()}
+    return Path(root), [images.get(image_id) for image_id in id_list]
+
+
+def _atlas_items(id_list: list[int], images: list[Optional[Image]]) -> list[str]:
+    return [
+        atlas_item(image_id, img.file_hash, img.mtime, img.path) if img else f"{image_id}:-"
+        for image_id, img in zip(id_list, images)
+    ]
+
+
+def _atlas_sources(id_list: list[int], thumb_fmt: str) -> tuple[Path, list[str], list]:
+    """Resolve atlas ids to (root, signature items, cells in id order).
+
+    A cell is None for an unknown or missing image, else the
+    ``generate_thumbnail`` arguments of the thumbnail it is cut from (without
+    the root) and whether that thumbnail is already cached.
+    """
+    root, images = _atlas_images(id_list)
+    store = get_thumb_store(root)
+    cells = []
+    for image_id, img in zip(id_list, images):
+        cell = None
+        if img:
+            try:
+                src = resolve_under_root(root, Path(img.path))
+                src_mtime = src.stat().st_mtime
+            except (HTTPException, OSError):
+                pass
+            else:
+                content_hash = source_hash(img.file_hash, img.mtime, src_mtime)
+                w = atlas_cell_width(img.width, img.height)
+                key, min_mtime = thumb_variant(image_id, content_hash, src_mtime, w, thumb_fmt)
+                args = (image_id, content_hash, src, src_mtime, w, thumb_fmt)
+                cell = (args, store.get(key, min_mtime) is not None)
+        cells.append(cell)
+    return root, _atlas_items(id_list, images), cells
+
+
+async def _ensure_atlas_cells(request: Request, root: Path, cells: list) -> list[Optional[str]]:
+    """Cache keys of the cell thumbnails, generating missing ones in parallel.
+
+    They run on the pool as ordinary thumbnail jobs, shared with ``/thumb``
+    requests for the same key. An image that cannot be decoded gets a blank
+    cell (``None``); ``QueueFull`` and ``ClientGone`` propagate.
+    """
+    priority = _view_priority(request)
+
+    async def ensure(cell) -> Optional[str]:
+        if cell is None:
+            return None
+        (image_id, content_hash, src, src_mtime, w, fmt), cached = cell
+        if not cached:
+            key = thumb_variant(image_id, content_hash, src_mtime, w, fmt)[0]
+            try:
+                fmt = await thumb_pool.run(
+                    key,
+                    generate_thumbnail, root, image_id, content_hash, src, src_mtime, w, fmt,
+                    priority=priority,
+                    is_disconnected=request.is_disconnected,
+                )
+            except (QueueFull, ClientGone):
+                raise
+            except Exception:
+                return None
+        return thumb_variant(image_id, content_hash, src_mtime, w, fmt)[0]
+
+    results = await asyncio.gather(*(ensure(cell) for cell in cells), return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return results
+
+
+def thumb_atlas_json(ids: str = Query(...)):
+    """Sprite layout for a page of images: atlas URL and per-id offsets."""
+    id_list = _parse_ids(ids)
+    _, images = _atlas_images(id_list)
+    layout = atlas_layout(id_list)
+    signature = atlas_signature(_atlas_items(id_list, images))
+    layout["url"] = f"/thumb/atlas?ids={','.join(map(str, id_list))}&s={signature}"
+    return layout
+
+
+async def thumb_atlas(request: Request, ids: str = Query(...)):
+    """Serve one sprite image holding the thumbnails of a whole page."""
+    id_list = _parse_ids(ids)
+    accept = request.headers.get("accept")
+    # Cells come from the thumbnails this client would get from /thumb
+    thumb_fmt = negotiate_format(accept)
+    fmt = negotiate_format(accept, allowed=ATLAS_FORMATS)
+    root, items, cells = await run_in_threadpool(_atlas_sources, id_list, thumb_fmt)
+    key = atlas_key(atlas_signature(items), fmt)
+
+    hit = await run_in_threadpool(_lookup_cached, root, key)
+    if hit is None:
+        try:
+            cell_keys = await _ensure_atlas_cells(request, root, cells)
+            await thumb_pool.run(
+                key, generate_atlas, root, key, cell_keys, fmt,
+                priority=_view_priority(request),
+                is_disconnected=request.is_disconnected,
+            )
+        except QueueFull:
+            raise HTTPException(
+                503,
+                "Thumbnail queue is full",
+                headers={"Retry-After": str(THUMB_RETRY_AFTER)},
+            )
+        except ClientGone:
+            return Response(status_code=499)
+        except FileNotFoundError:
+            # A cell thumbnail was evicted before the sheet was composed
+            hit = None
+        else:
+            hit = await run_in_threadpool(_read_generated, root, key)
+        if hit is None:
+            raise HTTPException(
+                503,
+                "Atlas not ready",
+                headers={"Retry-After": str(THUMB_RETRY_AFTER)},
+            )
+
+    response = thumb_response(hit, media_type_for(fmt), root)
+    # The URL carries the content signature, so browsers may keep it for good
+    response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    return response
 
-    thumb_dir = Path(root) / DEFAULT_THUMB_DIRNAME
-    thumb_dir.mkdir(exist_ok=True)
-    thumb_path = thumb_dir / f"{image_id}_{w}.jpg"
 
-    if (
-        not thumb_path.exists()
-        or thumb_path.stat().st_mtime < Path(img.path).stat().st_mtime
-    ):
-        im = PILImage.open(real)
-        im = ImageOps.exif_transpose(im)
-        im.thumbnail((w, w * 10_000))
-        rgb = im.convert("RGB")
-        rgb.save(thumb_path, format="JPEG", quality=88)
+def thumb_response(hit: Union[ThumbHit, bytes], media_type: str, root: Path) -> Response:
+    """Serve a cached thumbnail from either store backend.
 
-    return FileResponse(thumb_path)
+    Pack hits are already zero-copy slices of a memory map and are always
+    sent from here; file hits are offloaded to the reverse proxy if it is
+    configured and were read by ``_read_hit`` otherwise.
+    """
+    headers = {"Vary": "Accept"}
+    if isinstance(hit, Path):
+        return send_file(hit, root, media_type=media_type, headers=headers)
+    return Response(content=hit, media_type=media_type, headers=headers)
 
 
 def bulk_delete_images(
@@ -453,6 +832,7 @@ def bulk_delete_images(
 ):
     """Bulk delete images."""
     root = get_setting("root_dir")
+    removed = []
     with get_session() as s:
         for image_id in image_ids:
             img = s.get(Image, image_id)
@@ -462,6 +842,7 @@ def bulk_delete_images(
                     actual_path = resolve_under_root(Path(root), Path(img.path))
                     if actual_path.exists():
                         actual_path.unlink()
+                removed.append((image_id, img.file_hash))
                 
                 # Delete image tag links first
                 links = s.exec(select(ImageTagLink).where(ImageTagLink.image_id == image_id)).all()
@@ -471,6 +852,9 @@ def bulk_delete_images(
                 # Delete the image from database
                 s.delete(img)
         s.commit()
+    path_resolver.forget(image_id for image_id, _ in removed)
+    if root and removed:
+        purge_thumbnails(Path(root), removed)
     
     # Return to previous page with filters preserved
     redirect_url = return_to if return_to else "/images"
@@ -544,7 +928,7 @@ def export_preview(
     image_ids: Optional[str] = Query(None)
 ):
     """Show export preview page with current filters."""
-    with get_session() as s:
+    with get_read_session() as s:
         # If specific image IDs are provided, use those instead of filters
         if image_ids:
             id_list = [int(id.strip()) for id in image_ids.split(',') if id.strip().isdigit()]
@@ -558,10 +942,10 @@ def export_preview(
             stmt = select(Image).order_by(Image.filename)
             
             if q:
-                stmt = stmt.where(Image.filename.contains(q))
+                stmt = search(stmt, q)
                 
             if tag:
-                t = s.exec(select(Tag).where(Tag.name == tag)).first()
+                t = tag_named(s, tag)
                 if t:
                     stmt = stmt.join(ImageTagLink, Image.id == ImageTagLink.image_id).where(
                         ImageTagLink.tag_id == t.id
@@ -574,7 +958,7 @@ def export_preview(
                     # Get tag IDs for all include tags
                     include_tag_ids = []
                     for tag_name in include_tag_names:
-                        t = s.exec(select(Tag).where(Tag.name == tag_name)).first()
+                        t = tag_named(s, tag_name)
                         if t:
                             include_tag_ids.append(t.id)
                     
@@ -592,7 +976,7 @@ def export_preview(
             if exclude_tags:
                 exclude_tag_names = [t.strip() for t in exclude_tags.split(',') if t.strip()]
                 for tag_name in exclude_tag_names:
-                    t = s.exec(select(Tag).where(Tag.name == tag_name)).first()
+                    t = tag_named(s, tag_name)
                     if t:
                         # Use NOT EXISTS to exclude images with this tag
                         subquery = select(ImageTagLink.image_id).where(
@@ -601,7 +985,7 @@ def export_preview(
                         stmt = stmt.where(~Image.id.in_(subquery))
             
             matching_images = s.exec(stmt).all()
-        all_tags = s.exec(select(Tag).order_by(Tag.name)).all()
+        all_tags = list(tag_catalog(s).values())
         
         # Calculate total file size
         total_size = sum(img.size for img in matching_images)
@@ -643,7 +1027,7 @@ def export_execute(
             
         root_path = Path(root_dir)
         
-        with get_session() as s:
+        with get_read_session() as s:
             # If specific image IDs are provided, use those instead of filters
             if image_ids:
                 id_list = [int(id.strip()) for id in image_ids.split(',') if id.strip().isdigit()]
@@ -657,10 +1041,10 @@ def export_execute(
                 stmt = select(Image).order_by(Image.filename)
                 
                 if q:
-                    stmt = stmt.where(Image.filename.contains(q))
+                    stmt = search(stmt, q)
                     
                 if tag:
-                    t = s.exec(select(Tag).where(Tag.name == tag)).first()
+                    t = tag_named(s, tag)
                     if t:
                         stmt = stmt.join(ImageTagLink, Image.id == ImageTagLink.image_id).where(
                             ImageTagLink.tag_id == t.id
@@ -669,7 +1053,7 @@ def export_execute(
                 if include_tags:
                     include_tag_names = [t.strip() for t in include_tags.split(',') if t.strip()]
                     for tag_name in include_tag_names:
-                        t = s.exec(select(Tag).where(Tag.name == tag_name)).first()
+                        t = tag_named(s, tag_name)
                         if t:
                             stmt = stmt.join(ImageTagLink, Image.id == ImageTagLink.image_id).where(
                                 ImageTagLink.tag_id == t.id
@@ -678,7 +1062,7 @@ def export_execute(
                 if exclude_tags:
                     exclude_tag_names = [t.strip() for t in exclude_tags.split(',') if t.strip()]
                     for tag_name in exclude_tag_names:
-                        t = s.exec(select(Tag).where(Tag.name == tag_name)).first()
+                        t = tag_named(s, tag_name)
                         if t:
                             subquery = select(ImageTagLink.image_id).where(
                                 ImageTagLink.tag_id == t.id
@@ -732,7 +1116,7 @@ def open_folder(image_id: int):
     import subprocess
     import platform
     
-    with get_session() as s:
+    with get_read_session() as s:
         img = s.get(Image, image_id)
         if not img:
             raise HTTPException(404, "Image not found")
@@ -766,109 +1150,73 @@ def open_folder(image_id: int):
 
 def dashboard():
     """Dashboard page with statistics and insights."""
-    with get_session() as s:
-        # Basic statistics
-        total_images = len(s.exec(select(Image)).all())
-        total_tags = len(s.exec(select(Tag)).all())
-        
-        # Get all images to calculate size and recent activity
-        all_images = s.exec(select(Image)).all()
-        total_size = sum(img.size for img in all_images)
-        
-        # Recent images (last 7 days)
-        recent_threshold = (datetime.utcnow().timestamp() - (7 * 24 * 60 * 60))
-        recent_images = [img for img in all_images if img.created_at.timestamp() > recent_threshold]
+    with get_read_session() as s:
+        # Aggregates are kept up to date by triggers (see migrations.py)
+        stats: dict[str, dict[str, tuple[int, int]]] = {}
+        for kind, key, count, size in s.execute(
+            text("SELECT kind, key, count, size FROM catalog_stats WHERE count > 0")
+        ):
+            stats.setdefault(kind, {})[key] = (count, size)
+        total_images, total_size = stats.get("total", {}).get("", (0, 0))
+        total_tags = s.execute(text("SELECT count(*) FROM tag")).scalar()
+
+        def percentage(count: int) -> float:
+            return (count / total_images * 100) if total_images > 0 else 0
+
+        # Recent images (last 7 days), counted on the created_at index
+        recent_threshold = datetime.utcnow() - timedelta(days=7)
+        recent_images_count = s.execute(
+            select(func.count()).select_from(Image).where(Image.created_at > recent_threshold)
+        ).scalar()
         
         # Tag statistics with image counts
         tag_stats = []
-        tags = s.exec(select(Tag).order_by(Tag.name)).all()
+        tags = s.exec(select(Tag).where(Tag.usage_count > 0).order_by(Tag.name)).all()
         for tag in tags:
-            count = len(s.exec(
-                select(ImageTagLink).where(ImageTagLink.tag_id == tag.id)
-            ).all())
-            if count > 0:  # Only include tags that have images
-                tag_stats.append({
-                    'name': tag.name,
-                    'color': tag.color or '#444',
-                    'count': count,
-                    'percentage': (count / total_images * 100) if total_images > 0 else 0
-                })
+            tag_stats.append({
+                'name': tag.name,
+                'color': tag.color or '#444',
+                'count': tag.usage_count,
+                'percentage': percentage(tag.usage_count)
+            })
         
         # Sort by count descending
         tag_stats.sort(key=lambda x: x['count'], reverse=True)
         
-        # Top directories analysis
-        dir_stats = {}
-        for img in all_images:
-            dir_path = Path(img.dirpath).name or "Root"
-            if dir_path not in dir_stats:
-                dir_stats[dir_path] = {'count': 0, 'size': 0}
-            dir_stats[dir_path]['count'] += 1
-            dir_stats[dir_path]['size'] += img.size
-        
-        # Convert to list and sort
+        # Top 10 directories
         directory_stats = [
-            {'name': name, **stats, 'percentage': (stats['count'] / total_images * 100) if total_images > 0 else 0}
-            for name, stats in dir_stats.items()
+            {'name': name, 'count': count, 'size': size, 'percentage': percentage(count)}
+            for name, (count, size) in stats.get("directory", {}).items()
         ]
         directory_stats.sort(key=lambda x: x['count'], reverse=True)
-        directory_stats = directory_stats[:10]  # Top 10 directories
+        directory_stats = directory_stats[:10]
         
         # Image dimensions analysis
-        resolution_stats = {}
-        for img in all_images:
-            if img.width > 0 and img.height > 0:
-                # Categorize by resolution
-                pixels = img.width * img.height
-                if pixels >= 3840 * 2160:
-                    category = "4K+ (3840×2160+)"
-                elif pixels >= 2560 * 1440:
-                    category = "QHD (2560×1440+)"
-                elif pixels >= 1920 * 1080:
-                    category = "FHD (1920×1080+)"
-                elif pixels >= 1280 * 720:
-                    category = "HD (1280×720+)"
-                else:
-                    category = "SD (<1280×720)"
-                
-                if category not in resolution_stats:
-                    resolution_stats[category] = 0
-                resolution_stats[category] += 1
-        
         resolution_list = [
-            {'name': name, 'count': count, 'percentage': (count / total_images * 100) if total_images > 0 else 0}
-            for name, count in resolution_stats.items()
+            {'name': name, 'count': count, 'percentage': percentage(count)}
+            for name, (count, _) in stats.get("resolution", {}).items()
         ]
         resolution_list.sort(key=lambda x: x['count'], reverse=True)
         
         # File format analysis
-        format_stats = {}
-        for img in all_images:
-            ext = Path(img.filename).suffix.lower()
-            if ext not in format_stats:
-                format_stats[ext] = 0
-            format_stats[ext] += 1
-        
         format_list = [
-            {'name': ext or 'No extension', 'count': count, 'percentage': (count / total_images * 100) if total_images > 0 else 0}
-            for ext, count in format_stats.items()
+            {'name': ext or 'No extension', 'count': count, 'percentage': percentage(count)}
+            for ext, (count, _) in stats.get("format", {}).items()
         ]
         format_list.sort(key=lambda x: x['count'], reverse=True)
         
         # Workflow status (special tags)
         workflow_tags = ["Needs Inpainting", "Ready For i2v", "Ready for Upscale", "Posted", "i2v done"]
         workflow_stats = []
+        found = {tag.name: tag for tag in s.exec(select(Tag).where(Tag.name.in_(workflow_tags)))}
         for tag_name in workflow_tags:
-            tag = s.exec(select(Tag).where(Tag.name == tag_name)).first()
+            tag = found.get(tag_name)
             if tag:
-                count = len(s.exec(
-                    select(ImageTagLink).where(ImageTagLink.tag_id == tag.id)
-                ).all())
                 workflow_stats.append({
                     'name': tag.name,
                     'color': tag.color or '#444',
-                    'count': count,
-                    'percentage': (count / total_images * 100) if total_images > 0 else 0
+                    'count': tag.usage_count,
+                    'percentage': percentage(tag.usage_count)
                 })
         
         # Get latest images for preview
@@ -877,23 +1225,15 @@ def dashboard():
         ).all()
         
         # Storage breakdown by size ranges
-        size_ranges = [
-            ('< 1MB', 0, 1024*1024),
-            ('1-5MB', 1024*1024, 5*1024*1024),
-            ('5-10MB', 5*1024*1024, 10*1024*1024),
-            ('10-50MB', 10*1024*1024, 50*1024*1024),
-            ('> 50MB', 50*1024*1024, float('inf'))
-        ]
-        
+        size_ranges = stats.get("size_range", {})
         size_stats = []
-        for name, min_size, max_size in size_ranges:
-            count = len([img for img in all_images if min_size <= img.size < max_size])
-            total_size_range = sum(img.size for img in all_images if min_size <= img.size < max_size)
+        for name in ('< 1MB', '1-5MB', '5-10MB', '10-50MB', '> 50MB'):
+            count, size = size_ranges.get(name, (0, 0))
             size_stats.append({
                 'name': name,
                 'count': count,
-                'size': total_size_range,
-                'percentage': (count / total_images * 100) if total_images > 0 else 0
+                'size': size,
+                'percentage': percentage(count)
             })
     
     return render(
@@ -902,7 +1242,7 @@ def dashboard():
         total_images=total_images,
         total_tags=total_tags,
         total_size=total_size,
-        recent_images_count=len(recent_images),
+        recent_images_count=recent_images_count,
         tag_stats=tag_stats,
         directory_stats=directory_stats,
         resolution_stats=resolution_list,
@@ -915,8 +1255,95 @@ def dashboard():
     )
 
 
+def api_thumb_stats():
+    """Thumbnail cache size and hit/miss/eviction statistics."""
+    root = get_setting("root_dir")
+    if not root:
+        raise HTTPException(400, "Set root folder in Settings")
+    return {**get_thumb_store(Path(root)).stats(), "resolver": path_resolver.stats()}
+
+
+def api_warmup_status():
+    """Progress of the background thumbnail warm-up."""
+    return warmup_job.status
+
+
+async def api_warmup_restart():
+    """Restart the thumbnail warm-up from the newest images."""
+    warmup_job.restart()
+    return warmup_job.status
+
+
+def _analytics_value(field: str, raw: str) -> float:
+    try:
+        return float(raw)
+    except ValueError:
+        if field not in ("created", "mtime"):
+            raise HTTPException(400, f"{field} bounds must be numbers")
+    try:
+        when = datetime.fromisoformat(raw)
+    except ValueError:
+        raise HTTPException(400, f"{field} bounds must be numbers or ISO dates")
+    return (when if when.tzinfo else when.replace(tzinfo=timezone.utc)).timestamp()
+
+
+def _analytics_selection(request: Request):
+    """Catalog snapshot and the row mask for the filters in the query string.
+
+    ``<field>_min`` (inclusive) and ``<field>_max`` (exclusive) bound any of
+    ``snapshot.FIELDS``; ``created`` and ``mtime`` also take ISO dates (UTC).
+    ``tags`` lists tag names that must all be present, ``dir`` is a folder path.
+    """
+    if not SNAPSHOT_ENABLED:
+        raise HTTPException(503, "Analytics need NumPy (pip install numpy)")
+    params = request.query_params
+    ranges = {}
+    for field in FIELDS:
+        low, high = (params.get(f"{field}_{end}") for end in ("min", "max"))
+        if low or high:
+            ranges[field] = (
+                _analytics_value(field, low) if low else None,
+                _analytics_value(field, high) if high else None,
+            )
+    names = [t.strip() for t in params.get("tags", "").split(",") if t.strip()]
+    with get_read_session() as s:
+        found = {t.name: t.id for t in tags_by_name(s, names)}
+    snap = catalog_snapshot.get()
+    # An unknown tag matches nothing
+    tag_ids = [found.get(name, -1) for name in names]
+    return snap, filter_mask(snap, ranges, tag_ids, params.get("dir") or None)
+
+
+def api_analytics_summary(request: Request):
+    """Count, total size, per-field statistics and orientations of the selection."""
+    return snapshot_summary(*_analytics_selection(request))
+
+
+def api_analytics_histogram(
+    request: Request,
+    field: str = Query(...),
+    bins: int = Query(20, ge=1, le=1000),
+    log: bool = Query(False),
+):
+    """Histogram of one field over the selection."""
+    if field not in FIELDS:
+        raise HTTPException(400, f"field must be one of {', '.join(FIELDS)}")
+    snap, mask = _analytics_selection(request)
+    return snapshot_histogram(snap, mask, field, bins, log)
+
+
+def api_analytics_images(request: Request, limit: int = Query(100, ge=0, le=10000)):
+    """Ids of the selected images, newest first, with their count and total size."""
+    snap, mask = _analytics_selection(request)
+    return {
+        "count": int(mask.sum()),
+        "total_size": int(snap.cols["size"][mask].sum()),
+        "ids": newest_ids(snap, mask, limit),
+    }
+
+
 def api_get_tags():
     """Get all tags as JSON for API use."""
-    with get_session() as s:
+    with get_read_session() as s:
         tags = s.exec(select(Tag).order_by(Tag.name)).all()
         return [{"id": tag.id, "name": tag.name, "color": tag.color} for tag in tags]
\ No newline at end of file
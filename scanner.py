@@ -1,19 +1,28 @@
 """Image scanning utilities."""
+import base64
 import hashlib
+import io
+import time
 from datetime import datetime
 from pathlib import Path
-from typing import Iterable
+from typing import Iterable, Optional
 
 from fastapi import HTTPException
 from PIL import Image as PILImage, ImageOps
+from sqlalchemy import delete, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlmodel import select
 
-from database import get_session
+from database import WRITE_SLICE_SECONDS, get_batch_session, get_read_session, yield_to_interactive
 from models import Image, Tag, ImageTagLink
 
 # Configuration
 ALLOWED_EXTS = {".jpg", ".jpeg", ".png", ".webp"}
 DEFAULT_THUMB_DIRNAME = ".vault_thumbs"
+PLACEHOLDER_SIZE = 24  # px, longest side of the inline grid placeholder
+# Placeholder of a file that could not be decoded; rescans skip it until it changes
+PLACEHOLDER_FAILED = ""
+SCAN_WRITE_BATCH = 200  # scanned files queued before they are written
 
 
 def iter_image_files(root: Path) -> Iterable[Path]:
@@ -39,11 +48,40 @@ def md5sum(path: Path, chunk: int = 256 * 1024) -> str:
     return h.hexdigest()
 
 
-def read_image_meta(path: Path) -> tuple[int, int]:
-    """Read image dimensions."""
+def make_placeholder(im: PILImage.Image) -> tuple[str, str]:
+    """Build a tiny inline preview (data URI) and the dominant color of an image."""
+    im = im.convert("RGB")
+    small = im.copy()
+    small.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE))
+    buf = io.BytesIO()
+    # WebP headers are tiny compared to JPEG's tables (~80 vs ~650 bytes here)
+    small.save(buf, format="WEBP", quality=40)
+    data_uri = "data:image/webp;base64," + base64.b64encode(buf.getvalue()).decode("ascii")
+
+    # Most common color of a 4-color quantization of a 32px version
+    quantized = im.resize((32, 32)).quantize(colors=4)
+    _, index = max(quantized.getcolors())
+    r, g, b = quantized.getpalette()[index * 3:index * 3 + 3]
+    return data_uri, f"#{r:02x}{g:02x}{b:02x}"
+
+
+def read_image_info(path: Path) -> tuple[int, int, str, Optional[str]]:
+    """Read dimensions, placeholder data URI and dominant color in one decode.
+
+    The placeholder is ``PLACEHOLDER_FAILED`` if the pixels cannot be decoded.
+    """
     im = PILImage.open(path)
-    im = ImageOps.exif_transpose(im)
-    return im.width, im.height
+    width, height = im.size
+    if im.getexif().get(0x0112) in (5, 6, 7, 8):
+        # EXIF orientation rotates by 90°: report the displayed dimensions
+        width, height = height, width
+    try:
+        # Let JPEG decode at reduced scale; the preview is tiny anyway
+        im.draft("RGB", (PLACEHOLDER_SIZE * 8, PLACEHOLDER_SIZE * 8))
+        placeholder, color = make_placeholder(ImageOps.exif_transpose(im))
+    except Exception:
+        placeholder, color = PLACEHOLDER_FAILED, None
+    return width, height, placeholder, color
 
 
 def extract_tags_from_path(image_path: Path, root_dir: Path) -> list[str]:
@@ -77,30 +115,46 @@ def extract_tags_from_path(image_path: Path, root_dir: Path) -> list[str]:
         return []
 
 
-def get_or_create_tag(session, tag_name: str, color: str = None) -> Tag:
-    """Get existing tag or create new one."""
-    tag = session.exec(select(Tag).where(Tag.name == tag_name)).first()
-    if not tag:
-        tag = Tag(name=tag_name, color=color)
-        session.add(tag)
-        session.commit()
-        session.refresh(tag)
-    return tag
-
+def _write_batch(pending: list[tuple[Optional[int], dict, list[str]]], tag_ids: dict[str, int]) -> None:
+    """Write queued scan results, committing at least every ``WRITE_SLICE_SECONDS``.
 
-def assign_tags_to_image(session, image: Image, tag_names: list[str]) -> None:
-    """Assign tags to an image based on tag names."""
-    for tag_name in tag_names:
-        tag = get_or_create_tag(session, tag_name)
-        
-        # Check if association already exists
-        existing_link = session.get(ImageTagLink, (image.id, tag.id))
-        if not existing_link:
-            session.add(ImageTagLink(image_id=image.id, tag_id=tag.id))
+    Each entry is (image id or None for a new image, column values, folder tags).
+    """
+    with get_batch_session() as s:
+        started = time.monotonic()
+        for image_id, values, tag_names in pending:
+            if image_id is None:
+                image = Image(**values)
+                s.add(image)
+                s.flush()
+                image_id = image.id
+            elif values:
+                s.exec(update(Image).where(Image.id == image_id).values(**values))
+            for name in tag_names:
+                if name not in tag_ids:
+                    tag = s.exec(select(Tag).where(Tag.name == name)).first() or Tag(name=name)
+                    s.add(tag)
+                    s.flush()
+                    tag_ids[name] = tag.id
+                s.exec(
+                    sqlite_insert(ImageTagLink)
+                    .values(image_id=image_id, tag_id=tag_ids[name])
+                    .on_conflict_do_nothing()
+                )
+            if time.monotonic() - started >= WRITE_SLICE_SECONDS:
+                s.commit()
+                yield_to_interactive()
+                started = time.monotonic()
+        s.commit()
+    yield_to_interactive()
 
 
 def scan(root_dir: Path, cleanup: bool = False, auto_tag: bool = True) -> dict:
-    """Index all images under root_dir. Returns scan stats."""
+    """Index all images under root_dir. Returns scan stats.
+
+    Files are stat'ed, hashed and decoded outside any transaction and the
+    results written in short batches, so the UI keeps working during a scan.
+    """
     root_dir = root_dir.resolve()
     if not root_dir.exists() or not root_dir.is_dir():
         raise HTTPException(400, "Invalid root directory")
@@ -110,76 +164,96 @@ def scan(root_dir: Path, cleanup: bool = False, auto_tag: bool = True) -> dict:
 
     added = updated = unchanged = 0
     seen_paths: set[str] = set()
+    with get_read_session() as s:
+        known = {
+            row[0]: row[1:]
+            for row in s.exec(
+                select(
+                    Image.path, Image.id, Image.size, Image.mtime,
+                    Image.placeholder.is_(None), Image.file_hash,
+                )
+            )
+        }
+    pending: list[tuple[Optional[int], dict, list[str]]] = []
+    tag_ids: dict[str, int] = {}
 
-    with get_session() as s:
-        for file in iter_image_files(root_dir):
-            apath = str(file.resolve())
-            seen_paths.add(apath)
-            stat = file.stat()
-            db_img: Image | None = s.exec(
-                select(Image).where(Image.path == apath)
-            ).first()
-            if not db_img:
-                try:
-                    w, h = read_image_meta(file)
-                except Exception:
-                    w = h = 0
-                db_img = Image(
-                    path=apath,
-                    filename=file.name,
-                    dirpath=str(file.parent),
+    for file in iter_image_files(root_dir):
+        apath = str(file.resolve())
+        seen_paths.add(apath)
+        stat = file.stat()
+        # Auto-tag based on folder structure (existing images too, whether or not they changed)
+        folder_tags = extract_tags_from_path(file, root_dir) if auto_tag else []
+        row = known.get(apath)
+        if row is None:
+            try:
+                w, h, placeholder, color = read_image_info(file)
+            except Exception:
+                w = h = 0
+                placeholder, color = PLACEHOLDER_FAILED, None
+            pending.append((None, dict(
+                path=apath,
+                filename=file.name,
+                dirpath=str(file.parent),
+                size=stat.st_size,
+                mtime=stat.st_mtime,
+                width=w,
+                height=h,
+                placeholder=placeholder,
+                dominant_color=color,
+                file_hash=md5sum(file),
+                created_at=datetime.utcnow(),
+                updated_at=datetime.utcnow(),
+            ), folder_tags))
+            added += 1
+        else:
+            image_id, size, mtime, missing_placeholder, _ = row
+            values = {}
+            # only recompute metadata when size/mtime changed (why: speed)
+            if size != stat.st_size or mtime != stat.st_mtime:
+                values = dict(
                     size=stat.st_size,
                     mtime=stat.st_mtime,
-                    width=w,
-                    height=h,
                     file_hash=md5sum(file),
-                    created_at=datetime.utcnow(),
                     updated_at=datetime.utcnow(),
                 )
-                s.add(db_img)
-                s.commit()  # Commit to get the image ID
-                s.refresh(db_img)
-                
-                # Auto-tag based on folder structure
-                if auto_tag:
-                    folder_tags = extract_tags_from_path(file, root_dir)
-                    if folder_tags:
-                        assign_tags_to_image(s, db_img, folder_tags)
-                
-                added += 1
+                try:
+                    values["width"], values["height"], values["placeholder"], values["dominant_color"] = (
+                        read_image_info(file)
+                    )
+                except Exception:
+                    values["placeholder"], values["dominant_color"] = PLACEHOLDER_FAILED, None
+                updated += 1
             else:
-                # only recompute metadata when size/mtime changed (why: speed)
-                if db_img.size != stat.st_size or db_img.mtime != stat.st_mtime:
+                if missing_placeholder:
+                    # Catalogued before placeholders existed: fill them in once
                     try:
-                        w, h = read_image_meta(file)
+                        _, _, values["placeholder"], values["dominant_color"] = read_image_info(file)
                     except Exception:
-                        w, h = db_img.width, db_img.height
-                    db_img.size = stat.st_size
-                    db_img.mtime = stat.st_mtime
-                    db_img.width = w
-                    db_img.height = h
-                    db_img.file_hash = md5sum(file)
-                    db_img.updated_at = datetime.utcnow()
-                    updated += 1
-                else:
-                    unchanged += 1
-                
-                # Auto-tag existing images if requested (regardless of whether they were updated)
-                if auto_tag:
-                    folder_tags = extract_tags_from_path(file, root_dir)
-                    if folder_tags:
-                        assign_tags_to_image(s, db_img, folder_tags)
-        if cleanup:
-            rows = s.exec(select(Image)).all()
-            for img in rows:
-                if img.path not in seen_paths:
-                    s.delete(img)
-            # Optionally wipe stale thumbs
-            for t in (root_dir / DEFAULT_THUMB_DIRNAME).glob("*.jpg"):
-                try:
-                    int(t.stem.split("_")[0])
-                except Exception:
-                    continue
-        s.commit()
+                        values["placeholder"] = PLACEHOLDER_FAILED
+                unchanged += 1
+            if values or folder_tags:
+                pending.append((image_id, values, folder_tags))
+        if len(pending) >= SCAN_WRITE_BATCH:
+            _write_batch(pending, tag_ids)
+            pending = []
+    if pending:
+        _write_batch(pending, tag_ids)
+
+    removed = []
+    if cleanup:
+        removed = [(row[0], row[4]) for path, row in known.items() if path not in seen_paths]
+        for i in range(0, len(removed), SCAN_WRITE_BATCH):
+            ids = [image_id for image_id, _ in removed[i:i + SCAN_WRITE_BATCH]]
+            with get_batch_session() as s:
+                s.exec(delete(ImageTagLink).where(ImageTagLink.image_id.in_(ids)))
+                s.exec(delete(Image).where(Image.id.in_(ids)))
+                s.commit()
+            yield_to_interactive()
+
+    if removed:
+        # Wipe thumbnails of images that no longer exist
+        from thumbnails import purge_thumbnails
+
+        purge_thumbnails(root_dir, removed)
 
-    return {"added": added, "updated": updated, "unchanged": unchanged}
\ No newline at end of file
+    return {"added": added, "updated": updated, "unchanged": unchanged}
@@ -0,0 +1,57 @@
+"""Full-text search over filenames, folders and tag names.
+
+``image_fts`` is an FTS5 table keyed by image id with one column each for the
+filename, the folder path below the vault root and the image's tag names.
+Triggers keep it in step with every image, link and tag change and with the
+vault root (see migrations). Every word of the search text is a prefix
+query and all of them must match; results rank by bm25, filename hits
+first, then tags, then folders.
+"""
+import functools
+import re
+from typing import Optional
+
+from sqlalchemy import Float, column, table, text
+
+from models import Image
+
+_fts = table("image_fts", column("rowid"), column("rank", Float))
+# bm25 of the match, lower is better; only valid on a ``searches_fts`` query
+fts_rank = _fts.c.rank
+
+
+@functools.lru_cache(maxsize=None)
+def fts_available() -> bool:
+    """Whether the FTS5 table exists; SQLite may be built without FTS5."""
+    from database import read_engine
+
+    with read_engine.connect() as conn:
+        return bool(
+            conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'image_fts'")).first()
+        )
+
+
+def fts_query(q: str) -> Optional[str]:
+    """FTS5 MATCH expression for search box text; None if it has no words."""
+    words = re.findall(r"\w+", q)
+    # Quoted, so words are never read as FTS5 operators; a word the tokenizer
+    # splits (e.g. "sub_dir") becomes a phrase
+    return " ".join(f'"{word}"*' for word in words) or None
+
+
+def searches_fts(q: str) -> bool:
+    """Whether ``search`` answers ``q`` from the FTS table (and can rank it)."""
+    return fts_query(q) is not None and fts_available()
+
+
+def search(stmt, q: str):
+    """Restrict an ``Image`` query to search matches.
+
+    Without FTS5, or for text without any words, falls back to a filename
+    substring match.
+    """
+    if not searches_fts(q):
+        return stmt.where(Image.filename.contains(q))
+    return stmt.join(_fts, _fts.c.rowid == Image.id).where(
+        text("image_fts MATCH :fts_match").bindparams(fts_match=fts_query(q))
+    )
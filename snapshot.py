@@ -0,0 +1,356 @@
+"""Columnar in-memory snapshot of the catalog for analytics.
+
+One NumPy array per image attribute (id, size, width, height, mtime,
+created_at, directory), rows sorted by id, plus one packed bitset per tag.
+Statistics and range filters are vectorised over these arrays instead of
+iterating ORM objects.
+
+The snapshot refreshes incrementally: images whose ``updated_at`` moved and
+the image and link changes recorded in ``tagindex_log`` (see tagindex.py)
+are merged in; a gap in the log forces a full rebuild. With
+``VAULT_SNAPSHOT_DIR`` set, arrays are saved there as ``.npy`` files and
+memory-mapped on the next start, so a restart only applies what changed.
+
+NumPy is optional; without it ``SNAPSHOT_ENABLED`` is False.
+"""
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Optional
+
+from sqlalchemy import text
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - depends on the environment
+    np = None
+
+# Configuration
+SNAPSHOT_ENABLED = np is not None and os.environ.get("VAULT_SNAPSHOT", "1") != "0"
+SNAPSHOT_DIR = os.environ.get("VAULT_SNAPSHOT_DIR") or None
+
+# Stored columns and their dtypes; "created" is seconds since the epoch (UTC)
+COLUMNS = {
+    "id": "int64",
+    "size": "int64",
+    "width": "int32",
+    "height": "int32",
+    "mtime": "float64",
+    "created": "float64",
+    "dir": "int32",
+}
+
+_IMAGE_ROWS = (
+    "SELECT id, size, width, height, mtime, "
+    "(julianday(created_at) - 2440587.5) * 86400.0, dirpath, updated_at FROM image"
+)
+
+
+class Snapshot:
+    """One consistent set of columns; replaced as a whole on refresh."""
+
+    def __init__(self, cols: dict, dirs: list[str], tags: dict, seq: int, since: Optional[str]):
+        self.cols = cols  # name -> 1-D array, aligned by row
+        self.dirs = dirs  # dir column value -> dirpath
+        self.tags = tags  # tag id -> np.packbits of a row mask
+        self.seq = seq  # last tagindex_log row applied
+        self.since = since  # newest updated_at seen, as stored
+
+    def __len__(self) -> int:
+        return len(self.cols["id"])
+
+    def column(self, name: str):
+        """A stored column, or a derived one: ``pixels`` or ``aspect``."""
+        if name == "pixels":
+            return self.cols["width"].astype("int64") * self.cols["height"]
+        if name == "aspect":
+            height = self.cols["height"]
+            return np.divide(
+                self.cols["width"], height, out=np.zeros(len(self), "float64"), where=height > 0
+            )
+        return self.cols[name]
+
+    def tag_mask(self, tag_id: int):
+        packed = self.tags.get(tag_id)
+        if packed is None:
+            return np.zeros(len(self), bool)
+        return np.unpackbits(packed, count=len(self)).astype(bool)
+
+    def dir_ids(self, dirpath: str) -> list[int]:
+        return [i for i, d in enumerate(self.dirs) if d == dirpath]
+
+
+def _rows_of(ids, image_ids):
+    """Row positions of ``image_ids`` in the sorted ``ids``, and which were found."""
+    image_ids = np.asarray(image_ids, "int64")
+    rows = np.searchsorted(ids, image_ids)
+    found = rows < len(ids)
+    found[found] = ids[rows[found]] == image_ids[found]
+    return rows, found
+
+
+def _column_arrays(rows, dir_index: dict[str, int], dirs: list[str]) -> dict:
+    """Column arrays from image rows, registering new directories."""
+    values = {name: [] for name in COLUMNS}
+    for image_id, size, width, height, mtime, created, dirpath, _ in rows:
+        if dirpath not in dir_index:
+            dir_index[dirpath] = len(dirs)
+            dirs.append(dirpath)
+        for name, value in zip(
+            COLUMNS,
+            (image_id, size, width, height, mtime, created, dir_index[dirpath]),
+        ):
+            values[name].append(value or 0)
+    return {name: np.array(values[name], dtype) for name, dtype in COLUMNS.items()}
+
+
+class CatalogSnapshot:
+    """Keeps the current ``Snapshot`` in step with the database."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._current: Optional[Snapshot] = None
+        self._saved: Optional[Snapshot] = None
+
+    @property
+    def log_seq(self) -> Optional[int]:
+        """Last ``tagindex_log`` row merged in, None before the first build."""
+        current = self._current
+        return current.seq if current is not None else None
+
+    def _build(self, conn) -> Snapshot:
+        seq = conn.execute(text("SELECT coalesce(max(seq), 0) FROM tagindex_log")).scalar()
+        rows = conn.execute(text(_IMAGE_ROWS + " ORDER BY id")).all()
+        dirs: list[str] = []
+        cols = _column_arrays(rows, {}, dirs)
+        ids = cols["id"]
+        tags = {}
+        # Links of deleted tags can outlive them; the join leaves those out
+        links = conn.execute(
+            text(
+                "SELECT l.tag_id, l.image_id FROM imagetaglink l "
+                "JOIN tag ON tag.id = l.tag_id ORDER BY l.tag_id"
+            )
+        ).all()
+        if links:
+            link_tags = np.array([tag_id for tag_id, _ in links], "int64")
+            link_images = np.array([image_id for _, image_id in links], "int64")
+            bounds = np.flatnonzero(np.diff(link_tags)) + 1
+            for tag_ids, image_ids in zip(np.split(link_tags, bounds), np.split(link_images, bounds)):
+                mask = np.zeros(len(ids), bool)
+                positions, found = _rows_of(ids, image_ids)
+                mask[positions[found]] = True
+                tags[int(tag_ids[0])] = np.packbits(mask)
+        since = max((row[-1] for row in rows), default=None)
+        return Snapshot(cols, dirs, tags, seq, since)
+
+    def _refresh(self, conn, snap: Snapshot) -> Snapshot:
+        """``snap`` with every change since it was taken merged in."""
+        latest = conn.execute(text("SELECT coalesce(max(seq), 0) FROM tagindex_log")).scalar()
+        newest = conn.execute(text("SELECT max(updated_at) FROM image")).scalar()
+        if latest == snap.seq and newest == snap.since:
+            return snap
+        first = conn.execute(text("SELECT min(seq) FROM tagindex_log")).scalar()
+        if first is not None and first > snap.seq + 1:
+            return self._build(conn)  # pruned rows we never saw
+        log = conn.execute(
+            text(
+                "SELECT image_id, tag_id, added FROM tagindex_log "
+                "WHERE seq > :seq AND seq <= :latest ORDER BY seq"
+            ),
+            {"seq": snap.seq, "latest": latest},
+        ).all()
+        if any(image_id is None and tag_id is None for image_id, tag_id, _ in log):
+            return self._build(conn)  # rebuild marker
+        inserted = [image_id for image_id, tag_id, added in log if tag_id is None and added]
+        deleted = {image_id for image_id, tag_id, added in log if tag_id is None and not added}
+        changed = conn.execute(
+            text(
+                _IMAGE_ROWS + " WHERE updated_at >= :since OR id IN (SELECT value FROM json_each(:ids))"
+            ),
+            {"since": snap.since or "", "ids": json.dumps(inserted)},
+        ).all()
+
+        # Rows: drop deleted ones, overwrite changed ones, append new ones
+        dirs = list(snap.dirs)
+        dir_index = {d: i for i, d in enumerate(dirs)}
+        fresh = _column_arrays(changed, dir_index, dirs)
+        refreshed = set(fresh["id"].tolist())
+        keep = ~np.isin(snap.cols["id"], list(deleted | refreshed))
+        cols = {
+            name: np.concatenate([snap.cols[name][keep], fresh[name]]) for name in COLUMNS
+        }
+        order = np.argsort(cols["id"], kind="stable")
+        cols = {name: values[order] for name, values in cols.items()}
+
+        # Tag bits follow their rows; rows that are new or rewritten start clear
+        # and get their bits from the link table
+        tags = {}
+        for tag_id in snap.tags:
+            mask = snap.tag_mask(tag_id)
+            mask = np.concatenate([mask[keep], np.zeros(len(fresh["id"]), bool)])[order]
+            tags[tag_id] = mask
+        ids = cols["id"]
+        if refreshed:
+            links = conn.execute(
+                text(
+                    "SELECT l.tag_id, l.image_id FROM imagetaglink l JOIN tag ON tag.id = l.tag_id "
+                    "WHERE l.image_id IN (SELECT value FROM json_each(:ids))"
+                ),
+                {"ids": json.dumps(sorted(refreshed))},
+            ).all()
+            for tag_id, image_id in links:
+                rows, found = _rows_of(ids, [image_id])
+                if found[0]:
+                    tags.setdefault(tag_id, np.zeros(len(ids), bool))[rows[0]] = True
+        for image_id, tag_id, added in log:
+            if image_id is None:
+                tags.pop(tag_id, None)  # deleted tag
+            elif tag_id is not None and image_id not in refreshed:
+                rows, found = _rows_of(ids, [image_id])
+                if found[0]:
+                    tags.setdefault(tag_id, np.zeros(len(ids), bool))[rows[0]] = bool(added)
+        since = max([snap.since or ""] + [row[-1] for row in changed]) or None
+        return Snapshot(
+            cols, dirs, {tag_id: np.packbits(mask) for tag_id, mask in tags.items()}, latest, since
+        )
+
+    def get(self) -> Snapshot:
+        """The up-to-date snapshot, built or refreshed as needed."""
+        from database import read_engine
+
+        with self._lock:
+            if self._current is None and SNAPSHOT_DIR:
+                self._current = self._saved = _load(Path(SNAPSHOT_DIR))
+            with read_engine.connect() as conn:
+                if self._current is None:
+                    self._current = self._build(conn)
+                else:
+                    self._current = self._refresh(conn, self._current)
+            if SNAPSHOT_DIR and self._saved is None:
+                _save(Path(SNAPSHOT_DIR), self._current)
+                self._saved = self._current
+            return self._current
+
+    def save(self) -> None:
+        """Persist the snapshot if ``VAULT_SNAPSHOT_DIR`` is set and it changed."""
+        with self._lock:
+            if SNAPSHOT_DIR and self._current is not None and self._current is not self._saved:
+                _save(Path(SNAPSHOT_DIR), self._current)
+                self._saved = self._current
+
+
+def _save(directory: Path, snap: Snapshot) -> None:
+    directory.mkdir(parents=True, exist_ok=True)
+    arrays = dict(snap.cols)
+    tag_ids = sorted(snap.tags)
+    arrays["tag_ids"] = np.array(tag_ids, "int64")
+    arrays["tag_bits"] = (
+        np.stack([snap.tags[t] for t in tag_ids])
+        if tag_ids
+        else np.zeros((0, (len(snap) + 7) // 8), "uint8")
+    )
+    for name, values in arrays.items():
+        tmp = directory / f".{name}.npy.tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, values)
+        os.replace(tmp, directory / f"{name}.npy")
+    # Written last: it tells _load which state the arrays hold
+    meta = {"seq": snap.seq, "since": snap.since, "dirs": snap.dirs}
+    tmp = directory / ".meta.json.tmp"
+    tmp.write_text(json.dumps(meta))
+    os.replace(tmp, directory / "meta.json")
+
+
+def _load(directory: Path) -> Optional[Snapshot]:
+    """Memory-map a saved snapshot; None if there is none or it is unreadable."""
+    try:
+        meta = json.loads((directory / "meta.json").read_text())
+        cols = {name: np.load(directory / f"{name}.npy", mmap_mode="r") for name in COLUMNS}
+        tag_ids = np.load(directory / "tag_ids.npy")
+        tag_bits = np.load(directory / "tag_bits.npy", mmap_mode="r")
+    except (OSError, ValueError, KeyError):
+        return None
+    tags = {int(tag_id): tag_bits[i] for i, tag_id in enumerate(tag_ids)}
+    return Snapshot(cols, meta["dirs"], tags, meta["seq"], meta["since"])
+
+
+# Columns accepted by range filters and histograms
+FIELDS = ("size", "width", "height", "pixels", "aspect", "mtime", "created")
+
+
+def filter_mask(
+    snap: Snapshot,
+    ranges: dict[str, tuple[Optional[float], Optional[float]]],
+    tag_ids=(),
+    dirpath: Optional[str] = None,
+):
+    """Rows within every ``[low, high)`` range, carrying all tags, in ``dirpath``."""
+    mask = np.ones(len(snap), bool)
+    for name, (low, high) in ranges.items():
+        values = snap.column(name)
+        if low is not None:
+            mask &= values >= low
+        if high is not None:
+            mask &= values < high
+    for tag_id in tag_ids:
+        mask &= snap.tag_mask(tag_id)
+    if dirpath is not None:
+        mask &= np.isin(snap.cols["dir"], snap.dir_ids(dirpath))
+    return mask
+
+
+def histogram(snap: Snapshot, mask, field: str, bins: int, log: bool = False) -> dict:
+    """Counts of ``field`` over the selected rows in ``bins`` equal (or log-spaced) bins."""
+    values = snap.column(field)[mask]
+    if log:
+        values = values[values > 0]
+    if not len(values):
+        return {"field": field, "edges": [], "counts": []}
+    low, high = float(values.min()), float(values.max())
+    if log:
+        edges = np.geomspace(low, high if high > low else low * 2, bins + 1)
+    else:
+        edges = np.linspace(low, high if high > low else low + 1, bins + 1)
+    counts, edges = np.histogram(values, edges)
+    return {"field": field, "edges": edges.tolist(), "counts": counts.tolist()}
+
+
+def summary(snap: Snapshot, mask) -> dict:
+    """Count, total size, per-field statistics and orientation of the selected rows."""
+    n = int(mask.sum())
+    result = {"count": n, "total_size": int(snap.cols["size"][mask].sum()), "fields": {}}
+    if n:
+        for field in FIELDS:
+            values = snap.column(field)[mask]
+            result["fields"][field] = {
+                "min": values.min().item(),
+                "max": values.max().item(),
+                "mean": float(values.mean()),
+                "median": float(np.median(values)),
+            }
+    aspect = snap.column("aspect")[mask]
+    known = aspect > 0
+    result["orientation"] = {
+        "portrait": int((known & (aspect < 0.95)).sum()),
+        "square": int(((aspect >= 0.95) & (aspect <= 1.05)).sum()),
+        "landscape": int(((aspect > 1.05) & (aspect < 2)).sum()),
+        "panorama": int((aspect >= 2).sum()),
+        "unknown": int((~known).sum()),
+    }
+    return result
+
+
+def newest_ids(snap: Snapshot, mask, limit: int) -> list[int]:
+    """Ids of up to ``limit`` selected rows, most recently added first."""
+    if limit <= 0:
+        return []
+    rows = np.flatnonzero(mask)
+    if len(rows) > limit:
+        rows = rows[np.argpartition(-snap.cols["created"][rows], limit - 1)[:limit]]
+    rows = rows[np.argsort(-snap.cols["created"][rows], kind="stable")]
+    return snap.cols["id"][rows].tolist()
+
+
+catalog_snapshot = CatalogSnapshot()
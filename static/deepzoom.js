@@ -0,0 +1,131 @@
+// Minimal Deep Zoom (DZI) viewer: wheel or double-click to zoom, drag to pan.
+// Only tiles covering the visible area at the current zoom are requested; the
+// preview image stays underneath as a backdrop while they load.
+class DeepZoomViewer {
+  constructor(container, dziUrl, backdropUrl) {
+    this.container = container;
+    this.tileBase = dziUrl.replace(/\.dzi$/, '_files/');
+    this.tiles = new Map();
+    this.backdrop = document.createElement('img');
+    this.backdrop.className = 'dz-backdrop';
+    this.backdrop.src = backdropUrl;
+    this.backdrop.draggable = false;
+    container.appendChild(this.backdrop);
+    this.ready = fetch(dziUrl)
+      .then((r) => r.text())
+      .then((text) => this.init(new DOMParser().parseFromString(text, 'application/xml')));
+  }
+
+  init(doc) {
+    const image = doc.documentElement;
+    const size = image.getElementsByTagName('Size')[0];
+    this.tileSize = parseInt(image.getAttribute('TileSize'), 10);
+    this.format = image.getAttribute('Format');
+    this.width = parseInt(size.getAttribute('Width'), 10);
+    this.height = parseInt(size.getAttribute('Height'), 10);
+    this.maxLevel = Math.ceil(Math.log2(Math.max(this.width, this.height)));
+    this.fit();
+    this.bindEvents();
+    window.addEventListener('resize', () => this.fit());
+  }
+
+  fit() {
+    const box = this.container.getBoundingClientRect();
+    this.minScale = Math.min(box.width / this.width, box.height / this.height);
+    this.scale = this.minScale;
+    this.x = (box.width - this.width * this.scale) / 2;
+    this.y = (box.height - this.height * this.scale) / 2;
+    this.draw();
+  }
+
+  zoomAt(factor, cx, cy) {
+    // Keep the image point under (cx, cy) fixed; never past 2x device pixels
+    const scale = Math.min(Math.max(this.scale * factor, this.minScale), 2 * (window.devicePixelRatio || 1));
+    this.x = cx - (cx - this.x) * (scale / this.scale);
+    this.y = cy - (cy - this.y) * (scale / this.scale);
+    this.scale = scale;
+    this.draw();
+  }
+
+  bindEvents() {
+    const el = this.container;
+    el.addEventListener('wheel', (e) => {
+      e.preventDefault();
+      const box = el.getBoundingClientRect();
+      this.zoomAt(Math.exp(-e.deltaY * 0.002), e.clientX - box.left, e.clientY - box.top);
+    }, { passive: false });
+    el.addEventListener('dblclick', (e) => {
+      const box = el.getBoundingClientRect();
+      this.zoomAt(e.shiftKey ? 0.5 : 2, e.clientX - box.left, e.clientY - box.top);
+    });
+    let drag = null;
+    el.addEventListener('pointerdown', (e) => {
+      drag = { x: e.clientX - this.x, y: e.clientY - this.y };
+      el.setPointerCapture(e.pointerId);
+    });
+    el.addEventListener('pointermove', (e) => {
+      if (!drag) return;
+      this.x = e.clientX - drag.x;
+      this.y = e.clientY - drag.y;
+      this.draw();
+    });
+    el.addEventListener('pointerup', () => { drag = null; });
+  }
+
+  draw() {
+    if (this.pending) return;
+    this.pending = requestAnimationFrame(() => {
+      this.pending = null;
+      this.render();
+    });
+  }
+
+  render() {
+    const box = this.container.getBoundingClientRect();
+    const dpr = window.devicePixelRatio || 1;
+    Object.assign(this.backdrop.style, {
+      left: `${this.x}px`, top: `${this.y}px`,
+      width: `${this.width * this.scale}px`, height: `${this.height * this.scale}px`,
+    });
+    // Coarsest level that still has at least one tile pixel per device pixel
+    const level = Math.min(this.maxLevel, Math.max(0, Math.ceil(this.maxLevel + Math.log2(this.scale * dpr))));
+    const levelScale = Math.pow(2, this.maxLevel - level);  // image px per level px
+    const levelWidth = Math.ceil(this.width / levelScale);
+    const levelHeight = Math.ceil(this.height / levelScale);
+    const step = this.tileSize * levelScale * this.scale;  // screen px per tile
+    const firstCol = Math.max(0, Math.floor(-this.x / step));
+    const firstRow = Math.max(0, Math.floor(-this.y / step));
+    const lastCol = Math.min(Math.ceil(levelWidth / this.tileSize) - 1, Math.floor((box.width - this.x) / step));
+    const lastRow = Math.min(Math.ceil(levelHeight / this.tileSize) - 1, Math.floor((box.height - this.y) / step));
+
+    const wanted = new Set();
+    for (let row = firstRow; row <= lastRow; row++) {
+      for (let col = firstCol; col <= lastCol; col++) {
+        const key = `${level}/${col}_${row}`;
+        wanted.add(key);
+        let tile = this.tiles.get(key);
+        if (!tile) {
+          tile = document.createElement('img');
+          tile.className = 'dz-tile';
+          tile.draggable = false;
+          tile.src = `${this.tileBase}${key}.${this.format}`;
+          this.container.appendChild(tile);
+          this.tiles.set(key, tile);
+        }
+        const w = Math.min(this.tileSize, levelWidth - col * this.tileSize);
+        const h = Math.min(this.tileSize, levelHeight - row * this.tileSize);
+        Object.assign(tile.style, {
+          left: `${this.x + col * step}px`, top: `${this.y + row * step}px`,
+          width: `${w * levelScale * this.scale}px`, height: `${h * levelScale * this.scale}px`,
+        });
+      }
+    }
+    for (const [key, tile] of this.tiles) {
+      if (!wanted.has(key)) {
+        tile.src = '';  // cancels the request if still in flight
+        tile.remove();
+        this.tiles.delete(key);
+      }
+    }
+  }
+}
@@ -0,0 +1,70 @@
+"""Cached tag catalog and batched tag loading for pages of images.
+
+Every page needs the full tag list (filters, tag pickers) and the tags of
+each image shown. The catalog is loaded once per process and reloaded when
+the ``tags`` version stamp, bumped by triggers on any tag insert, rename,
+recolor or delete, moves on; usage counts in it may lag. Tags of a page of
+images then take one query on the link table.
+"""
+import threading
+from typing import Iterable, Optional
+
+from sqlalchemy import text
+from sqlmodel import select
+
+from models import ImageTagLink, Tag
+
+# (version, tags by id in name order); replaced whole, never mutated
+_catalog: Optional[tuple[int, dict[int, Tag]]] = None
+_catalog_lock = threading.Lock()
+
+
+def tag_catalog(session) -> dict[int, Tag]:
+    """All tags by id, in name order. Shared between requests: do not modify."""
+    global _catalog
+    version = session.execute(
+        text("SELECT version FROM version_stamp WHERE name = 'tags'")
+    ).scalar()
+    cached = _catalog
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    with _catalog_lock:
+        if _catalog is not None and _catalog[0] == version:
+            return _catalog[1]
+        tags = session.exec(select(Tag).order_by(Tag.name)).all()
+        for tag in tags:
+            session.expunge(tag)  # outlives this session
+        _catalog = (version, {tag.id: tag for tag in tags})
+        return _catalog[1]
+
+
+def tag_named(session, name: str) -> Optional[Tag]:
+    """The catalog tag with exactly this name, if any."""
+    found = tags_by_name(session, [name])
+    return found[0] if found else None
+
+
+def tags_by_name(session, names: Iterable[str]) -> list[Tag]:
+    """Catalog tags with these exact names, in the order given; unknown names are skipped."""
+    by_name = {tag.name: tag for tag in tag_catalog(session).values()}
+    return [by_name[name] for name in names if name in by_name]
+
+
+def load_image_tags(session, image_ids: Iterable[int]) -> dict[int, list[Tag]]:
+    """Tags of each image, in name order, from one query."""
+    catalog = tag_catalog(session)
+    order = {tag_id: i for i, tag_id in enumerate(catalog)}
+    image_ids = list(image_ids)
+    image_tags: dict[int, list[Tag]] = {image_id: [] for image_id in image_ids}
+    if not image_ids:
+        return image_tags
+    links = session.exec(
+        select(ImageTagLink.image_id, ImageTagLink.tag_id).where(
+            ImageTagLink.image_id.in_(image_ids)
+        )
+    ).all()
+    for image_id, tag_id in sorted(links, key=lambda link: order.get(link[1], len(order))):
+        tag = catalog.get(tag_id)
+        if tag is not None:
+            image_tags[image_id].append(tag)
+    return image_tags
@@ -0,0 +1,252 @@
+"""In-memory bitmap index of tag links.
+
+Every tag maps to a bitmap of the image ids carrying it, so ALL-of, ANY-of
+and NONE-of filters and their counts are set operations instead of
+GROUP BY / NOT IN queries. Bitmaps are ``pyroaring`` compressed bitmaps when
+that package is installed and plain Python integers used as bitsets
+otherwise.
+
+The index stays current through the ``tagindex_log`` table, which triggers
+append to on every link, image and tag change (see migrations). Each query
+first applies the log rows it has not seen yet; a missing stretch of the log
+or an explicit marker row forces a full rebuild.
+
+Queries never write. A background thread (``run_log_pruner``) records how far
+this process's log readers got in ``tagindex_reader`` and deletes only rows
+every live reader, in any worker, has already applied.
+"""
+import itertools
+import os
+import socket
+import threading
+import time
+from typing import Iterable, Optional
+
+from sqlalchemy import func, select, text
+from sqlalchemy.exc import SQLAlchemyError
+
+try:
+    from pyroaring import BitMap
+except ImportError:  # pragma: no cover - depends on the environment
+    BitMap = None
+
+# Configuration
+TAG_INDEX_ENABLED = os.environ.get("VAULT_TAG_INDEX", "1") != "0"
+# The newest log rows are kept even when every reader has applied them
+TAG_INDEX_LOG_KEEP = 10_000
+TAG_INDEX_PRUNE_SECONDS = 300
+# Readers not heard from for this long (e.g. stopped workers) no longer hold the log back
+TAG_INDEX_READER_TIMEOUT = 3600
+
+
+class IntBitmap:
+    """The subset of ``pyroaring.BitMap`` used here, backed by a Python int."""
+
+    __slots__ = ("bits",)
+
+    def __init__(self, ids: Iterable[int] = (), bits: int = 0):
+        ids = list(ids)
+        if ids:
+            buf = bytearray(max(ids) // 8 + 1)
+            for i in ids:
+                buf[i >> 3] |= 1 << (i & 7)
+            bits |= int.from_bytes(buf, "little")
+        self.bits = bits
+
+    def add(self, i: int) -> None:
+        self.bits |= 1 << i
+
+    def discard(self, i: int) -> None:
+        self.bits &= ~(1 << i)
+
+    def __and__(self, other: "IntBitmap") -> "IntBitmap":
+        return IntBitmap(bits=self.bits & other.bits)
+
+    def __or__(self, other: "IntBitmap") -> "IntBitmap":
+        return IntBitmap(bits=self.bits | other.bits)
+
+    def __sub__(self, other: "IntBitmap") -> "IntBitmap":
+        return IntBitmap(bits=self.bits & ~other.bits)
+
+    def __len__(self) -> int:
+        return self.bits.bit_count()
+
+    def __iter__(self):
+        raw = self.bits.to_bytes((self.bits.bit_length() + 7) // 8, "little")
+        for offset, byte in enumerate(raw):
+            while byte:
+                low = byte & -byte
+                yield offset * 8 + low.bit_length() - 1
+                byte ^= low
+
+
+Bitmap = BitMap or IntBitmap
+
+
+class TagIndex:
+    """Tag id -> bitmap of image ids, refreshed from ``tagindex_log``."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._seq: Optional[int] = None  # last log row applied; None = not built
+        self._images = Bitmap()
+        self._tags: dict[int, Bitmap] = {}
+
+    def _build(self, conn) -> None:
+        # Take the log position first: replaying rows the snapshot already
+        # reflects is harmless, every pair ends at its latest change
+        self._seq = conn.execute(text("SELECT coalesce(max(seq), 0) FROM tagindex_log")).scalar()
+        self._images = Bitmap(conn.execute(text("SELECT id FROM image")).scalars())
+        rows = conn.execute(
+            text("SELECT tag_id, image_id FROM imagetaglink ORDER BY tag_id, image_id")
+        )
+        self._tags = {
+            tag_id: Bitmap(image_id for _, image_id in links)
+            for tag_id, links in itertools.groupby(rows, key=lambda row: row[0])
+        }
+
+    def _apply(self, image_id: Optional[int], tag_id: Optional[int], added: bool) -> bool:
+        """Apply one log row; False when only a rebuild can."""
+        if image_id is None and tag_id is None:
+            return False
+        if tag_id is None:
+            if added:
+                self._images.add(image_id)
+            else:
+                self._images.discard(image_id)
+                for images in self._tags.values():
+                    images.discard(image_id)
+        elif image_id is None:
+            self._tags.pop(tag_id, None)
+        elif added:
+            self._tags.setdefault(tag_id, Bitmap()).add(image_id)
+        else:
+            self._tags.get(tag_id, Bitmap()).discard(image_id)
+        return True
+
+    def _refresh(self, conn) -> None:
+        if self._seq is None:
+            self._build(conn)
+            return
+        first = conn.execute(text("SELECT min(seq) FROM tagindex_log")).scalar()
+        if first is not None and first > self._seq + 1:
+            self._build(conn)  # rows we never saw were pruned
+            return
+        rows = conn.execute(
+            text("SELECT seq, image_id, tag_id, added FROM tagindex_log WHERE seq > :seq ORDER BY seq"),
+            {"seq": self._seq},
+        )
+        for seq, image_id, tag_id, added in rows:
+            if not self._apply(image_id, tag_id, added):
+                self._build(conn)
+                return
+            self._seq = seq
+
+    @property
+    def log_seq(self) -> Optional[int]:
+        """Last log row applied, None before the first build."""
+        return self._seq
+
+    def warm(self) -> None:
+        """Build the index now rather than on the first filtered query."""
+        from database import read_engine
+
+        with self._lock, read_engine.connect() as conn:
+            self._refresh(conn)
+
+    def match(
+        self,
+        all_of: Iterable[int] = (),
+        any_of: Iterable[int] = (),
+        none_of: Iterable[int] = (),
+    ) -> tuple[Bitmap, Bitmap]:
+        """Image ids passing the filter, and the ids of all images."""
+        from database import read_engine
+
+        with self._lock:
+            with read_engine.connect() as conn:
+                self._refresh(conn)
+            empty = Bitmap()
+            result = self._images
+            for tag_id in all_of:
+                result = result & self._tags.get(tag_id, empty)
+            any_of = list(any_of)
+            if any_of:
+                union = Bitmap()
+                for tag_id in any_of:
+                    union = union | self._tags.get(tag_id, empty)
+                result = result & union
+            for tag_id in none_of:
+                result = result - self._tags.get(tag_id, empty)
+            if result is self._images:
+                result = result | empty  # callers get copies, never live state
+            images = self._images | empty
+        return result, images
+
+
+def restrict(stmt, column, ids: Bitmap, images: Bitmap):
+    """Limit ``stmt`` to rows whose ``column`` is in ``ids``.
+
+    The ids travel as one JSON array bound parameter; when they cover most of
+    ``images`` the shorter complement is excluded instead.
+    """
+    if len(ids) * 2 > len(images):
+        return stmt.where(column.not_in(_json_ids(images - ids)))
+    return stmt.where(column.in_(_json_ids(ids)))
+
+
+def _json_ids(ids: Bitmap):
+    values = func.json_each("[" + ",".join(map(str, ids)) + "]").table_valued("value")
+    return select(values.c.value)
+
+
+def prune_log(readers: dict) -> int:
+    """Record this process's log readers, then drop rows all live readers applied.
+
+    ``readers`` maps names to objects with a ``log_seq``. Returns the number
+    of rows deleted.
+    """
+    from database import engine
+
+    now = time.time()
+    process = f"{socket.gethostname()}:{os.getpid()}"
+    with engine.begin() as conn:
+        for name, reader in readers.items():
+            if reader.log_seq is not None:
+                conn.execute(
+                    text(
+                        "INSERT INTO tagindex_reader (name, seq, seen_at) "
+                        "VALUES (:name, :seq, :now) ON CONFLICT(name) "
+                        "DO UPDATE SET seq = excluded.seq, seen_at = excluded.seen_at"
+                    ),
+                    {"name": f"{name}@{process}", "seq": reader.log_seq, "now": now},
+                )
+        conn.execute(
+            text("DELETE FROM tagindex_reader WHERE seen_at < :cutoff"),
+            {"cutoff": now - TAG_INDEX_READER_TIMEOUT},
+        )
+        floor, latest = conn.execute(
+            text(
+                "SELECT (SELECT min(seq) FROM tagindex_reader), "
+                "(SELECT coalesce(max(seq), 0) FROM tagindex_log)"
+            )
+        ).one()
+        bound = latest - TAG_INDEX_LOG_KEEP
+        if floor is not None:
+            # Keep each reader's own last row so it can tell nothing is missing
+            bound = min(bound, floor)
+        deleted = conn.execute(text("DELETE FROM tagindex_log WHERE seq < :bound"), {"bound": bound})
+        return deleted.rowcount
+
+
+def run_log_pruner(readers: dict) -> None:
+    """Background loop: ``prune_log`` every ``TAG_INDEX_PRUNE_SECONDS``."""
+    while True:
+        time.sleep(TAG_INDEX_PRUNE_SECONDS)
+        try:
+            prune_log(readers)
+        except SQLAlchemyError:
+            pass  # busy with a long write; try again next round
+
+
+tag_index = TagIndex()
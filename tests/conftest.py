@@ -0,0 +1,80 @@
+"""Shared fixtures: the app on a throwaway database and a small generated vault."""
+import os
+import re
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+# App modules bind the database path and their settings at import time
+_TMP = Path(tempfile.mkdtemp(prefix="vault-tests-"))
+os.environ["VAULT_DB"] = str(_TMP / "vault.db")
+os.environ["VAULT_WARMUP"] = "0"
+os.environ["VAULT_THUMB_WORKERS"] = "1"
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# relative path -> (width, height); folders become tags when scanning
+VAULT_FILES = {
+    "Portraits/anna.jpg": (600, 900),
+    "Portraits/ben.jpg": (640, 960),
+    "Portraits/studio_lights/carla.png": (800, 800),
+    "Landscapes/lake.jpg": (1600, 900),
+    "Landscapes/mountain_sunrise.webp": (1920, 1080),
+    "Landscapes/beach.jpg": (1200, 800),
+}
+
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+
+    import app
+
+    with TestClient(app.app) as c:
+        yield c
+
+
+@pytest.fixture
+def vault(client, tmp_path):
+    """A freshly scanned vault (database reset first); returns its root."""
+    from PIL import Image as PILImage
+
+    root = tmp_path / "Vault"
+    for i, (name, size) in enumerate(VAULT_FILES.items()):
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        PILImage.new("RGB", size, (i * 40, 120, 200 - i * 30)).save(path)
+    r = client.post(
+        "/scan",
+        data={"root_dir": str(root), "auto_tag": "1", "reset_db": "1"},
+        follow_redirects=False,
+    )
+    assert r.status_code == 303, r.text
+    return root
+
+
+@pytest.fixture
+def image_ids(client):
+    """Ids of the image cards on a listing page, in page order."""
+
+    def ids(url: str, **params) -> list[int]:
+        r = client.get(url, params=params) if params else client.get(url)
+        assert r.status_code == 200, r.text
+        return list(dict.fromkeys(int(i) for i in re.findall(r'href="/images/(\d+)', r.text)))
+
+    return ids
+
+
+@pytest.fixture
+def image_id(vault):
+    """Id of a vault image by its path relative to the root."""
+    from database import get_read_session
+    from models import Image
+    from sqlmodel import select
+
+    def lookup(name: str) -> int:
+        with get_read_session() as s:
+            return s.exec(select(Image.id).where(Image.path == str(vault / name))).one()
+
+    return lookup
@@ -0,0 +1,72 @@
+"""Analytics endpoints over the columnar catalog snapshot."""
+import pytest
+
+pytest.importorskip("numpy")
+
+import routes  # noqa: E402
+from database import engine  # noqa: E402
+from snapshot import CatalogSnapshot, catalog_snapshot  # noqa: E402
+
+pytestmark = pytest.mark.usefixtures("vault")
+
+
+def get(client, path, **params):
+    r = client.get(f"/api/analytics/{path}", params=params)
+    assert r.status_code == 200, r.text
+    return r.json()
+
+
+def assert_matches_fresh_build():
+    current = catalog_snapshot.get()
+    with engine.connect() as conn:
+        fresh = CatalogSnapshot()._build(conn)
+    for name in current.cols:
+        if name != "dir":
+            assert current.cols[name].tolist() == fresh.cols[name].tolist(), name
+    assert [current.dirs[i] for i in current.cols["dir"]] == [fresh.dirs[i] for i in fresh.cols["dir"]]
+    used = {tag_id for tag_id in current.tags if current.tag_mask(tag_id).any()}
+    assert used == set(fresh.tags)
+    for tag_id in used:
+        assert current.tag_mask(tag_id).tolist() == fresh.tag_mask(tag_id).tolist()
+
+
+def test_summary(client):
+    summary = get(client, "summary")
+    assert summary["count"] == 6
+    assert summary["fields"]["width"]["max"] == 1920
+    assert summary["orientation"] == {
+        "portrait": 2, "square": 1, "landscape": 3, "panorama": 0, "unknown": 0
+    }
+
+
+def test_filters(client, vault, image_id):
+    assert get(client, "summary", tags="Portraits", width_min=640)["count"] == 2
+    assert get(client, "summary", width_min=640, width_max=1600)["count"] == 3
+    assert get(client, "summary", tags="No Such Tag")["count"] == 0
+    selected = get(client, "images", dir=str(vault / "Portraits/studio_lights"))
+    assert selected["ids"] == [image_id("Portraits/studio_lights/carla.png")]
+    assert get(client, "images", created_min="2000-01-01", limit=2)["count"] == 6
+
+
+def test_histogram(client):
+    hist = get(client, "histogram", field="width", bins=4)
+    assert len(hist["edges"]) == 5 and sum(hist["counts"]) == 6
+    assert client.get("/api/analytics/histogram", params={"field": "nope"}).status_code == 400
+    assert client.get("/api/analytics/summary", params={"size_min": "x"}).status_code == 400
+
+
+def test_snapshot_follows_changes(client, vault, image_id):
+    catalog_snapshot.get()
+    lake = image_id("Landscapes/lake.jpg")
+    client.post(f"/images/{lake}/tags/assign", data={"name": "Fresh"}, follow_redirects=False)
+    assert_matches_fresh_build()
+    client.post(f"/images/{image_id('Portraits/ben.jpg')}/delete", follow_redirects=False)
+    assert_matches_fresh_build()
+    client.post("/scan", data={"root_dir": str(vault)}, follow_redirects=False)
+    assert_matches_fresh_build()
+    assert get(client, "summary", tags="Fresh")["count"] == 1
+
+
+def test_unavailable_without_numpy(client, monkeypatch):
+    monkeypatch.setattr(routes, "SNAPSHOT_ENABLED", False)
+    assert client.get("/api/analytics/summary").status_code == 503
@@ -0,0 +1,65 @@
+"""Page atlases are opt-in and built from the cached grid thumbnails."""
+import io
+import re
+
+import pytest
+from PIL import Image as PILImage
+
+import routes
+from atlas import ATLAS_CELL, atlas_cell_width
+from thumbnails import GRID_THUMB_WIDTH, negotiate_format
+from thumbstore import get_thumb_store
+
+ACCEPT = "image/avif,image/webp,*/*"
+
+
+@pytest.fixture
+def atlas_url(client, vault, monkeypatch):
+    monkeypatch.setattr(routes, "ATLAS_ENABLED", True)
+    page = client.get("/images")
+    return re.search(r"url\('(/thumb/atlas\?[^']+)'\)", page.text).group(1).replace("&amp;", "&")
+
+
+def test_grid_uses_thumbnails_by_default(client, image_ids):
+    page = client.get("/images")
+    assert "/thumb/atlas" not in page.text
+    assert len(re.findall(r'src="/thumb/\d+\?w=360"', page.text)) == len(image_ids("/images"))
+
+
+@pytest.mark.parametrize(
+    "size, expected",
+    [
+        ((600, 900), GRID_THUMB_WIDTH),
+        ((800, 800), GRID_THUMB_WIDTH),
+        ((1920, 1080), 456),
+        ((0, 0), GRID_THUMB_WIDTH),
+    ],
+)
+def test_cell_thumbnails_cover_a_cell(size, expected):
+    width = atlas_cell_width(*size)
+    assert width == expected
+    if size[1]:
+        assert width * size[1] / size[0] >= min(ATLAS_CELL, size[1])
+
+
+def test_atlas_is_built_from_grid_thumbnails(client, vault, image_id, atlas_url):
+    r = client.get(atlas_url, headers={"Accept": ACCEPT})
+    assert r.status_code == 200, r.text
+    assert r.headers["content-type"] == "image/webp"
+    sheet = PILImage.open(io.BytesIO(r.content))
+    assert sheet.size == (3 * ATLAS_CELL, 2 * ATLAS_CELL)  # 6 images
+
+    # The cells went through the ordinary thumbnail cache, so the grid
+    # thumbnail of a tall image is now a cache hit
+    store = get_thumb_store(vault)
+    hits = store.stats()["hits"]
+    anna = client.get(f"/thumb/{image_id('Portraits/anna.jpg')}", headers={"Accept": ACCEPT})
+    assert anna.status_code == 200
+    assert anna.headers["content-type"] == f"image/{negotiate_format(ACCEPT)}"
+    assert store.stats()["hits"] == hits + 1
+
+
+def test_undecodable_image_leaves_a_blank_cell(client, vault, atlas_url):
+    (vault / "Landscapes/lake.jpg").write_bytes(b"\xff\xd8 not really a jpeg")
+    r = client.get(atlas_url)
+    assert r.status_code == 200, r.text
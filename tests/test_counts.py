@@ -0,0 +1,58 @@
+"""Listing counts: exact below the cap, "at least N" above it, cached per catalog version."""
+import re
+
+import pytest
+from sqlmodel import select
+
+import counts
+from counts import count_images
+from database import get_read_session, read_engine
+from models import Image
+
+pytestmark = pytest.mark.usefixtures("vault")
+
+
+@pytest.fixture(autouse=True)
+def _empty_cache():
+    counts._cache.clear()
+
+
+def results_line(client, **params) -> str:
+    page = client.get("/images", params=params)
+    assert page.status_code == 200
+    return re.search(r'class="results-info[^"]*">([^<]+)<', page.text).group(1)
+
+
+def test_exact_below_the_cap():
+    with get_read_session() as s:
+        assert count_images(s, select(Image), "all") == (6, True)
+        assert count_images(s, select(Image).where(Image.width > 1000), "wide") == (3, True)
+
+
+def test_capped_above_the_limit(client, monkeypatch):
+    monkeypatch.setattr(counts, "COUNT_LIMIT", 4)
+    assert results_line(client) == "At least 4 results"
+    assert results_line(client, q="lake") == "1 results"
+
+
+def test_cached_until_the_catalog_changes(client, image_id):
+    from sqlalchemy import event
+
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    with get_read_session() as s:
+        assert count_images(s, select(Image), "all") == (6, True)
+    event.listen(read_engine, "before_cursor_execute", record)
+    try:
+        with get_read_session() as s:
+            assert count_images(s, select(Image), "all") == (6, True)
+        # Only the catalog version was read
+        assert len(statements) == 1 and "tagindex_log" in statements[0]
+        client.post(f"/images/{image_id('Portraits/anna.jpg')}/delete", follow_redirects=False)
+        with get_read_session() as s:
+            assert count_images(s, select(Image), "all") == (5, True)
+    finally:
+        event.remove(read_engine, "before_cursor_execute", record)
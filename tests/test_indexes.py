@@ -0,0 +1,40 @@
+"""Query plans of the hot lookups use the indexes added by the migrations."""
+import pytest
+
+from database import engine, init_db
+
+
+def query_plan(sql: str, **params) -> list[str]:
+    with engine.connect() as conn:
+        rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}", params or ()).all()
+    return [row[-1] for row in rows]
+
+
+def assert_indexed(plan: list[str], index: str) -> None:
+    assert any(index in step for step in plan), plan
+    assert not any("USE TEMP B-TREE" in step for step in plan), plan
+    # A bare "SCAN image" reads the whole table in rowid order
+    assert "SCAN image" not in plan, plan
+
+
+@pytest.mark.usefixtures("vault")
+def test_link_lookup_by_tag_uses_reverse_index():
+    plan = query_plan("SELECT image_id FROM imagetaglink WHERE tag_id = 1")
+    assert_indexed(plan, "ix_imagetaglink_tag_id_image_id")
+
+
+@pytest.mark.usefixtures("vault")
+@pytest.mark.parametrize("column", ["created_at", "updated_at"])
+def test_sorts_read_their_index(column):
+    plan = query_plan(f"SELECT id FROM image ORDER BY {column} DESC LIMIT 100")
+    assert_indexed(plan, f"ix_image_{column}")
+
+
+@pytest.mark.usefixtures("vault")
+def test_migrate_is_idempotent():
+    from migrations import SCHEMA_VERSION, migrate, schema_version
+
+    init_db()
+    assert migrate(engine) == []
+    with engine.connect() as conn:
+        assert schema_version(conn) == SCHEMA_VERSION
@@ -0,0 +1,93 @@
+"""Keyset pages walk every sort in order, forwards and back, without gaps."""
+import html
+import re
+
+import pytest
+from sqlalchemy import text
+from sqlmodel import select
+
+from database import get_read_session
+from models import Image
+from pagination import SORTS, decode_cursor, encode_cursor, keyset_page
+from search import fts_query
+
+pytestmark = pytest.mark.usefixtures("vault")
+
+
+def expected_order(sort: str, descending: bool) -> list[int]:
+    spec = SORTS[sort]
+    with get_read_session() as s:
+        rows = s.exec(select(Image)).all()
+
+    def key(img):
+        value = getattr(img, spec.column.key)
+        return (value.lower() if spec.collation == "NOCASE" else value), img.id
+
+    return [img.id for img in sorted(rows, key=key, reverse=descending)]
+
+
+@pytest.mark.parametrize("sort", sorted(SORTS))
+@pytest.mark.parametrize("descending", [False, True])
+def test_pages_cover_the_sort_order(sort, descending):
+    seen, pages, after = [], [], None
+    with get_read_session() as s:
+        while True:
+            page = keyset_page(s, select(Image), sort, descending, 4, after=after)
+            assert (page.prev_cursor is not None) == (after is not None)
+            pages.append(page)
+            seen += [img.id for img in page.images]
+            if page.next_cursor is None:
+                break
+            after = page.next_cursor
+        assert seen == expected_order(sort, descending)
+
+        # Walking back from the last page gives the same pages
+        back = keyset_page(s, select(Image), sort, descending, 4, before=pages[-1].prev_cursor)
+        assert back == pages[-2]
+
+
+def test_cursor_round_trip_and_rejects_garbage():
+    with get_read_session() as s:
+        img = s.exec(select(Image)).first()
+    cursor = encode_cursor(img.updated_at, img.id)
+    assert decode_cursor("updated", cursor) == (img.updated_at, img.id)
+    with pytest.raises(ValueError):
+        decode_cursor("size", "bm90IGpzb24")
+
+
+def follow_next_links(client, image_ids, url: str) -> list[int]:
+    seen = []
+    while url:
+        page = client.get(url)
+        assert page.status_code == 200
+        seen += image_ids(url)
+        link = re.search(r'<a href="([^"]+)">Next', page.text)
+        url = html.unescape(link.group(1)) if link else None
+    return seen
+
+
+def test_listing_follows_next_links(client, image_ids):
+    seen = follow_next_links(client, image_ids, "/images?sort=size&order=asc&page_size=2")
+    assert seen == expected_order("size", False)
+    assert client.get("/images", params={"sort": "size", "after": "garbage"}).status_code == 400
+
+
+def ranked_matches(q: str) -> list[tuple[float, int]]:
+    with get_read_session() as s:
+        rows = s.execute(
+            text("SELECT rank, rowid FROM image_fts WHERE image_fts MATCH :q"),
+            {"q": fts_query(q)},
+        ).all()
+    return sorted((-rank, image_id) for rank, image_id in rows)
+
+
+@pytest.mark.parametrize("order", ["desc", "asc"])
+def test_relevance_pages_follow_the_rank(client, image_ids, order):
+    # Three matches: one ranked apart and two tied, broken by id
+    matches = ranked_matches("portraits")
+    assert len(matches) == 3 and len({rank for rank, _ in matches}) == 2
+    expected = [image_id for _, image_id in matches]
+    if order == "desc":
+        expected.reverse()
+    seen = follow_next_links(client, image_ids, f"/images?q=portraits&order={order}&page_size=1")
+    assert seen == expected
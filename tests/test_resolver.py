@@ -0,0 +1,39 @@
+"""The path resolver cache survives tag edits and follows image changes."""
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import text
+
+import resolver
+from database import engine
+from resolver import path_resolver
+
+pytestmark = pytest.mark.usefixtures("vault")
+
+
+@pytest.fixture(autouse=True)
+def _always_check(monkeypatch):
+    path_resolver.clear()
+    monkeypatch.setattr(resolver, "RESOLVER_CHECK_SECONDS", 0)
+
+
+def test_tag_changes_keep_the_cache(client, vault, image_id):
+    root = vault.resolve()
+    lake = image_id("Landscapes/lake.jpg")
+    assert path_resolver.resolve(root, lake).path == root / "Landscapes/lake.jpg"
+    client.post(f"/images/{lake}/tags/assign", data={"name": "Water"}, follow_redirects=False)
+    hits = path_resolver.stats()["hits"]
+    path_resolver.resolve(root, lake)
+    assert path_resolver.stats()["hits"] == hits + 1
+
+
+def test_image_changes_elsewhere_clear_the_cache(vault, image_id):
+    root = vault.resolve()
+    lake = image_id("Landscapes/lake.jpg")
+    path_resolver.resolve(root, lake)
+    # Deleted by another worker: no forget() in this process
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM imagetaglink WHERE image_id = :id"), {"id": lake})
+        conn.execute(text("DELETE FROM image WHERE id = :id"), {"id": lake})
+    with pytest.raises(HTTPException) as exc:
+        path_resolver.resolve(root, lake)
+    assert exc.value.status_code == 404
@@ -0,0 +1,52 @@
+"""Scan-time placeholders, including files that cannot be decoded."""
+import os
+
+import pytest
+from sqlmodel import select
+
+import scanner
+from database import get_read_session
+from models import Image
+from scanner import PLACEHOLDER_FAILED
+
+
+def placeholder(path) -> str:
+    with get_read_session() as s:
+        return s.exec(select(Image.placeholder).where(Image.path == str(path))).one()
+
+
+@pytest.fixture
+def broken(vault):
+    path = vault / "Landscapes/broken.jpg"
+    path.write_bytes(b"\xff\xd8 not really a jpeg")
+    return path
+
+
+def rescan(client, vault):
+    r = client.post("/scan", data={"root_dir": str(vault)}, follow_redirects=False)
+    assert r.status_code == 303, r.text
+
+
+def test_placeholders_stored_at_scan(vault):
+    assert placeholder(vault / "Landscapes/lake.jpg").startswith("data:image/webp;base64,")
+
+
+def test_undecodable_file_is_not_retried_until_it_changes(client, vault, broken, monkeypatch):
+    rescan(client, vault)
+    assert placeholder(broken) == PLACEHOLDER_FAILED
+
+    decoded = []
+    read_image_info = scanner.read_image_info
+
+    def counting(path):
+        decoded.append(path.name)
+        return read_image_info(path)
+
+    monkeypatch.setattr(scanner, "read_image_info", counting)
+    rescan(client, vault)
+    assert decoded == []
+
+    os.utime(broken, (1, 1))
+    rescan(client, vault)
+    assert decoded == ["broken.jpg"]
+    assert placeholder(broken) == PLACEHOLDER_FAILED
@@ -0,0 +1,61 @@
+"""Full-text search over filenames, folders below the root and tag names."""
+import pytest
+from sqlalchemy import text
+
+from database import read_engine
+from search import fts_available, fts_query
+
+pytestmark = pytest.mark.usefixtures("vault")
+
+
+@pytest.fixture(autouse=True)
+def _needs_fts():
+    if not fts_available():
+        pytest.skip("SQLite built without FTS5")
+
+
+def search_ids(image_ids, q):
+    return sorted(image_ids("/images", q=q))
+
+
+def test_fts_query_quotes_words():
+    assert fts_query('anna OR "x"') == '"anna"* "OR"* "x"*'
+    assert fts_query("  --  ") is None
+
+
+def test_prefix_words_must_all_match(image_ids, image_id):
+    assert search_ids(image_ids, "moun") == [image_id("Landscapes/mountain_sunrise.webp")]
+    assert search_ids(image_ids, "mountain lake") == []
+
+
+def test_folders_and_tags_match(image_ids, image_id):
+    portraits = sorted(
+        image_id(name)
+        for name in ("Portraits/anna.jpg", "Portraits/ben.jpg", "Portraits/studio_lights/carla.png")
+    )
+    assert search_ids(image_ids, "portraits") == portraits
+    assert search_ids(image_ids, "studio") == [image_id("Portraits/studio_lights/carla.png")]
+
+
+def test_root_segments_do_not_match(image_ids, vault):
+    for segment in vault.parts[1:]:
+        assert search_ids(image_ids, segment) == [], segment
+    with read_engine.connect() as conn:
+        folders = conn.execute(text("SELECT DISTINCT folders FROM image_fts")).scalars().all()
+    assert sorted(folders) == ["Landscapes", "Portraits", "Portraits/studio_lights"]
+
+
+def test_tag_rename_is_searchable(client, image_ids, image_id):
+    from database import get_read_session
+    from models import Tag
+    from sqlmodel import select
+
+    with get_read_session() as s:
+        tag = s.exec(select(Tag).where(Tag.name == "Landscapes")).one()
+    client.post(
+        f"/tags/{tag.id}/update", data={"name": "Scenery", "color": tag.color}, follow_redirects=False
+    )
+    assert search_ids(image_ids, "scenery") == sorted(
+        image_id(name)
+        for name in ("Landscapes/lake.jpg", "Landscapes/mountain_sunrise.webp", "Landscapes/beach.jpg")
+    )
@@ -0,0 +1,56 @@
+"""Settings are cached per process and invalidated through the version stamp."""
+import pytest
+from sqlalchemy import event, text
+
+import database
+from database import engine, get_setting, read_engine, set_setting
+from warmup import WARMUP_CURSOR_SETTING
+
+pytestmark = pytest.mark.usefixtures("vault")
+
+
+def stamp() -> int:
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT version FROM version_stamp WHERE name = 'settings'")).scalar()
+
+
+def test_cached_reads_issue_no_queries(vault):
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    assert get_setting("root_dir") == str(vault)
+    event.listen(read_engine, "before_cursor_execute", record)
+    try:
+        for _ in range(20):
+            get_setting("root_dir")
+    finally:
+        event.remove(read_engine, "before_cursor_execute", record)
+    assert statements == []
+
+
+def test_own_writes_are_seen_at_once():
+    set_setting("example", "1")
+    assert get_setting("example") == "1"
+    set_setting("example", "2")
+    assert get_setting("example") == "2"
+
+
+def test_other_workers_writes_are_seen_after_the_check(monkeypatch):
+    set_setting("example", "1")
+    assert get_setting("example") == "1"
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE setting SET value = '2' WHERE key = 'example'"))
+    assert get_setting("example") == "1"
+    monkeypatch.setattr(database, "SETTINGS_CHECK_SECONDS", 0)
+    assert get_setting("example") == "2"
+
+
+def test_warmup_cursor_does_not_invalidate(vault):
+    get_setting("root_dir")
+    cached, before = database._settings, stamp()
+    set_setting(WARMUP_CURSOR_SETTING, '{"tier": "rest", "before": 5}')
+    assert stamp() == before
+    assert database._settings is cached
+    assert get_setting(WARMUP_CURSOR_SETTING) == '{"tier": "rest", "before": 5}'
@@ -0,0 +1,56 @@
+"""Trigger-maintained dashboard statistics and tag usage counts stay exact."""
+import os
+
+import pytest
+from PIL import Image as PILImage
+from sqlalchemy import text
+
+from database import engine
+from maintenance import check_catalog_stats, check_tag_counts, rebuild_catalog_stats
+
+pytestmark = pytest.mark.usefixtures("vault")
+
+
+def stat(kind: str, key: str) -> tuple[int, int]:
+    with engine.connect() as conn:
+        row = conn.execute(
+            text("SELECT count, size FROM catalog_stats WHERE kind = :kind AND key = :key"),
+            {"kind": kind, "key": key},
+        ).first()
+    return tuple(row) if row else (0, 0)
+
+
+def test_stats_after_scan():
+    assert check_catalog_stats() == []
+    assert stat("total", "")[0] == 6
+    assert stat("format", ".jpg")[0] == 4
+    assert stat("directory", "Landscapes")[0] == 3
+    assert stat("resolution", "FHD (1920×1080+)")[0] == 1
+
+
+def test_stats_follow_deletes_and_rescans(client, vault, image_id):
+    client.post(f"/images/{image_id('Landscapes/lake.jpg')}/delete", follow_redirects=False)
+    assert stat("directory", "Landscapes")[0] == 2
+    # A changed file is updated in place by the next scan
+    path = vault / "Portraits/anna.jpg"
+    PILImage.new("RGB", (2560, 1440)).save(path)
+    os.utime(path, (1, 1))
+    client.post("/scan", data={"root_dir": str(vault)}, follow_redirects=False)
+    assert stat("resolution", "QHD (2560×1440+)")[0] == 1
+    assert stat("total", "")[0] == 5
+    assert check_catalog_stats() == []
+    assert check_tag_counts() == []
+
+
+def test_drift_is_detected_and_repaired():
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE catalog_stats SET count = count + 1 WHERE kind = 'total'"))
+    assert [(kind, key) for kind, key, _, _ in check_catalog_stats()] == [("total", "")]
+    rebuild_catalog_stats()
+    assert check_catalog_stats() == []
+
+
+def test_dashboard_reads_the_totals(client):
+    page = client.get("/dashboard")
+    assert page.status_code == 200
+    assert "Landscapes" in page.text
@@ -0,0 +1,49 @@
+"""Listing pages load tags with a constant number of queries."""
+import pytest
+from sqlalchemy import event
+from sqlmodel import select
+
+from database import get_read_session, read_engine
+from models import Tag
+from tagcatalog import load_image_tags, tag_catalog
+
+pytestmark = pytest.mark.usefixtures("vault")
+
+
+def statements_for(client, url: str) -> int:
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    client.get(url)  # warm the per-process caches
+    event.listen(read_engine, "before_cursor_execute", record)
+    try:
+        assert client.get(url).status_code == 200
+    finally:
+        event.remove(read_engine, "before_cursor_execute", record)
+    return len(statements)
+
+
+@pytest.mark.parametrize("params", ["", "&tag=Portraits", "&q=lake"])
+def test_query_count_does_not_grow_with_page_size(client, image_ids, params):
+    assert len(image_ids(f"/images?page_size=1{params}")) == 1
+    one = statements_for(client, f"/images?page_size=1{params}")
+    many = statements_for(client, f"/images?page_size=6{params}")
+    assert one == many
+
+
+def test_image_tags_in_name_order(image_id):
+    carla = image_id("Portraits/studio_lights/carla.png")
+    with get_read_session() as s:
+        tags = load_image_tags(s, [carla])[carla]
+    assert [t.name for t in tags] == ["Portraits", "Studio Lights"]
+
+
+def test_catalog_reloads_after_rename(client):
+    with get_read_session() as s:
+        tag = s.exec(select(Tag).where(Tag.name == "Portraits")).one()
+        assert tag_catalog(s)[tag.id].name == "Portraits"
+    client.post(f"/tags/{tag.id}/update", data={"name": "People"}, follow_redirects=False)
+    with get_read_session() as s:
+        assert tag_catalog(s)[tag.id].name == "People"
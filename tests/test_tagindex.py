@@ -0,0 +1,86 @@
+"""The bitmap tag index answers tag filters exactly like the SQL path."""
+import pytest
+from sqlalchemy import text
+
+import routes
+import tagindex
+from database import engine
+from tagindex import IntBitmap, prune_log, tag_index
+
+FILTERS = [
+    {"tag": "Portraits"},
+    {"tags": "Portraits,Studio Lights"},
+    {"exclude_tags": "Portraits"},
+    {"tag": "Landscapes", "exclude_tags": "Portraits"},
+    {"tags": "Portraits", "exclude_tags": "Studio Lights"},
+    {"tags": "No Such Tag"},
+    {"tag": "Portraits", "q": "anna"},
+]
+
+
+def both_paths(image_ids, monkeypatch, params):
+    indexed = image_ids("/images", **params)
+    monkeypatch.setattr(routes, "TAG_INDEX_ENABLED", False)
+    plain = image_ids("/images", **params)
+    monkeypatch.setattr(routes, "TAG_INDEX_ENABLED", True)
+    return indexed, plain
+
+
+def test_int_bitmap_set_operations():
+    a = IntBitmap([3, 70, 5])
+    assert list(a) == [3, 5, 70] and len(a) == 3
+    a.discard(5)
+    a.add(1000)
+    assert list(a) == [3, 70, 1000]
+    assert list(a - IntBitmap([3])) == [70, 1000]
+    assert list(a & IntBitmap([70, 71])) == [70]
+    assert list(a | IntBitmap([4])) == [3, 4, 70, 1000]
+
+
+@pytest.mark.usefixtures("vault")
+@pytest.mark.parametrize("params", FILTERS)
+def test_filters_match_sql(client, image_ids, monkeypatch, params):
+    indexed, plain = both_paths(image_ids, monkeypatch, params)
+    assert indexed == plain
+
+
+def test_index_follows_link_and_image_changes(client, image_ids, image_id, monkeypatch):
+    lake = image_id("Landscapes/lake.jpg")
+    anna = image_id("Portraits/anna.jpg")
+    client.post(f"/images/{lake}/tags/assign", data={"name": "Portraits"}, follow_redirects=False)
+    client.post(f"/images/{anna}/delete", follow_redirects=False)
+    indexed, plain = both_paths(image_ids, monkeypatch, {"tag": "Portraits"})
+    assert indexed == plain
+    assert lake in indexed and anna not in indexed
+
+
+class _Reader:
+    def __init__(self, seq):
+        self.log_seq = seq
+
+
+@pytest.mark.usefixtures("vault")
+def test_prune_keeps_rows_live_readers_need(monkeypatch):
+    monkeypatch.setattr(tagindex, "TAG_INDEX_LOG_KEEP", 0)
+    with engine.connect() as conn:
+        first, latest = conn.execute(text("SELECT min(seq), max(seq) FROM tagindex_log")).one()
+    lagging = first + (latest - first) // 2
+    prune_log({"lagging": _Reader(lagging), "current": _Reader(latest)})
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT min(seq) FROM tagindex_log")).scalar() == lagging
+        conn.execute(text("DELETE FROM tagindex_reader"))
+        conn.commit()
+
+
+@pytest.mark.usefixtures("vault")
+def test_match_does_not_rebuild_after_prune(monkeypatch):
+    tag_index.warm()
+    monkeypatch.setattr(tagindex, "TAG_INDEX_LOG_KEEP", 0)
+    prune_log({"tag-index": tag_index})
+    built = []
+    monkeypatch.setattr(tag_index, "_build", lambda conn: built.append(conn))
+    tag_index.match(all_of=[1])
+    assert not built
+    with engine.connect() as conn:
+        conn.execute(text("DELETE FROM tagindex_reader"))
+        conn.commit()
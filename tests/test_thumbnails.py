@@ -0,0 +1,161 @@
+"""Thumbnail format negotiation, the formats actually served and single-flight generation."""
+import io
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+from PIL import Image as PILImage
+
+import thumbnails
+from thumbnails import ensure_cached, generate_thumbnail, negotiate_format, thumb_variant
+from thumbstore import ACCESS_INDEX_NAME, FileThumbStore, ThumbCache, get_thumb_store
+
+ALL_FORMATS = ["avif", "webp", "jpeg"]
+
+
+@pytest.mark.parametrize(
+    "accept, allowed, expected",
+    [
+        (None, None, "jpeg"),
+        ("", None, "jpeg"),
+        ("image/avif,image/webp,image/apng,*/*;q=0.8", None, "avif"),
+        ("image/webp,*/*", None, "webp"),
+        ("IMAGE/WEBP", None, "webp"),
+        ("image/avif;q=0.5", None, "avif"),
+        # q=0 refuses a type, however it is spelled
+        ("image/avif;q=0,image/webp", None, "webp"),
+        ("image/avif ; q=0.0, image/webp;q=0", None, "jpeg"),
+        # Wildcards promise nothing beyond what every browser decodes
+        ("*/*", None, "jpeg"),
+        ("image/*", None, "jpeg"),
+        ("text/html,application/xhtml+xml", None, "jpeg"),
+        ("image/avif,image/webp", ("webp", "jpeg"), "webp"),
+        ("image/avif", ("webp", "jpeg"), "jpeg"),
+    ],
+)
+def test_negotiate_format(monkeypatch, accept, allowed, expected):
+    monkeypatch.setattr(thumbnails, "SUPPORTED_FORMATS", ALL_FORMATS)
+    assert negotiate_format(accept, allowed) == expected
+
+
+def test_missing_avif_encoder_is_never_offered(monkeypatch):
+    monkeypatch.delitem(PILImage.SAVE, "AVIF", raising=False)
+    assert not thumbnails._encoder_available("avif")
+    monkeypatch.setattr(thumbnails, "SUPPORTED_FORMATS", ["webp", "jpeg"])
+    assert negotiate_format("image/avif,image/webp") == "webp"
+    assert negotiate_format("image/avif") == "jpeg"
+
+
+def test_failing_encoder_falls_back_to_jpeg(monkeypatch, vault, image_id):
+    encode = thumbnails.encode_image
+
+    def no_avif(im, fmt):
+        if fmt == "avif":
+            raise OSError("encoder not available")
+        return encode(im, fmt)
+
+    monkeypatch.setattr(thumbnails, "encode_image", no_avif)
+    src = vault / "Landscapes/lake.jpg"
+    mtime = src.stat().st_mtime
+    lake = image_id("Landscapes/lake.jpg")
+    assert generate_thumbnail(vault, lake, None, src, mtime, 64, "avif") == "jpeg"
+    store = get_thumb_store(vault)
+    assert store.get(*thumb_variant(lake, None, mtime, 64, "jpeg")) is not None
+    assert store.get(*thumb_variant(lake, None, mtime, 64, "avif")) is None
+
+
+@pytest.mark.parametrize(
+    "accept, media_type, pil_format",
+    [
+        ("image/avif,image/webp,*/*", "image/avif", "AVIF"),
+        ("image/webp,*/*", "image/webp", "WEBP"),
+        ("*/*", "image/jpeg", "JPEG"),
+    ],
+)
+def test_thumbnail_route_serves_the_negotiated_format(client, image_id, accept, media_type, pil_format):
+    if media_type == "image/avif" and "avif" not in thumbnails.SUPPORTED_FORMATS:
+        pytest.skip("Pillow build without an AVIF encoder")
+    r = client.get(f"/thumb/{image_id('Landscapes/lake.jpg')}?w=64", headers={"Accept": accept})
+    assert r.status_code == 200, r.text
+    assert r.headers["content-type"] == media_type
+    assert r.headers["vary"] == "Accept"
+    im = PILImage.open(io.BytesIO(r.content))
+    assert im.format == pil_format and im.width == 64
+
+
+def make_cache(directory: Path) -> ThumbCache:
+    return ThumbCache(FileThumbStore(directory), directory / ACCESS_INDEX_NAME)
+
+
+def _render_logged(log: str) -> bytes:
+    with open(log, "a") as f:
+        f.write("render\n")
+    time.sleep(0.2)
+    return b"thumbnail"
+
+
+def _ensure_in_process(directory: str, log: str) -> bytes:
+    cache = make_cache(Path(directory))
+    hit = ensure_cached(cache, "ab/key_360.jpg", 0.0, lambda: _render_logged(log))
+    return Path(hit).read_bytes()
+
+
+def test_concurrent_requests_render_once(tmp_path):
+    cache = make_cache(tmp_path / "thumbs")
+    renders = []
+    start = threading.Barrier(8)
+
+    def produce():
+        renders.append(1)
+        time.sleep(0.2)
+        return b"thumbnail"
+
+    def request(_):
+        start.wait()
+        return ensure_cached(cache, "ab/key_360.jpg", 0.0, produce)
+
+    with ThreadPoolExecutor(8) as pool:
+        hits = list(pool.map(request, range(8)))
+    assert len(renders) == 1
+    assert {Path(hit).read_bytes() for hit in hits} == {b"thumbnail"}
+
+
+def test_concurrent_processes_render_once(tmp_path):
+    directory, log = tmp_path / "thumbs", tmp_path / "renders.log"
+    make_cache(directory)
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(4, mp_context=context) as pool:
+        results = list(pool.map(_ensure_in_process, [str(directory)] * 4, [str(log)] * 4))
+    assert results == [b"thumbnail"] * 4
+    assert log.read_text().splitlines() == ["render"]
+
+
+def test_failed_render_leaves_nothing_behind(tmp_path, monkeypatch):
+    cache = make_cache(tmp_path / "thumbs")
+
+    def broken():
+        raise OSError("decoder error")
+
+    with pytest.raises(OSError):
+        ensure_cached(cache, "ab/key_360.jpg", 0.0, broken)
+    assert cache.get("ab/key_360.jpg") is None
+
+    # A write that dies halfway (disk full) leaves no partial thumbnail
+    def half_write(path, data):
+        with open(path, "wb") as f:
+            f.write(data[: len(data) // 2])
+        raise OSError("No space left on device")
+
+    monkeypatch.setattr(Path, "write_bytes", half_write)
+    with pytest.raises(OSError):
+        ensure_cached(cache, "ab/key_360.jpg", 0.0, lambda: b"thumbnail")
+    assert cache.get("ab/key_360.jpg") is None
+    assert [p.name for p in (tmp_path / "thumbs/ab").iterdir()] == []
+    monkeypatch.undo()
+
+    # The key is not left locked
+    hit = ensure_cached(cache, "ab/key_360.jpg", 0.0, lambda: b"thumbnail")
+    assert Path(hit).read_bytes() == b"thumbnail"
@@ -0,0 +1,101 @@
+"""The bounded, prioritized thumbnail process pool."""
+import asyncio
+import os
+import time
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from thumbpool import THUMB_RETRY_AFTER, ClientGone, QueueFull, ThumbPool, thumb_pool
+
+
+@pytest.fixture
+def pool():
+    pool = ThumbPool(workers=1, max_queue=2)
+    yield pool
+    pool.shutdown()
+
+
+def run(coro):
+    return asyncio.run(asyncio.wait_for(coro, 60))
+
+
+async def occupy(pool: ThumbPool, seconds: float = 1.0) -> asyncio.Task:
+    """Keep the only worker busy so later jobs have to queue."""
+    task = asyncio.ensure_future(pool.run("busy", time.sleep, seconds))
+    await asyncio.sleep(0)
+    assert not pool.idle
+    return task
+
+
+def test_queue_is_bounded(pool):
+    async def scenario():
+        busy = await occupy(pool)
+        queued = [asyncio.ensure_future(pool.run(f"q{n}", time.sleep, 0)) for n in range(2)]
+        await asyncio.sleep(0)
+        assert pool.queued == 2
+        with pytest.raises(QueueFull):
+            await pool.run("one too many", time.sleep, 0)
+        # A key that is already queued joins its job instead
+        joined = asyncio.ensure_future(pool.run("q0", time.sleep, 0))
+        await asyncio.gather(busy, joined, *queued)
+
+    run(scenario())
+
+
+def test_full_queue_is_a_503(client, image_id, monkeypatch):
+    monkeypatch.setattr(thumb_pool, "max_queue", 0)
+    r = client.get(f"/thumb/{image_id('Landscapes/beach.jpg')}?w=99")
+    assert r.status_code == 503
+    assert r.headers["retry-after"] == str(THUMB_RETRY_AFTER)
+
+
+def test_newest_page_view_runs_first(pool):
+    pool.max_queue = 10
+    finished = []
+
+    async def job(name: str, priority: float):
+        await pool.run(name, time.sleep, 0, priority=priority)
+        finished.append(name)
+
+    async def scenario():
+        busy = await occupy(pool, 0.5)
+        jobs = [
+            asyncio.ensure_future(job(name, priority))
+            for name, priority in [("old", 1), ("newest", 3), ("newer", 2), ("bumped", 0)]
+        ]
+        await asyncio.sleep(0)
+        # A newer page view asking for a queued key moves it up
+        jobs.append(asyncio.ensure_future(job("bumped", 4)))
+        await asyncio.gather(busy, *jobs)
+
+    run(scenario())
+    assert finished[:2] == ["bumped", "bumped"]
+    assert finished[2:] == ["newest", "newer", "old"]
+
+
+def test_abandoned_job_is_dropped(pool, tmp_path):
+    marker = tmp_path / "ran"
+
+    async def gone():
+        return True
+
+    async def scenario():
+        busy = await occupy(pool, 0.5)
+        with pytest.raises(ClientGone):
+            await pool.run("abandoned", os.mkdir, str(marker), is_disconnected=gone)
+        assert (pool.queued, pool.dropped) == (0, 1)
+        await busy
+
+    run(scenario())
+    assert not marker.exists()
+
+
+def test_recovers_from_a_dead_worker(pool):
+    async def scenario():
+        with pytest.raises(BrokenProcessPool):
+            await pool.run("crash", os._exit, 1)
+        # The next job gets a fresh pool
+        assert await pool.run("after", abs, -5) == 5
+
+    run(scenario())
@@ -0,0 +1,182 @@
+"""Thumbnail store backends."""
+import time
+from pathlib import Path
+
+import pytest
+
+from thumbstore import (
+    ACCESS_INDEX_NAME,
+    FileThumbStore,
+    PackThumbStore,
+    ThumbCache,
+    get_thumb_store,
+)
+
+
+@pytest.fixture
+def pack_dir(tmp_path):
+    return tmp_path / "thumbs" / "packs"
+
+
+def data(n: int, size: int = 1000) -> bytes:
+    return bytes([n % 256]) * size
+
+
+def files(directory, pattern: str) -> list[str]:
+    return sorted(p.name for p in directory.glob(pattern))
+
+
+def test_pack_shared_between_instances(pack_dir):
+    writer, reader = PackThumbStore(pack_dir), PackThumbStore(pack_dir)
+    writer.put("ab/one_360.webp", data(1))
+    writer.put("ab/two_360.webp", data(2, 10))
+    assert bytes(reader.get("ab/one_360.webp")) == data(1)
+    assert bytes(reader.get("ab/two_360.webp")) == data(2, 10)
+    assert reader.get("ab/missing_360.webp") is None
+    assert sorted(reader.entries()) == [("ab/one_360.webp", 1000), ("ab/two_360.webp", 10)]
+    # A fresh instance replays the same index
+    assert bytes(PackThumbStore(pack_dir).get("ab/one_360.webp")) == data(1)
+
+
+def test_pack_min_mtime(pack_dir):
+    store = PackThumbStore(pack_dir)
+    store.put("id/1_360.jpg", data(1))
+    assert store.get("id/1_360.jpg", time.time() - 60) is not None
+    assert store.get("id/1_360.jpg", time.time() + 60) is None
+
+
+def test_pack_overwrite(pack_dir):
+    writer, reader = PackThumbStore(pack_dir), PackThumbStore(pack_dir)
+    writer.put("k", data(1))
+    assert bytes(reader.get("k")) == data(1)
+    writer.put("k", data(2, 500))
+    assert bytes(reader.get("k")) == data(2, 500)
+    assert (reader.live_bytes, reader.dead_bytes) == (500, 1000)
+
+
+def test_pack_delete(pack_dir):
+    writer, reader = PackThumbStore(pack_dir), PackThumbStore(pack_dir)
+    writer.put("k", data(1))
+    assert reader.get("k") is not None
+    writer.delete("k")
+    assert reader.get("k") is None
+    assert list(reader.entries()) == []
+    writer.delete("k")  # already gone: no-op
+
+
+def test_pack_rolls_over_segments(pack_dir):
+    store = PackThumbStore(pack_dir, segment_bytes=2500)
+    for n in range(5):
+        store.put(f"k{n}", data(n))
+    assert files(pack_dir, "seg-0-*.pack") == ["seg-0-1.pack", "seg-0-2.pack", "seg-0-3.pack"]
+    assert all(bytes(store.get(f"k{n}")) == data(n) for n in range(5))
+
+
+def test_compaction_reclaims_dead_space(pack_dir):
+    store = PackThumbStore(pack_dir, segment_bytes=2500)
+    for n in range(6):
+        store.put(f"k{n}", data(n))
+    for n in range(0, 6, 2):
+        store.delete(f"k{n}")
+    before = sum(p.stat().st_size for p in pack_dir.glob("seg-*.pack"))
+    assert store.compact() == 3000
+    after = sum(p.stat().st_size for p in pack_dir.glob("seg-*.pack"))
+    assert before - after >= 3000
+    assert (store.live_bytes, store.dead_bytes) == (3000, 0)
+    # Only the new generation is left, with every live entry intact
+    assert (pack_dir / "CURRENT").read_text() == "1"
+    assert files(pack_dir, "*-0*") == []
+    assert all(store.get(f"k{n}") is None for n in range(0, 6, 2))
+    assert all(bytes(store.get(f"k{n}")) == data(n) for n in range(1, 6, 2))
+
+
+def test_reader_follows_a_new_generation(pack_dir):
+    writer, reader = PackThumbStore(pack_dir), PackThumbStore(pack_dir)
+    for n in range(3):
+        writer.put(f"k{n}", data(n))
+    writer.delete("k0")
+    # The reader has mapped generation 0 before the switch
+    assert bytes(reader.get("k1")) == data(1)
+    writer.compact()
+    assert bytes(reader.get("k1")) == data(1)
+    assert bytes(reader.get("k2")) == data(2)
+    assert reader.get("k0") is None
+    assert reader._generation == 1
+    # And keeps appending to the new generation
+    reader.put("k3", data(3))
+    assert bytes(writer.get("k3")) == data(3)
+    assert files(pack_dir, "index-*.log") == ["index-1.log"]
+
+
+def make_cache(directory: Path, budget: int) -> ThumbCache:
+    return ThumbCache(FileThumbStore(directory), directory / ACCESS_INDEX_NAME, budget)
+
+
+def fill(cache: ThumbCache, count: int) -> None:
+    for n in range(count):
+        cache.put(f"k{n}", data(n))
+        time.sleep(0.002)  # distinct access times
+
+
+def test_cache_stays_within_its_budget(tmp_path):
+    cache = make_cache(tmp_path / "thumbs", budget=10_000)
+    fill(cache, 10)
+    assert cache.stats()["bytes"] == 10_000
+    # One more goes over the budget: trim to the low-water mark (90%)
+    cache.put("k10", data(10))
+    stats = cache.stats()
+    assert (stats["bytes"], stats["entries"], stats["evictions"]) == (9000, 9, 2)
+    assert sum(size for _, size in cache.backend.entries()) == 9000
+
+
+def test_eviction_drops_least_recently_used(tmp_path):
+    cache = make_cache(tmp_path / "thumbs", budget=10_000)
+    fill(cache, 10)
+    # Reading the oldest entries makes them the most recently used
+    assert cache.lookup("k0") is not None and cache.lookup("k1") is not None
+    time.sleep(0.002)
+    cache.put("k10", data(10))
+    assert [n for n in range(11) if cache.get(f"k{n}") is None] == [2, 3]
+
+
+def test_hit_miss_and_eviction_counters(tmp_path):
+    directory = tmp_path / "thumbs"
+    cache = make_cache(directory, budget=3000)
+    fill(cache, 3)
+    cache.lookup("k0")
+    cache.lookup("k2")
+    cache.lookup("missing")
+    cache.put("k3", data(3))
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"]) == (2, 1, 2)
+    assert stats["budget"] == 3000
+    # The counters live in the shared index, as seen by another worker
+    other = make_cache(directory, budget=3000).stats()
+    assert {k: other[k] for k in ("hits", "misses", "evictions", "bytes")} == {
+        "hits": 2, "misses": 1, "evictions": 2, "bytes": 2000
+    }
+
+
+def test_index_rebuilt_from_the_backend(tmp_path):
+    directory = tmp_path / "thumbs"
+    fill(make_cache(directory, budget=0), 3)
+    # A lost or new index starts from what is on disk
+    fresh = ThumbCache(FileThumbStore(directory), tmp_path / "fresh.db", budget=0)
+    assert (fresh.stats()["entries"], fresh.stats()["bytes"]) == (3, 3000)
+
+
+def test_evicted_file_is_regenerated(client, vault, image_id, monkeypatch):
+    lake = image_id("Landscapes/lake.jpg")
+    assert client.get(f"/thumb/{lake}?w=70").status_code == 200
+    store = get_thumb_store(vault)
+    lookup = store.lookup
+
+    def evicted_after_lookup(key, min_mtime=0.0):
+        # Found, then unlinked by another worker before it could be sent
+        hit = lookup(key, min_mtime)
+        store.backend.delete(key)
+        return hit
+
+    monkeypatch.setattr(store, "lookup", evicted_after_lookup)
+    r = client.get(f"/thumb/{lake}?w=70")
+    assert r.status_code == 200 and r.content
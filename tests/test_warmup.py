@@ -0,0 +1,61 @@
+"""Background warm-up of grid and dashboard thumbnails."""
+import asyncio
+
+import pytest
+from sqlmodel import select
+
+import warmup
+from database import get_read_session, set_setting
+from models import Image
+from thumbnails import thumb_variant
+from thumbstore import get_thumb_store
+from warmup import WARMUP_CURSOR_SETTING, WARMUP_FORMATS, WarmupJob
+
+
+@pytest.fixture
+def job(vault, monkeypatch):
+    monkeypatch.setattr(warmup, "WARMUP_IDLE_POLL_SECONDS", 0.02)
+    set_setting(WARMUP_CURSOR_SETTING, "")
+    return WarmupJob()
+
+
+def walk(job: WarmupJob) -> dict:
+    assert asyncio.run(asyncio.wait_for(job._walk(), 120))
+    return job.status
+
+
+def cached_widths(vault, name: str) -> set[int]:
+    with get_read_session() as s:
+        img = s.exec(select(Image).where(Image.path == str(vault / name))).one()
+    store = get_thumb_store(vault)
+    return {
+        w
+        for w in (150, 360, 456)
+        if store.get(thumb_variant(img.id, img.file_hash, img.mtime, w, WARMUP_FORMATS[0])[0])
+    }
+
+
+def test_warms_grid_and_dashboard_thumbnails(job, vault):
+    status = walk(job)
+    assert (status["state"], status["processed"], status["generated"]) == ("done", 6, 12)
+    assert cached_widths(vault, "Landscapes/mountain_sunrise.webp") == {150, 360}
+    # Everything is cached now
+    set_setting(WARMUP_CURSOR_SETTING, "")
+    status = walk(WarmupJob())
+    assert (status["generated"], status["skipped"]) == (0, 12)
+
+
+def test_warms_atlas_cell_thumbnails(job, vault, monkeypatch):
+    monkeypatch.setattr(warmup, "ATLAS_ENABLED", True)
+    walk(job)
+    # Wide images get a wider thumbnail so their cell is covered
+    assert cached_widths(vault, "Landscapes/mountain_sunrise.webp") == {150, 456}
+    assert cached_widths(vault, "Portraits/anna.jpg") == {150, 360}
+
+
+def test_missing_root_is_left_alone(job, vault, tmp_path):
+    gone = tmp_path / "Unplugged"
+    set_setting("root_dir", str(gone))
+    status = walk(job)
+    assert status["state"] == "idle" and status["generated"] == 0
+    assert not gone.exists()
@@ -0,0 +1,265 @@
+"""Thumbnail rendering, format negotiation and single-flight generation."""
+import hashlib
+import io
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterable, Optional, Union
+
+from PIL import Image as PILImage, ImageOps
+
+from thumbstore import ThumbCache, ThumbHit, get_thumb_store
+from utils import file_lock
+
+# Configuration
+# format name -> (Pillow format, media type, file extension)
+THUMB_FORMATS = {
+    "avif": ("AVIF", "image/avif", ".avif"),
+    "webp": ("WEBP", "image/webp", ".webp"),
+    "jpeg": ("JPEG", "image/jpeg", ".jpg"),
+}
+# Preferred order when the client accepts several formats
+THUMB_FORMAT_PREFERENCE = ("avif", "webp", "jpeg")
+THUMB_QUALITY = {
+    "avif": int(os.environ.get("VAULT_THUMB_QUALITY_AVIF", "55")),
+    "webp": int(os.environ.get("VAULT_THUMB_QUALITY_WEBP", "80")),
+    "jpeg": int(os.environ.get("VAULT_THUMB_QUALITY_JPEG", "88")),
+}
+# Comma-separated list of formats to offer; JPEG is always available
+THUMB_ENABLED_FORMATS = {
+    f.strip().lower()
+    for f in os.environ.get("VAULT_THUMB_FORMATS", "avif,webp,jpeg").split(",")
+    if f.strip()
+} | {"jpeg"}
+# Width of the listing grid thumbnails (templates/images.html)
+GRID_THUMB_WIDTH = 360
+# Detail-page previews: longest edge in px, and formats (AVIF is too slow at this size)
+PREVIEW_SIZE = int(os.environ.get("VAULT_PREVIEW_SIZE", "2048"))
+PREVIEW_FORMATS = ("webp", "jpeg")
+# Number of inter-process lock files keys are spread over
+THUMB_LOCK_STRIPES = 64
+
+
+def _encoder_available(fmt: str) -> bool:
+    """Check whether this Pillow build can write the given format."""
+    PILImage.init()
+    return THUMB_FORMATS[fmt][0] in PILImage.SAVE
+
+
+SUPPORTED_FORMATS = [
+    fmt
+    for fmt in THUMB_FORMAT_PREFERENCE
+    if fmt in THUMB_ENABLED_FORMATS and _encoder_available(fmt)
+]
+
+
+def negotiate_format(accept: Optional[str], allowed: Optional[Iterable[str]] = None) -> str:
+    """Pick the best thumbnail format the client advertises in its Accept header.
+
+    ``allowed`` narrows the candidates, e.g. to skip AVIF for very large images
+    where its encoder is slow.
+    """
+    if not accept:
+        return "jpeg"
+    accepted = set()
+    for part in accept.split(","):
+        media_type, _, params = part.strip().partition(";")
+        # Skip types explicitly refused with q=0
+        if params.replace(" ", "").lower() in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(media_type.strip().lower())
+    for fmt in SUPPORTED_FORMATS:
+        if allowed is not None and fmt not in allowed:
+            continue
+        if THUMB_FORMATS[fmt][1] in accepted:
+            return fmt
+    return "jpeg"
+
+
+def media_type_for(fmt: str) -> str:
+    """Media type served for a thumbnail format."""
+    return THUMB_FORMATS[fmt][1]
+
+
+def source_hash(file_hash: Optional[str], catalog_mtime: float, disk_mtime: float) -> Optional[str]:
+    """The catalogued content hash, or None if the file changed since it was hashed."""
+    return file_hash if file_hash and catalog_mtime == disk_mtime else None
+
+
+def thumb_variant(
+    image_id: int, content_hash: Optional[str], src_mtime: float, w: Union[int, str], fmt: str
+) -> tuple[str, float]:
+    """Cache key and minimum cache mtime of a derivative; each format gets its own key.
+
+    ``w`` is a thumbnail width or a named variant such as ``preview_variant()``.
+
+    Derivatives are addressed by the source's content hash (sharded on its
+    first two hex digits), so database resets, moved files and duplicates all
+    share them, and they never go stale. Without a trustworthy hash they fall
+    back to a per-image key checked against the source mtime.
+    """
+    ext = THUMB_FORMATS[fmt][2]
+    if content_hash:
+        return f"{content_hash[:2]}/{content_hash}_{w}{ext}", 0.0
+    return f"id/{image_id}_{w}{ext}", src_mtime
+
+
+def purge_thumbnails(root: Path, removed: Iterable[tuple[int, Optional[str]]]) -> None:
+    """Drop cached derivatives of removed (image id, content hash) pairs.
+
+    Content-addressed derivatives are kept while another catalogued image
+    still has the same hash.
+    """
+    from database import get_read_session
+    from models import Image
+    from sqlmodel import select
+
+    store = get_thumb_store(root)
+    with get_read_session() as s:
+        for image_id, content_hash in removed:
+            store.purge_prefix(f"id/{image_id}_")
+            if content_hash and s.exec(
+                select(Image.id).where(Image.file_hash == content_hash)
+            ).first() is None:
+                store.purge_prefix(f"{content_hash[:2]}/{content_hash}_")
+
+
+def preview_variant(size: int = PREVIEW_SIZE) -> str:
+    """Variant name of a preview, kept apart from thumbnail widths."""
+    return f"p{size}"
+
+
+def encode_image(im: PILImage.Image, fmt: str) -> bytes:
+    """Encode ``im`` as RGB in ``fmt`` at the configured quality."""
+    buf = io.BytesIO()
+    im.convert("RGB").save(buf, format=THUMB_FORMATS[fmt][0], quality=THUMB_QUALITY[fmt])
+    return buf.getvalue()
+
+
+def render_thumbnail(src: Path, w: int, fmt: str) -> bytes:
+    """Decode, resize and encode a thumbnail of width ``w`` in ``fmt``."""
+    im = PILImage.open(src)
+    im = ImageOps.exif_transpose(im)
+    im.thumbnail((w, w * 10_000))
+    return encode_image(im, fmt)
+
+
+def render_preview(src: Path, size: int, fmt: str) -> bytes:
+    """Decode and encode a screen-sized preview fitting a ``size`` square; never upscales."""
+    im = PILImage.open(src)
+    im.draft("RGB", (size, size))
+    im = ImageOps.exif_transpose(im)
+    im.thumbnail((size, size))
+    return encode_image(im, fmt)
+
+
+class KeyedLock:
+    """Per-key mutual exclusion inside one process."""
+
+    def __init__(self):
+        self._guard = threading.Lock()
+        self._locks: dict[str, list] = {}
+
+    @contextmanager
+    def hold(self, key: str):
+        with self._guard:
+            entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._guard:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[key]
+
+
+_generating = KeyedLock()
+
+
+def _stripe_lock_path(store: ThumbCache, key: str) -> Path:
+    stripe = int(hashlib.md5(key.encode("utf-8")).hexdigest(), 16) % THUMB_LOCK_STRIPES
+    return store.directory / ".locks" / f"{stripe}.lock"
+
+
+def ensure_cached(
+    store: ThumbCache, key: str, min_mtime: float, produce: Callable[[], bytes]
+) -> ThumbHit:
+    """Return the cached derivative for ``key``, producing it at most once.
+
+    Concurrent callers for the same key, in this process or another worker
+    process, wait for the first producer and then read its result.
+    """
+    hit = store.get(key, min_mtime)
+    if hit is not None:
+        return hit
+    with _generating.hold(key), file_lock(_stripe_lock_path(store, key)):
+        hit = store.get(key, min_mtime)
+        if hit is None:
+            store.put(key, produce())
+            hit = store.get(key)
+    return hit
+
+
+def ensure_thumbnail(
+    store: ThumbCache,
+    key: str,
+    src: Path,
+    src_mtime: float,
+    w: int,
+    fmt: str,
+) -> ThumbHit:
+    """Return the cached thumbnail for ``key``, generating it at most once."""
+    return ensure_cached(store, key, src_mtime, lambda: render_thumbnail(src, w, fmt))
+
+
+def generate_thumbnail(
+    root: Path,
+    image_id: int,
+    content_hash: Optional[str],
+    src: Path,
+    src_mtime: float,
+    w: int,
+    fmt: str,
+) -> str:
+    """Process-pool entry point: cache the thumbnail and return the format stored.
+
+    Falls back to JPEG when the requested encoder fails on this image.
+    """
+    store = get_thumb_store(root)
+    try:
+        key, min_mtime = thumb_variant(image_id, content_hash, src_mtime, w, fmt)
+        ensure_thumbnail(store, key, src, min_mtime, w, fmt)
+    except (OSError, ValueError):
+        if fmt == "jpeg":
+            raise
+        fmt = "jpeg"
+        key, min_mtime = thumb_variant(image_id, content_hash, src_mtime, w, fmt)
+        ensure_thumbnail(store, key, src, min_mtime, w, fmt)
+    return fmt
+
+
+def generate_preview(
+    root: Path,
+    image_id: int,
+    content_hash: Optional[str],
+    src: Path,
+    src_mtime: float,
+    size: int,
+    fmt: str,
+) -> str:
+    """Process-pool entry point for detail-page previews; see ``generate_thumbnail``."""
+    store = get_thumb_store(root)
+    variant = preview_variant(size)
+    try:
+        key, min_mtime = thumb_variant(image_id, content_hash, src_mtime, variant, fmt)
+        ensure_cached(store, key, min_mtime, lambda: render_preview(src, size, fmt))
+    except (OSError, ValueError):
+        if fmt == "jpeg":
+            raise
+        fmt = "jpeg"
+        key, min_mtime = thumb_variant(image_id, content_hash, src_mtime, variant, fmt)
+        ensure_cached(store, key, min_mtime, lambda: render_preview(src, size, fmt))
+    return fmt
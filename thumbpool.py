@@ -0,0 +1,172 @@
+"""Dedicated process pool for thumbnail generation.
+
+Pillow decode/resize is CPU bound and holds the GIL for most of its work, so
+running it in Starlette's shared threadpool starves every other route. Jobs
+are queued here instead and handed to a separate pool of worker processes;
+the queue is bounded so a cold page of thumbnails cannot pile up unbounded
+work, and callers get ``QueueFull`` to turn into a 503.
+
+Queued jobs are ordered by priority (the page view that asked for them, newest
+first) and a job nobody is waiting for any more is dropped before it reaches a
+worker. Jobs already running always finish so their result gets cached.
+"""
+import asyncio
+import heapq
+import itertools
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Awaitable, Callable, Optional
+
+# Configuration
+THUMB_WORKERS = int(
+    os.environ.get("VAULT_THUMB_WORKERS", str(max(1, (os.cpu_count() or 2) - 1)))
+)
+THUMB_QUEUE_SIZE = int(os.environ.get("VAULT_THUMB_QUEUE", "256"))
+THUMB_RETRY_AFTER = 2  # seconds, sent with 503 when the queue is full
+DISCONNECT_POLL_SECONDS = 0.25
+
+
+class QueueFull(Exception):
+    """Raised when the thumbnail queue cannot take another job."""
+
+
+class ClientGone(Exception):
+    """Raised when the waiting client disconnected before its job finished."""
+
+
+class _Job:
+    __slots__ = ("key", "fn", "args", "future", "priority", "waiters", "started")
+
+    def __init__(self, key: str, fn: Callable, args: tuple, future: asyncio.Future, priority: float):
+        self.key = key
+        self.fn = fn
+        self.args = args
+        self.future = future
+        self.priority = priority
+        self.waiters = 0
+        self.started = False
+
+
+class ThumbPool:
+    """Bounded priority queue in front of a process pool, with single-flight."""
+
+    def __init__(self, workers: int = THUMB_WORKERS, max_queue: int = THUMB_QUEUE_SIZE):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._heap: list = []
+        self._seq = itertools.count()
+        self._jobs: dict[str, _Job] = {}
+        self._queued = 0
+        self._running = 0
+        self.dropped = 0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn: forking a process that already runs the event loop and
+            # threadpool threads is not safe. Spawned workers re-import the
+            # main module, so app.py keeps its startup work in the lifespan
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    async def run(
+        self,
+        key: str,
+        fn: Callable,
+        *args,
+        priority: float = 0.0,
+        is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+    ) -> Any:
+        """Run ``fn(*args)`` in the pool; concurrent calls for ``key`` share one job.
+
+        Higher ``priority`` runs first. If ``is_disconnected`` reports the
+        client went away, this caller stops waiting (``ClientGone``) and the
+        job is dropped if it has not started and nobody else wants it.
+        """
+        loop = asyncio.get_running_loop()
+        job = self._jobs.get(key)
+        if job is None or job.future.get_loop() is not loop:
+            if self._queued >= self.max_queue:
+                raise QueueFull()
+            job = _Job(key, fn, args, loop.create_future(), priority)
+            self._jobs[key] = job
+            self._push(job)
+        elif not job.started and priority > job.priority:
+            # A newer page view wants this key: move the job up
+            job.priority = priority
+            heapq.heappush(self._heap, (-priority, next(self._seq), job))
+        job.waiters += 1
+        self._pump(loop)
+        try:
+            while True:
+                done, _ = await asyncio.wait({job.future}, timeout=DISCONNECT_POLL_SECONDS)
+                if done:
+                    return job.future.result()
+                if is_disconnected is not None and await is_disconnected():
+                    raise ClientGone()
+        finally:
+            job.waiters -= 1
+            if not job.waiters and not job.started and not job.future.done():
+                self._drop(job)
+
+    def _push(self, job: _Job) -> None:
+        self._queued += 1
+        heapq.heappush(self._heap, (-job.priority, next(self._seq), job))
+
+    def _drop(self, job: _Job) -> None:
+        self._queued -= 1
+        self.dropped += 1
+        if self._jobs.get(job.key) is job:
+            del self._jobs[job.key]
+        job.future.cancel()
+
+    def _pump(self, loop: asyncio.AbstractEventLoop) -> None:
+        while self._running < self.workers and self._heap:
+            _, _, job = heapq.heappop(self._heap)
+            if job.started or job.future.done():
+                # Stale heap entry: re-prioritized duplicate or dropped job
+                continue
+            job.started = True
+            self._queued -= 1
+            self._running += 1
+            work = loop.run_in_executor(self._get_executor(), job.fn, *job.args)
+            work.add_done_callback(lambda done, job=job: self._finish(loop, job, done))
+
+    def _finish(self, loop, job: _Job, done: asyncio.Future) -> None:
+        self._running -= 1
+        if self._jobs.get(job.key) is job:
+            del self._jobs[job.key]
+        if not job.future.done():
+            if done.cancelled():
+                job.future.cancel()
+            elif done.exception() is not None:
+                if isinstance(done.exception(), BrokenProcessPool):
+                    # A worker died (e.g. decoder crash); start a fresh pool next time
+                    self._executor = None
+                job.future.set_exception(done.exception())
+            else:
+                job.future.set_result(done.result())
+        self._pump(loop)
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+    @property
+    def idle(self) -> bool:
+        """True when nothing is waiting and at least one worker is free."""
+        return not self._queued and self._running < self.workers
+
+    def shutdown(self) -> None:
+        """Stop worker processes (called on application shutdown)."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+thumb_pool = ThumbPool()
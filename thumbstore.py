@@ -0,0 +1,510 @@
+"""Storage backends for cached thumbnails.
+
+Two backends share the same small interface (``get``/``put``/``delete``/``entries``):
+
+* ``FileThumbStore`` keeps one file per thumbnail under ``<root>/.vault_thumbs``.
+* ``PackThumbStore`` appends thumbnails to large segment files and serves them
+  as zero-copy slices of a memory map, which keeps the inode count flat and
+  makes the cache cheap to copy or back up.
+
+``ThumbCache`` wraps either backend, keeps an access index next to it and
+evicts least recently used thumbnails once the cache outgrows its byte budget.
+"""
+import mmap
+import os
+import sqlite3
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import Iterator, Optional, Union
+
+from scanner import DEFAULT_THUMB_DIRNAME
+from utils import file_lock
+
+# Configuration
+THUMB_STORE = os.environ.get("VAULT_THUMB_STORE", "files").lower()  # "files" or "pack"
+PACK_DIRNAME = "packs"
+PACK_SEGMENT_BYTES = int(os.environ.get("VAULT_PACK_SEGMENT_MB", "256")) * 1024 * 1024
+# Compact automatically once this much space is dead and outweighs live data
+PACK_COMPACT_MIN_DEAD_BYTES = 64 * 1024 * 1024
+# Byte budget for all cached thumbnails of a vault (0 = unlimited)
+THUMB_CACHE_BYTES = int(os.environ.get("VAULT_THUMB_CACHE_MB", "2048")) * 1024 * 1024
+# Eviction trims the cache down to this fraction of the budget
+THUMB_CACHE_LOW_WATER = 0.9
+ACCESS_INDEX_NAME = ".access.db"
+# Access times are buffered and written in batches
+ACCESS_FLUSH_SECONDS = 5.0
+ACCESS_FLUSH_ENTRIES = 256
+
+# Record header in a segment: magic, key length, data length, stamp
+_RECORD = struct.Struct("<4sHId")
+_MAGIC = b"VTPK"
+
+ThumbHit = Union[Path, memoryview]
+
+
+class FileThumbStore:
+    """One file per thumbnail, named after its key.
+
+    Keys may contain one ``/`` to shard files over subdirectories.
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        # Never parents=True: a missing vault root must not be created
+        self.directory.mkdir(exist_ok=True)
+
+    def get(self, key: str, min_mtime: float = 0.0) -> Optional[Path]:
+        """Return the cached file if it is at least as new as ``min_mtime``."""
+        path = self.directory / key
+        try:
+            if path.stat().st_mtime >= min_mtime:
+                return path
+        except FileNotFoundError:
+            pass
+        return None
+
+    def put(self, key: str, data: bytes) -> None:
+        """Store thumbnail bytes under ``key`` atomically (temp file + rename)."""
+        path = self.directory / key
+        path.parent.mkdir(exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            tmp.write_bytes(data)
+            os.replace(tmp, path)
+        finally:
+            tmp.unlink(missing_ok=True)
+
+    def delete(self, key: str) -> None:
+        """Remove a cached thumbnail if present."""
+        (self.directory / key).unlink(missing_ok=True)
+
+    def entries(self) -> Iterator[tuple[str, int]]:
+        """Iterate over all cached (key, size) pairs."""
+        for p in self.directory.iterdir():
+            if p.name.startswith("."):
+                continue
+            if p.is_dir():
+                for q in p.iterdir():
+                    if q.is_file() and not q.name.startswith("."):
+                        yield f"{p.name}/{q.name}", q.stat().st_size
+            elif p.is_file():
+                yield p.name, p.stat().st_size
+
+
+class PackThumbStore:
+    """Append-only segment files with an offset index, read through mmap.
+
+    Layout under ``directory``:
+
+    * ``CURRENT`` names the live generation.
+    * ``seg-<gen>-<n>.pack`` holds records (header, key, bytes) back to back.
+    * ``index-<gen>.log`` is an append-only log of ``P``ut and ``D``elete lines
+      mapping keys to (segment, offset, length, stamp).
+
+    Writers serialize on an inter-process file lock; readers replay new index
+    lines on a miss, so several worker processes can share one pack.
+    """
+
+    def __init__(self, directory: Path, segment_bytes: int = PACK_SEGMENT_BYTES):
+        self.directory = directory
+        self.directory.parent.mkdir(exist_ok=True)
+        self.directory.mkdir(exist_ok=True)
+        self.segment_bytes = segment_bytes
+        self._lock = threading.RLock()
+        self._generation = -1
+        self._index: dict[str, tuple[int, int, int, float]] = {}
+        self._log_pos = 0
+        self._maps: dict[int, mmap.mmap] = {}
+        self._last_segment = 0
+        self.live_bytes = 0
+        self.dead_bytes = 0
+        self._refresh()
+
+    # -- paths ---------------------------------------------------------------
+
+    def _segment_path(self, generation: int, segment: int) -> Path:
+        return self.directory / f"seg-{generation}-{segment}.pack"
+
+    def _index_path(self, generation: int) -> Path:
+        return self.directory / f"index-{generation}.log"
+
+    def _read_generation(self) -> int:
+        try:
+            return int((self.directory / "CURRENT").read_text().strip())
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    # -- index replay --------------------------------------------------------
+
+    def _refresh(self) -> None:
+        """Pick up index lines (or a new generation) written by other processes."""
+        generation = self._read_generation()
+        if generation != self._generation:
+            self._generation = generation
+            self._index = {}
+            self._maps = {}
+            self._log_pos = 0
+            self._last_segment = 0
+            self.live_bytes = self.dead_bytes = 0
+        try:
+            with open(self._index_path(generation), "rb") as f:
+                f.seek(self._log_pos)
+                chunk = f.read()
+        except FileNotFoundError:
+            return
+        # Only consume complete lines; a writer may be mid-append
+        end = chunk.rfind(b"\n") + 1
+        self._log_pos += end
+        for line in chunk[:end].decode("utf-8").splitlines():
+            self._apply(line.split("\t"))
+
+    def _refresh_if_changed(self) -> None:
+        """Replay the index only if another process appended to or replaced it."""
+        try:
+            size = self._index_path(self._generation).stat().st_size
+        except FileNotFoundError:
+            # Compacted into a new generation (or nothing written yet)
+            size = -1
+        if size != self._log_pos:
+            self._refresh()
+
+    def _apply(self, fields: list[str]) -> None:
+        previous = self._index.pop(fields[1], None)
+        if previous:
+            self.live_bytes -= previous[2]
+            self.dead_bytes += previous[2]
+        if fields[0] == "P":
+            segment, offset, length = int(fields[2]), int(fields[3]), int(fields[4])
+            self._index[fields[1]] = (segment, offset, length, float(fields[5]))
+            self._last_segment = max(self._last_segment, segment)
+            self.live_bytes += length
+
+    def _append_log(self, line: str) -> None:
+        with open(self._index_path(self._generation), "ab") as f:
+            f.write(line.encode("utf-8"))
+
+    # -- reads ---------------------------------------------------------------
+
+    def _view(self, segment: int, offset: int, length: int) -> memoryview:
+        mm = self._maps.get(segment)
+        if mm is None or len(mm) < offset + length:
+            with open(self._segment_path(self._generation, segment), "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            # Older maps stay alive for as long as a response still holds a view
+            self._maps[segment] = mm
+        return memoryview(mm)[offset:offset + length]
+
+    def get(self, key: str, min_mtime: float = 0.0) -> Optional[memoryview]:
+        """Return a zero-copy view of the cached bytes, or None if missing/stale."""
+        with self._lock:
+            self._refresh_if_changed()
+            entry = self._index.get(key)
+            if entry is None or entry[3] < min_mtime:
+                return None
+            try:
+                return self._view(entry[0], entry[1], entry[2])
+            except (FileNotFoundError, ValueError):
+                # Compacted by another process since our last refresh
+                self._refresh()
+                entry = self._index.get(key)
+                if entry is None or entry[3] < min_mtime:
+                    return None
+                return self._view(entry[0], entry[1], entry[2])
+
+    def entries(self) -> Iterator[tuple[str, int]]:
+        """Iterate over all cached (key, size) pairs."""
+        with self._lock:
+            self._refresh()
+            return iter([(key, entry[2]) for key, entry in self._index.items()])
+
+    # -- writes --------------------------------------------------------------
+
+    def put(self, key: str, data: bytes) -> None:
+        """Append thumbnail bytes to the active segment and index them."""
+        raw_key = key.encode("utf-8")
+        stamp = time.time()
+        with self._lock, file_lock(self.directory / "pack.lock"):
+            self._refresh()
+            segment = max(self._last_segment, 1)
+            path = self._segment_path(self._generation, segment)
+            size = path.stat().st_size if path.exists() else 0
+            if size and size + _RECORD.size + len(raw_key) + len(data) > self.segment_bytes:
+                segment += 1
+                path = self._segment_path(self._generation, segment)
+                size = 0
+            with open(path, "ab") as f:
+                f.write(_RECORD.pack(_MAGIC, len(raw_key), len(data), stamp) + raw_key + data)
+            offset = size + _RECORD.size + len(raw_key)
+            self._append_log(f"P\t{key}\t{segment}\t{offset}\t{len(data)}\t{stamp}\n")
+            self._refresh()
+
+    def delete(self, key: str) -> None:
+        """Drop a key from the index; its bytes are reclaimed by ``compact``."""
+        with self._lock, file_lock(self.directory / "pack.lock"):
+            self._refresh()
+            if key not in self._index:
+                return
+            self._append_log(f"D\t{key}\n")
+            self._refresh()
+        if (
+            self.dead_bytes >= PACK_COMPACT_MIN_DEAD_BYTES
+            and self.dead_bytes > self.live_bytes
+        ):
+            self.compact()
+
+    def compact(self) -> int:
+        """Rewrite live entries into a new generation. Returns bytes reclaimed."""
+        with self._lock, file_lock(self.directory / "pack.lock"):
+            self._refresh()
+            old_generation = self._generation
+            reclaimed = self.dead_bytes
+            generation = old_generation + 1
+            segment, size = 1, 0
+            out = open(self._segment_path(generation, segment), "wb")
+            try:
+                with open(self._index_path(generation), "wb") as log:
+                    for key, (seg, offset, length, stamp) in self._index.items():
+                        raw_key = key.encode("utf-8")
+                        record = _RECORD.size + len(raw_key) + length
+                        if size and size + record > self.segment_bytes:
+                            out.close()
+                            segment, size = segment + 1, 0
+                            out = open(self._segment_path(generation, segment), "wb")
+                        out.write(_RECORD.pack(_MAGIC, len(raw_key), length, stamp) + raw_key)
+                        out.write(self._view(seg, offset, length))
+                        log.write(
+                            f"P\t{key}\t{segment}\t{size + _RECORD.size + len(raw_key)}"
+                            f"\t{length}\t{stamp}\n".encode("utf-8")
+                        )
+                        size += record
+            finally:
+                out.close()
+            tmp = self.directory / "CURRENT.tmp"
+            tmp.write_text(str(generation))
+            os.replace(tmp, self.directory / "CURRENT")
+            self._refresh()
+            stale = list(self.directory.glob(f"seg-{old_generation}-*.pack"))
+            stale.append(self._index_path(old_generation))
+            for p in stale:
+                try:
+                    p.unlink()
+                except OSError:
+                    # Still mapped elsewhere (Windows); the file is orphaned but harmless
+                    pass
+            return reclaimed
+
+
+_ACCESS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access);
+CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+INSERT OR IGNORE INTO counters (name, value) VALUES
+    ('bytes', 0), ('entries', 0), ('hits', 0), ('misses', 0), ('evictions', 0);
+CREATE TRIGGER IF NOT EXISTS entries_ai AFTER INSERT ON entries BEGIN
+    UPDATE counters SET value = value + NEW.size WHERE name = 'bytes';
+    UPDATE counters SET value = value + 1 WHERE name = 'entries';
+END;
+CREATE TRIGGER IF NOT EXISTS entries_ad AFTER DELETE ON entries BEGIN
+    UPDATE counters SET value = value - OLD.size WHERE name = 'bytes';
+    UPDATE counters SET value = value - 1 WHERE name = 'entries';
+END;
+CREATE TRIGGER IF NOT EXISTS entries_au AFTER UPDATE OF size ON entries BEGIN
+    UPDATE counters SET value = value + NEW.size - OLD.size WHERE name = 'bytes';
+END;
+"""
+
+
+class ThumbCache:
+    """Size-budgeted LRU cache on top of a store backend.
+
+    The access index (``.access.db`` next to the thumbnails) records size and
+    last access per key plus running totals, so eviction picks victims with an
+    indexed query instead of walking the directory. Hit/miss/eviction counters
+    live in the same file and are shared by all worker processes.
+    """
+
+    def __init__(
+        self,
+        backend: Union[FileThumbStore, PackThumbStore],
+        index_path: Path,
+        budget: int = THUMB_CACHE_BYTES,
+    ):
+        self.backend = backend
+        self.budget = budget
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(index_path), timeout=10, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_ACCESS_SCHEMA)
+        # Access times and counters buffered by lookups; a background thread
+        # writes them out so requests never wait on .access.db
+        self._pending_lock = threading.Lock()
+        self._touched: dict[str, float] = {}
+        self._hits = self._misses = 0
+        self._flush_wanted = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+        if not self._counter("entries"):
+            self.rebuild()
+
+    @property
+    def directory(self) -> Path:
+        return self.backend.directory
+
+    def _counter(self, name: str) -> int:
+        # The connection is shared with the flusher thread: callers hold the
+        # lock (or are still in __init__)
+        return self._db.execute("SELECT value FROM counters WHERE name = ?", (name,)).fetchone()[0]
+
+    # -- store interface -----------------------------------------------------
+
+    def get(self, key: str, min_mtime: float = 0.0) -> Optional[ThumbHit]:
+        """Raw lookup without touching statistics."""
+        return self.backend.get(key, min_mtime)
+
+    def lookup(self, key: str, min_mtime: float = 0.0) -> Optional[ThumbHit]:
+        """Lookup on behalf of a client: counts the hit or miss and records access."""
+        hit = self.backend.get(key, min_mtime)
+        with self._pending_lock:
+            if hit is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+                self._touched[key] = time.time()
+            if self._flusher is None:
+                self._flusher = threading.Thread(
+                    target=self._flush_loop, name="thumb-access", daemon=True
+                )
+                self._flusher.start()
+            if len(self._touched) >= ACCESS_FLUSH_ENTRIES:
+                self._flush_wanted.set()
+        return hit
+
+    def put(self, key: str, data: bytes) -> None:
+        """Store bytes, index them and evict if the budget is exceeded."""
+        self.backend.put(key, data)
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT INTO entries (key, size, last_access) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET size = excluded.size, "
+                "last_access = excluded.last_access",
+                (key, len(data), time.time()),
+            )
+            total = self._counter("bytes")
+        if self.budget and total > self.budget:
+            self.evict()
+
+    def delete(self, key: str) -> None:
+        """Remove a key from the backend and the index."""
+        self.backend.delete(key)
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def purge_prefix(self, prefix: str) -> int:
+        """Delete every derivative whose key starts with ``prefix``."""
+        pattern = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        with self._lock:
+            keys = [
+                row[0]
+                for row in self._db.execute(
+                    "SELECT key FROM entries WHERE key LIKE ? ESCAPE '\\'", (pattern,)
+                )
+            ]
+        for key in keys:
+            self.delete(key)
+        return len(keys)
+
+    # -- bookkeeping ---------------------------------------------------------
+
+    def _flush_loop(self) -> None:
+        while True:
+            self._flush_wanted.wait(ACCESS_FLUSH_SECONDS)
+            self._flush_wanted.clear()
+            try:
+                with self._lock:
+                    self._flush()
+            except sqlite3.Error:
+                pass  # a lost batch only leaves LRU order and hit counts a little stale
+
+    def _flush(self) -> None:
+        """Write buffered access times and counters (caller holds the lock)."""
+        with self._pending_lock:
+            touched, hits, misses = self._touched, self._hits, self._misses
+            self._touched = {}
+            self._hits = self._misses = 0
+        if not (touched or hits or misses):
+            return
+        with self._db:
+            self._db.executemany(
+                "UPDATE entries SET last_access = ? WHERE key = ?",
+                [(ts, key) for key, ts in touched.items()],
+            )
+            self._db.execute("UPDATE counters SET value = value + ? WHERE name = 'hits'", (hits,))
+            self._db.execute(
+                "UPDATE counters SET value = value + ? WHERE name = 'misses'", (misses,)
+            )
+
+    def evict(self) -> int:
+        """Drop least recently used entries until under the low-water mark."""
+        with self._lock:
+            self._flush()
+            excess = self._counter("bytes") - int(self.budget * THUMB_CACHE_LOW_WATER)
+            victims = []
+            for key, size in self._db.execute(
+                "SELECT key, size FROM entries ORDER BY last_access"
+            ):
+                if excess <= 0:
+                    break
+                victims.append(key)
+                excess -= size
+        for key in victims:
+            self.delete(key)
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE counters SET value = value + ? WHERE name = 'evictions'",
+                (len(victims),),
+            )
+        return len(victims)
+
+    def rebuild(self) -> int:
+        """Re-create the access index from what the backend actually holds."""
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM entries")
+            self._db.executemany(
+                "INSERT INTO entries (key, size, last_access) VALUES (?, ?, ?)",
+                ((key, size, now) for key, size in self.backend.entries()),
+            )
+            return self._counter("entries")
+
+    def stats(self) -> dict:
+        """Cache size and hit/miss/eviction counters across all processes."""
+        with self._lock:
+            self._flush()
+            counters = dict(self._db.execute("SELECT name, value FROM counters"))
+        counters["budget"] = self.budget
+        return counters
+
+
+_stores: dict[str, ThumbCache] = {}
+_stores_lock = threading.Lock()
+
+
+def get_thumb_store(root: Path) -> ThumbCache:
+    """Return the configured thumbnail cache for a vault root (one per process)."""
+    thumb_dir = root / DEFAULT_THUMB_DIRNAME
+    with _stores_lock:
+        store = _stores.get(str(thumb_dir))
+        if store is None:
+            if THUMB_STORE == "pack":
+                backend = PackThumbStore(thumb_dir / PACK_DIRNAME)
+            else:
+                backend = FileThumbStore(thumb_dir)
+            store = ThumbCache(backend, thumb_dir / ACCESS_INDEX_NAME)
+            _stores[str(thumb_dir)] = store
+        return store
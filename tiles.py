@@ -0,0 +1,123 @@
+"""Deep Zoom (DZI) tile pyramids for very large images.
+
+Level ``max_level`` is the full-resolution image and every level below it is
+half the size of the next, rounded up, down to a single pixel at level 0.
+Each level is cut into square tiles without overlap. Tiles are rendered on
+demand by the thumbnail pool and cached like any other derivative, so only
+the parts of an image that are actually viewed get encoded.
+"""
+import math
+import os
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+from PIL import Image as PILImage, ImageOps
+
+from thumbnails import (
+    PREVIEW_SIZE,
+    SUPPORTED_FORMATS,
+    THUMB_FORMATS,
+    encode_image,
+    ensure_cached,
+    thumb_variant,
+)
+from thumbstore import get_thumb_store
+
+# Configuration
+TILES_ENABLED = os.environ.get("VAULT_DEEP_ZOOM", "1") != "0"
+TILE_SIZE = 256
+# One format for the whole pyramid, since the descriptor names it
+TILE_FORMAT = "webp" if "webp" in SUPPORTED_FORMATS else "jpeg"
+# Only images larger than the detail-page preview get a pyramid
+TILES_MIN_EDGE = PREVIEW_SIZE
+# Decoded sources kept per worker process; a full-resolution 8K image is ~200 MB
+TILE_DECODE_CACHE = 1
+
+# (src, mtime) -> {level: image}, most recently used last
+_decoded: "OrderedDict[tuple[str, float], dict[int, PILImage.Image]]" = OrderedDict()
+
+
+def deep_zoom_available(width: Optional[int], height: Optional[int]) -> bool:
+    """Whether an image of this size is worth a tile pyramid."""
+    return TILES_ENABLED and max(width or 0, height or 0) > TILES_MIN_EDGE
+
+
+def max_level(width: int, height: int) -> int:
+    """Index of the full-resolution level."""
+    return max(math.ceil(math.log2(max(width, height, 1))), 0)
+
+
+def level_size(width: int, height: int, level: int) -> tuple[int, int]:
+    """Pixel size of a pyramid level."""
+    scale = 2 ** (max_level(width, height) - level)
+    return math.ceil(width / scale), math.ceil(height / scale)
+
+
+def tile_grid(width: int, height: int, level: int) -> tuple[int, int]:
+    """Number of (columns, rows) of tiles at a level."""
+    w, h = level_size(width, height, level)
+    return math.ceil(w / TILE_SIZE), math.ceil(h / TILE_SIZE)
+
+
+def dzi_descriptor(width: int, height: int) -> str:
+    """The ``.dzi`` XML document describing the pyramid."""
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" '
+        f'TileSize="{TILE_SIZE}" Overlap="0" Format="{THUMB_FORMATS[TILE_FORMAT][2][1:]}">'
+        f'<Size Width="{width}" Height="{height}"/></Image>'
+    )
+
+
+def tile_variant(level: int, col: int, row: int) -> str:
+    """Variant name of a tile, kept apart from thumbnail widths."""
+    return f"t{level}-{col}-{row}"
+
+
+def _level_image(src: Path, src_mtime: float, level: int) -> PILImage.Image:
+    """Decode ``src`` once per worker and derive pyramid levels by halving."""
+    cache_key = (str(src), src_mtime)
+    levels = _decoded.get(cache_key)
+    if levels is None:
+        full = ImageOps.exif_transpose(PILImage.open(src)).convert("RGB")
+        levels = {max_level(*full.size): full}
+        _decoded[cache_key] = levels
+        while len(_decoded) > TILE_DECODE_CACHE:
+            _decoded.popitem(last=False)
+    _decoded.move_to_end(cache_key)
+    if not 0 <= level <= max(levels):
+        raise ValueError(f"No level {level} in this image")
+    # Ceil-rounding halvings give exactly the DZI level sizes
+    current = min(l for l in levels if l >= level)
+    while current > level:
+        levels[current - 1] = levels[current].reduce(2)
+        current -= 1
+    return levels[level]
+
+
+def render_tile(src: Path, src_mtime: float, level: int, col: int, row: int, fmt: str) -> bytes:
+    """Cut and encode one tile."""
+    im = _level_image(src, src_mtime, level)
+    left, top = col * TILE_SIZE, row * TILE_SIZE
+    if left >= im.width or top >= im.height:
+        raise ValueError("Tile is outside the level")
+    box = (left, top, min(left + TILE_SIZE, im.width), min(top + TILE_SIZE, im.height))
+    return encode_image(im.crop(box), fmt)
+
+
+def generate_tile(
+    root: Path,
+    image_id: int,
+    content_hash: Optional[str],
+    src: Path,
+    src_mtime: float,
+    address: tuple[int, int, int],
+    fmt: str,
+) -> str:
+    """Process-pool entry point: cache the tile at ``address`` (level, col, row)."""
+    key, min_mtime = thumb_variant(image_id, content_hash, src_mtime, tile_variant(*address), fmt)
+    ensure_cached(
+        get_thumb_store(root), key, min_mtime, lambda: render_tile(src, src_mtime, *address, fmt)
+    )
+    return fmt
@@ -1,7 +1,20 @@
 """Utility functions."""
+import mimetypes
+import os
+import time
+from contextlib import contextmanager
 from pathlib import Path
+from typing import Optional
+from urllib.parse import quote
 
 from fastapi import HTTPException
+from fastapi.responses import FileResponse, Response
+
+# Configuration
+# "x-accel-redirect" (nginx), "x-sendfile" (Apache, lighttpd) or empty to stream from Python
+SENDFILE_MODE = os.environ.get("VAULT_SENDFILE", "").strip().lower()
+# nginx internal location that maps onto the vault root
+ACCEL_PREFIX = "/" + os.environ.get("VAULT_ACCEL_PREFIX", "/_vault_files").strip("/") + "/"
 
 
 def resolve_under_root(root: Path, candidate: Path) -> Path:
@@ -9,4 +22,64 @@ def resolve_under_root(root: Path, candidate: Path) -> Path:
     real = candidate.resolve()
     if root not in real.parents and real != root:
         raise HTTPException(status_code=400, detail="Path is outside root")
-    return real
\ No newline at end of file
+    return real
+
+
+def proxy_sends_files() -> bool:
+    """True when ``send_file`` leaves the bytes to the reverse proxy."""
+    return SENDFILE_MODE in ("x-accel-redirect", "x-sendfile")
+
+
+def send_file(
+    path: Path, root: Path, media_type: Optional[str] = None, headers: Optional[dict] = None
+) -> Response:
+    """Serve a file that already passed ``resolve_under_root``.
+
+    With ``VAULT_SENDFILE`` set, only headers are returned and the reverse
+    proxy sends the bytes itself; otherwise Python streams the file.
+    """
+    if not proxy_sends_files():
+        return FileResponse(path, media_type=media_type, headers=headers)
+    headers = dict(headers or {})
+    if SENDFILE_MODE == "x-sendfile":
+        headers["X-Sendfile"] = str(path)
+    else:
+        try:
+            relative = path.relative_to(root)
+        except ValueError:
+            return FileResponse(path, media_type=media_type, headers=headers)
+        headers["X-Accel-Redirect"] = ACCEL_PREFIX + quote(relative.as_posix())
+    if media_type is None:
+        media_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+    return Response(media_type=media_type, headers=headers)
+
+
+@contextmanager
+def file_lock(path: Path):
+    """Hold an exclusive lock on ``path`` that is shared across processes."""
+    path.parent.mkdir(exist_ok=True)
+    with open(path, "a+b") as f:
+        if os.name == "nt":
+            import msvcrt
+
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK gives up after ~10s; keep waiting like flock does
+                    time.sleep(0.05)
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
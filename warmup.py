@@ -0,0 +1,237 @@
+"""Background thumbnail warm-up.
+
+Pre-generates the grid and dashboard thumbnails (with page atlases on, the
+thumbnails their cells are cut from) so the first visit to a folder does not
+wait on the decoder. Work goes through the shared
+thumbnail pool at the lowest priority and is only submitted while the pool is
+idle, so interactive requests always come first. Progress is kept in the
+settings table, which lets the job resume where it stopped after a restart.
+"""
+import asyncio
+import json
+import os
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func
+from sqlmodel import select
+
+from atlas import ATLAS_ENABLED, atlas_cell_width
+from database import get_read_session, get_setting, set_setting
+from models import Image, ImageTagLink, Tag
+from thumbnails import (
+    GRID_THUMB_WIDTH,
+    generate_thumbnail,
+    negotiate_format,
+    source_hash,
+    thumb_variant,
+)
+from thumbpool import QueueFull, thumb_pool
+from thumbstore import get_thumb_store
+from utils import resolve_under_root
+
+# Configuration
+WARMUP_ENABLED = os.environ.get("VAULT_WARMUP", "1") != "0"
+WARMUP_DASHBOARD_WIDTH = 150  # templates/dashboard.html
+# What a current browser negotiates (AVIF when Pillow can encode it, else WebP)
+WARMUP_FORMATS = (negotiate_format("image/avif,image/webp,*/*"),)
+WARMUP_WORKFLOW_TAGS = ["Needs Inpainting", "Ready For i2v", "Ready for Upscale"]
+WARMUP_NEWEST_DAYS = 7
+WARMUP_BATCH = 50
+WARMUP_PRIORITY = -1.0  # below any page view
+WARMUP_IDLE_POLL_SECONDS = 0.5
+WARMUP_CURSOR_SETTING = "warmup_cursor"  # one of migrations.UNSTAMPED_SETTINGS
+
+# Tiers in the order they are warmed; each is walked by descending id
+WARMUP_TIERS = ("newest", "workflow", "rest")
+
+
+def _warmup_sizes(width: Optional[int], height: Optional[int]) -> tuple[int, ...]:
+    """Thumbnail widths warmed for one image: its grid (or atlas cell) one and the dashboard's."""
+    grid = atlas_cell_width(width, height) if ATLAS_ENABLED else GRID_THUMB_WIDTH
+    return grid, WARMUP_DASHBOARD_WIDTH
+
+
+def _tier_query(tier: str, before: Optional[int]):
+    """Images of one tier below id ``before``; tiers do not overlap."""
+    stmt = select(
+        Image.id, Image.path, Image.mtime, Image.file_hash, Image.width, Image.height
+    ).order_by(Image.id.desc())
+    since = datetime.utcnow() - timedelta(days=WARMUP_NEWEST_DAYS)
+    tagged = (
+        select(ImageTagLink.image_id)
+        .join(Tag, Tag.id == ImageTagLink.tag_id)
+        .where(Tag.name.in_(WARMUP_WORKFLOW_TAGS))
+    )
+    if tier == "newest":
+        stmt = stmt.where(Image.created_at >= since)
+    elif tier == "workflow":
+        stmt = stmt.where(Image.created_at < since, Image.id.in_(tagged))
+    else:
+        stmt = stmt.where(Image.created_at < since, Image.id.not_in(tagged))
+    if before is not None:
+        stmt = stmt.where(Image.id < before)
+    return stmt
+
+
+class _Batch(NamedTuple):
+    root: Optional[Path]  # None: no usable vault root
+    images: int
+    last_id: Optional[int]
+    # (cache key, generate_thumbnail arguments after the root) of each missing thumbnail
+    missing: list[tuple]
+    skipped: int  # thumbnails already cached or without a readable source
+
+
+class WarmupJob:
+    """Resumable, idle-priority thumbnail pre-generation."""
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self._restart_requested = False
+        self.status = {
+            "state": "idle",
+            "tier": None,
+            "processed": 0,
+            "total": 0,
+            "generated": 0,
+            "skipped": 0,
+            "failed": 0,
+        }
+
+    def start(self) -> None:
+        """Start (or resume) the job unless it is already running."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def restart(self) -> None:
+        """Forget the saved position (e.g. after a scan added images) and start over.
+
+        Must be called on the event loop; a running job picks the reset up at
+        its next batch, a finished one is started again.
+        """
+        self._restart_requested = True
+        if WARMUP_ENABLED:
+            self.start()
+
+    async def stop(self) -> None:
+        """Cancel the job; its position is already saved."""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def _load_cursor(self) -> tuple[int, Optional[int]]:
+        try:
+            cursor = json.loads(get_setting(WARMUP_CURSOR_SETTING) or "{}")
+            return WARMUP_TIERS.index(cursor["tier"]), cursor.get("before")
+        except (ValueError, KeyError):
+            return 0, None
+
+    def _save_cursor(self, tier: str, before: Optional[int]) -> None:
+        set_setting(WARMUP_CURSOR_SETTING, json.dumps({"tier": tier, "before": before}))
+
+    def _next_batch(self, tier: str, before: Optional[int]) -> _Batch:
+        """Load the next images of a tier and find their missing thumbnails.
+
+        Runs in the threadpool: it resolves and stats every source file and
+        checks the cache for each variant.
+        """
+        root = get_setting("root_dir")
+        if not root or not Path(root).is_dir():
+            return _Batch(None, 0, None, [], 0)
+        root = Path(root)
+        with get_read_session() as s:
+            rows = s.exec(_tier_query(tier, before).limit(WARMUP_BATCH)).all()
+        store = get_thumb_store(root)
+        missing, skipped = [], 0
+        for image_id, path, mtime, file_hash, width, height in rows:
+            sizes = _warmup_sizes(width, height)
+            try:
+                src = resolve_under_root(root, Path(path))
+                src_mtime = src.stat().st_mtime
+            except (HTTPException, OSError):
+                skipped += len(sizes) * len(WARMUP_FORMATS)
+                continue
+            content_hash = source_hash(file_hash, mtime, src_mtime)
+            for w in sizes:
+                for fmt in WARMUP_FORMATS:
+                    key, min_mtime = thumb_variant(image_id, content_hash, src_mtime, w, fmt)
+                    if store.get(key, min_mtime) is not None:
+                        skipped += 1
+                    else:
+                        missing.append((key, (image_id, content_hash, src, src_mtime, w, fmt)))
+        return _Batch(root, len(rows), rows[-1][0] if rows else None, missing, skipped)
+
+    def _count(self) -> int:
+        with get_read_session() as s:
+            return s.exec(select(func.count()).select_from(Image)).one()
+
+    async def _run(self) -> None:
+        while True:
+            if self._restart_requested:
+                self._restart_requested = False
+                await run_in_threadpool(set_setting, WARMUP_CURSOR_SETTING, "")
+            self.status.update(state="running", processed=0, generated=0, skipped=0, failed=0)
+            self.status["total"] = await run_in_threadpool(self._count)
+            if await self._walk() and not self._restart_requested:
+                break
+
+    async def _walk(self) -> bool:
+        """Warm tiers from the saved cursor; False if a restart interrupted it."""
+        start_tier, before = await run_in_threadpool(self._load_cursor)
+        in_flight: set[asyncio.Task] = set()
+        try:
+            for tier in WARMUP_TIERS[start_tier:]:
+                self.status["tier"] = tier
+                while True:
+                    if self._restart_requested:
+                        return False
+                    batch = await run_in_threadpool(self._next_batch, tier, before)
+                    if batch.root is None:
+                        # No usable vault root; keep the cursor for when there is one
+                        if in_flight:
+                            await asyncio.wait(in_flight)
+                        self.status.update(state="idle", tier=None)
+                        return True
+                    if not batch.images:
+                        break
+                    self.status["skipped"] += batch.skipped
+                    for key, args in batch.missing:
+                        # Only feed the pool when interactive work leaves it idle
+                        while not thumb_pool.idle or len(in_flight) >= thumb_pool.workers:
+                            await asyncio.sleep(WARMUP_IDLE_POLL_SECONDS)
+                            in_flight = {t for t in in_flight if not t.done()}
+                        in_flight.add(asyncio.create_task(self._generate(key, batch.root, *args)))
+                    self.status["processed"] += batch.images
+                    before = batch.last_id
+                    await run_in_threadpool(self._save_cursor, tier, before)
+                before = None
+            if in_flight:
+                await asyncio.wait(in_flight)
+            await run_in_threadpool(self._save_cursor, WARMUP_TIERS[-1], 0)
+            self.status.update(state="done", tier=None)
+            return True
+        except asyncio.CancelledError:
+            self.status["state"] = "stopped"
+            raise
+
+    async def _generate(self, key, root, image_id, content_hash, src, src_mtime, w, fmt) -> None:
+        try:
+            await thumb_pool.run(
+                key, generate_thumbnail, root, image_id, content_hash, src, src_mtime, w, fmt,
+                priority=WARMUP_PRIORITY,
+            )
+            self.status["generated"] += 1
+        except QueueFull:
+            self.status["skipped"] += 1
+        except Exception:
+            self.status["failed"] += 1
+
+
+warmup_job = WarmupJob()